@@ -0,0 +1,319 @@
+#!/usr/bin/env python3
+"""
+artifactory-request.log 历史数据回填:
+exporter 启动时从日志末尾开始读取，首次部署或异常重启之前的请求没有指标。
+本脚本批量回放已有的 artifactory-request.log 及轮转后的 .log / .log.gz 文件，
+按第 0 列的时间戳把请求归入 WINDOW_SIZE 秒的时间桶，输出 OpenMetrics 文本，
+再用 promtool 生成 Prometheus 数据块:
+
+python3 artifactory_request_backfill.py -o backfill.om --label instance=192.168.139.212:8002 \\
+    /var/opt/jfrog/artifactory/log/artifactory-request.log \\
+    /var/opt/jfrog/artifactory/log/archived/artifactory-request.*.log.gz
+promtool tsdb create-blocks-from openmetrics backfill.om /path/to/prometheus/data
+
+默认的输入包含仍在写入的 artifactory-request.log，exporter 运行期间这部分请求已经以相同的 instance/job 标签
+计入了指标；--end 之后的请求不回填（默认为当前时间前 END_OFFSET 秒，应设为 exporter 的启动时间），避免两者重叠。
+
+每个文件由一个工作进程解析（解析逻辑与 exporter 的批量模式相同）；时间桶超过 SPILL_BUCKETS 个时
+按时间顺序写入临时文件，最后多路归并输出，内存占用与日志文件大小无关。
+"""
+
+import argparse
+import bisect
+import calendar
+import glob
+import gzip
+import heapq
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from artifactory_request_exporter import (
+    HISTOGRAM_BUCKET_COUNT, HISTOGRAM_BUCKET_FACTOR, HISTOGRAM_BUCKET_START,
+    LATENCY_TIERS, LOG_FILE, READ_CHUNK_SIZE, WINDOW_SIZE, latency_tier, parse_request_lines
+)
+
+# ========== Configuration ==========
+DEFAULT_LABELS = {'job': 'artifactory_request_exporter', 'service': 'artifactory'}  # 与 Dashboard 查询中的 job、exporter 输出的 service 标签一致
+END_OFFSET = 3 * 3600  # 未指定 --end 时回填到当前时间前多少秒，之后的请求由运行中的 exporter 统计
+SPILL_BUCKETS = 20000  # 单个工作进程内存中最多保留的时间桶数，超过后写入临时文件
+# ===================================
+
+# 时间桶数组布局：请求数、上传/下载字节、耗时总和 (ms)、各耗时分层、直方图各桶 (最后一个为 +Inf)
+HISTOGRAM_BOUNDS = [round(HISTOGRAM_BUCKET_START * HISTOGRAM_BUCKET_FACTOR ** i, 6) for i in range(HISTOGRAM_BUCKET_COUNT)]
+HISTOGRAM_BOUNDS_MS = [b * 1000 for b in HISTOGRAM_BOUNDS]
+COL_REQUESTS, COL_UPLOAD, COL_DOWNLOAD, COL_DURATION = 0, 1, 2, 3
+COL_TIERS = {tier: 4 + i for i, tier in enumerate(LATENCY_TIERS)}
+COL_HISTOGRAM = 4 + len(LATENCY_TIERS)
+ROW_WIDTH = COL_HISTOGRAM + HISTOGRAM_BUCKET_COUNT + 1
+
+def open_log(path):
+    return gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')
+
+def bucket_of(prefix: bytes, step):
+    """第 0 列形如 2026-10-18T08:00:00.123Z (UTC)，只取到秒的前 19 个字符"""
+    try:
+        return calendar.timegm(time.strptime(prefix.decode('ascii'), '%Y-%m-%dT%H:%M:%S')) // step
+    except (UnicodeDecodeError, ValueError):
+        return None
+
+def parse_end(value):
+    """--end: Unix 时间戳（秒）或 UTC 时间 2026-10-18T08:00:00"""
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    try:
+        return calendar.timegm(time.strptime(value.rstrip('Z'), '%Y-%m-%dT%H:%M:%S'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'invalid time: {value}')
+
+def add_lines(buckets, bucket, lines):
+    """把同一时间桶内的日志行按 exporter 的批量解析规则累加到该桶"""
+    batch = parse_request_lines(lines)
+    if not batch.total:
+        return
+    entry = buckets.get(bucket)
+    if entry is None:
+        entry = buckets[bucket] = ([0] * ROW_WIDTH, {})
+    row, codes = entry
+    row[COL_REQUESTS] += batch.total
+    row[COL_UPLOAD] += batch.upload_bytes
+    row[COL_DOWNLOAD] += batch.download_bytes
+    for code, n in batch.status_counts.items():
+        code = code.strip().decode('ascii', 'ignore')
+        codes[code] = codes.get(code, 0) + n
+    for d, n in batch.duration_counts.items():
+        row[COL_TIERS[latency_tier(d)]] += n
+        row[COL_HISTOGRAM + bisect.bisect_left(HISTOGRAM_BOUNDS_MS, d)] += n
+        if d > 0:
+            row[COL_DURATION] += d * n
+
+def spill(buckets, tmp_dir):
+    """按时间顺序把内存中的时间桶写入一个临时文件（每行一个 JSON 数组: [桶, 数组, 状态码计数]）"""
+    fd, path = tempfile.mkstemp(suffix='.run', dir=tmp_dir)
+    with os.fdopen(fd, 'w') as f:
+        for bucket in sorted(buckets):
+            row, codes = buckets[bucket]
+            f.write(json.dumps([bucket, row, codes]) + '\n')
+    buckets.clear()
+    return path
+
+def process_file(path, step, end_bucket, tmp_dir):
+    """工作进程：解析一个日志文件，只保留 end_bucket 之前的时间桶；
+    返回 (临时文件列表, 行数, 无法识别时间戳的行数, 晚于 --end 的行数)"""
+    runs = []
+    buckets = {}
+    prefixes = {}  # 到秒的时间戳前缀 -> 时间桶，同一秒内的行只解析一次时间
+    lines_read = skipped = late = 0
+    pending = b''
+    with open_log(path) as f:
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if pending:
+                chunk = pending + chunk
+            if not chunk:
+                break
+            lines = chunk.split(b'\n')
+            # 读到文件末尾时 chunk 只剩上次未完整的行，即没有换行符的最后一行，直接处理
+            pending = lines.pop() if len(chunk) > len(pending) else b''
+
+            groups = {}
+            for line in lines:
+                prefix = line[:19]
+                bucket = prefixes.get(prefix)
+                if bucket is None:
+                    if len(prefixes) > 100000:
+                        prefixes.clear()
+                    bucket = prefixes[prefix] = bucket_of(prefix, step)
+                group = groups.get(bucket)
+                if group is None:
+                    groups[bucket] = [line]
+                else:
+                    group.append(line)
+            lines_read += len(lines)
+            skipped += len(groups.pop(None, ()))
+            for bucket, group in groups.items():
+                if bucket >= end_bucket:
+                    late += len(group)
+                else:
+                    add_lines(buckets, bucket, group)
+            if len(buckets) > SPILL_BUCKETS:
+                runs.append(spill(buckets, tmp_dir))
+    if buckets:
+        runs.append(spill(buckets, tmp_dir))
+    return runs, lines_read, skipped, late
+
+def read_run(path):
+    with open(path) as f:
+        for line in f:
+            yield json.loads(line)
+
+def merge_runs(runs, tmp_dir):
+    """多路归并所有临时文件，同一时间桶的数据相加；返回 (合并后的文件, 出现过的状态码)"""
+    fd, path = tempfile.mkstemp(suffix='.merged', dir=tmp_dir)
+    all_codes = set()
+    with os.fdopen(fd, 'w') as out:
+        current = None
+        for bucket, row, codes in heapq.merge(*(read_run(r) for r in runs), key=lambda r: r[0]):
+            if current is not None and current[0] == bucket:
+                current[1] = [a + b for a, b in zip(current[1], row)]
+                for code, n in codes.items():
+                    current[2][code] = current[2].get(code, 0) + n
+                continue
+            if current is not None:
+                out.write(json.dumps(current) + '\n')
+            current = [bucket, row, codes]
+            all_codes.update(codes)
+        if current is not None:
+            out.write(json.dumps(current) + '\n')
+    return path, sorted(all_codes)
+
+def iter_buckets(merged, step):
+    """按时间顺序遍历合并后的时间桶，中间没有请求的桶补 0；样本时间戳为桶的结束时间 (秒)"""
+    previous = None
+    for bucket, row, codes in read_run(merged):
+        if previous is not None:
+            for empty in range(previous + 1, bucket):
+                yield (empty + 1) * step, [0] * ROW_WIDTH, {}
+        previous = bucket
+        yield (bucket + 1) * step, row, codes
+
+def write_openmetrics(out, merged, codes, step, labels):
+    """
+    OpenMetrics 要求同一族的样本连续、同一时间序列的样本按时间顺序连续，
+    因此每个时间序列（直方图为每个族）单独遍历一遍合并后的文件。
+    Gauge 与 exporter 的同名指标含义一致（一个 WINDOW_SIZE 窗口内的值），
+    Counter / Histogram 为从回填起点开始的累计值。
+    """
+    extra = ''.join(f',{k}="{v}"' for k, v in sorted(labels.items()))
+    base = f'{{{extra[1:]}}}' if extra else ''
+
+    def points(cumulative):
+        """遍历时间桶；cumulative 时返回到该桶为止的累计值"""
+        if not cumulative:
+            yield from iter_buckets(merged, step)
+            return
+        totals = [0] * ROW_WIDTH
+        code_totals = dict.fromkeys(codes, 0)
+        for ts, row, row_codes in iter_buckets(merged, step):
+            for i, v in enumerate(row):
+                totals[i] += v
+            for code, n in row_codes.items():
+                code_totals[code] += n
+            yield ts, totals, code_totals
+
+    def family(name, kind, help_text, series, cumulative=False):
+        """series: [(样本名及标签, value(row, codes))]"""
+        out.write(f'# HELP {name} {help_text}\n# TYPE {name} {kind}\n')
+        for sample, value in series:
+            for ts, row, row_codes in points(cumulative):
+                out.write(f'{sample} {value(row, row_codes)} {ts}\n')
+
+    def column(col):
+        return lambda row, c: row[col]
+
+    def code_count(code):
+        return lambda row, c: c.get(code, 0)
+
+    def traffic(name):
+        return [(f'{name}{{direction="upload"{extra}}}', column(COL_UPLOAD)),
+                (f'{name}{{direction="download"{extra}}}', column(COL_DOWNLOAD))]
+
+    # 1. 窗口内的值 (Gauge)
+    family('artifactory_status_codes_total', 'gauge', f'Requests in last {step}s window',
+           [(f'artifactory_status_codes_total{{code="{code}"{extra}}}', code_count(code)) for code in codes])
+    family('artifactory_request_duration_seconds', 'gauge', f'Request count by duration tier in last {step}s',
+           [(f'artifactory_request_duration_seconds{{tier="{tier}"{extra}}}', column(COL_TIERS[tier]))
+            for tier in LATENCY_TIERS])
+    family('artifactory_traffic_bytes', 'gauge', f'Traffic in last {step}s window', traffic('artifactory_traffic_bytes'))
+    family('artifactory_requests_in_window', 'gauge', f'Total requests in current {step}s window',
+           [(f'artifactory_requests_in_window{base}', column(COL_REQUESTS))])
+
+    # 2. 累计值 (Counter / Histogram)，OpenMetrics 中 counter 的族名不带 _total
+    family('artifactory_requests', 'counter', 'Cumulative total requests since backfill start',
+           [(f'artifactory_requests_total{base}', column(COL_REQUESTS))], cumulative=True)
+    family('artifactory_requests_by_code', 'counter', 'Cumulative requests by status code since backfill start',
+           [(f'artifactory_requests_by_code_total{{code="{code}"{extra}}}', code_count(code)) for code in codes],
+           cumulative=True)
+    family('artifactory_requests_by_tier', 'counter', 'Cumulative requests by duration tier since backfill start',
+           [(f'artifactory_requests_by_tier_total{{tier="{tier}"{extra}}}', column(COL_TIERS[tier]))
+            for tier in LATENCY_TIERS], cumulative=True)
+    # 去掉 _total 后与 Gauge artifactory_traffic_bytes 重名，与 exporter 的 OpenMetrics 输出一样声明为 unknown
+    family('artifactory_traffic_bytes_total', 'unknown', 'Cumulative traffic since backfill start',
+           traffic('artifactory_traffic_bytes_total'), cumulative=True)
+
+    # 直方图的各个桶与 _sum/_count 属于同一个时间点，按时间逐点输出
+    name = 'artifactory_request_latency_seconds'
+    out.write(f'# HELP {name} Request latency histogram since backfill start\n# TYPE {name} histogram\n')
+    for ts, row, _ in points(cumulative=True):
+        count = 0
+        for i, bound in enumerate(HISTOGRAM_BOUNDS):
+            count += row[COL_HISTOGRAM + i]
+            out.write(f'{name}_bucket{{le="{bound}"{extra}}} {count} {ts}\n')
+        count += row[-1]
+        out.write(f'{name}_bucket{{le="+Inf"{extra}}} {count} {ts}\n')
+        out.write(f'{name}_sum{base} {row[COL_DURATION] / 1000} {ts}\n')
+        out.write(f'{name}_count{base} {count} {ts}\n')
+    out.write('# EOF\n')
+
+def default_files():
+    """当前日志，以及同目录和 archived/ 下轮转出的 artifactory-request.*.log / .log.gz"""
+    log_dir = os.path.dirname(LOG_FILE)
+    name = os.path.splitext(os.path.basename(LOG_FILE))[0]
+    files = []
+    for directory in (log_dir, os.path.join(log_dir, 'archived')):
+        for pattern in (f'{name}.log', f'{name}.*.log', f'{name}.*.log.gz', f'{name}-*.log.gz'):
+            files += glob.glob(os.path.join(directory, pattern))
+    return sorted(set(files))
+
+def main():
+    parser = argparse.ArgumentParser(description='Backfill Artifactory request metrics from existing logs')
+    parser.add_argument('files', nargs='*', help='日志文件 (.log / .log.gz)，默认为 LOG_FILE 及其轮转文件')
+    parser.add_argument('-o', '--output', default='artifactory_request_backfill.om', help='输出的 OpenMetrics 文件')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(), help='并行解析的进程数')
+    parser.add_argument('--step', type=int, default=WINDOW_SIZE, help='时间桶大小（秒），默认与 WINDOW_SIZE 一致')
+    parser.add_argument('--label', action='append', default=[], metavar='NAME=VALUE',
+                        help='附加到所有样本的标签，如 instance=192.168.139.212:8002，可重复')
+    parser.add_argument('--end', type=parse_end, default=int(time.time()) - END_OFFSET,
+                        help='只回填此时间之前的请求（Unix 时间戳或 UTC 时间 2026-10-18T08:00:00），'
+                             '应设为 exporter 的启动时间；默认为当前时间前 END_OFFSET 秒')
+    args = parser.parse_args()
+
+    labels = dict(DEFAULT_LABELS)
+    for item in args.label:
+        name, _, value = item.partition('=')
+        labels[name] = value
+    files = args.files or default_files()
+    if not files:
+        parser.error('no log files found')
+
+    # 最后一个时间桶必须在 --end 之前结束，样本时间戳为桶的结束时间
+    end_bucket = args.end // args.step
+    start = time.perf_counter()
+    total_lines = total_skipped = total_late = 0
+    with tempfile.TemporaryDirectory(prefix='artifactory_backfill_') as tmp_dir:
+        runs = []
+        with ProcessPoolExecutor(max_workers=max(1, min(args.workers, len(files)))) as pool:
+            futures = {pool.submit(process_file, path, args.step, end_bucket, tmp_dir): path for path in files}
+            for future, path in futures.items():
+                file_runs, lines, skipped, late = future.result()
+                runs += file_runs
+                total_lines += lines
+                total_skipped += skipped
+                total_late += late
+                print(f"{path}: {lines} lines" + (f", {skipped} without timestamp" if skipped else '')
+                      + (f", {late} after --end" if late else ''))
+        merged, codes = merge_runs(runs, tmp_dir)
+        with open(args.output, 'w') as out:
+            write_openmetrics(out, merged, codes, args.step, labels)
+
+    end_time = time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(end_bucket * args.step))
+    print(f"{total_lines} lines from {len(files)} files in {time.perf_counter() - start:.1f}s -> {args.output}"
+          f" (up to {end_time}, {total_late} later lines skipped)")
+    print(f"promtool tsdb create-blocks-from openmetrics {args.output} <prometheus data dir>")
+
+if __name__ == "__main__":
+    main()
@@ -6,20 +6,113 @@ nohup python3 artifactory_request_exporter.py &
 
 Change log:
 2026.1.28 - Optimized that after log rotation, changes in the inode of artifactory-request.log prevent the script from continuing to retrieve metrics.
+2026.10.18 - Batched ingest: read the log in large byte chunks, parse only the needed fields and apply one aggregated delta per batch under a single lock.
+2026.10.18 - Replaced sleep polling with inotify-driven tailing (ctypes), with adaptive backoff polling as fallback.
+2026.10.18 - Lossless rotation: drain the old file before reopening, read the new file from offset 0, handle copytruncate, and resume from a persisted (inode, offset) checkpoint on restart.
+2026.10.18 - Added artifactory_request_latency_seconds histogram (log-scale buckets) and optional p50/p90/p99 from DDSketch-style per-window sketches merged over a sliding window.
+2026.10.18 - Optional per-repository breakdown (requests, status class, bytes, latency) with Space-Saving top-K tracking and an "_other" bucket.
+2026.10.18 - Sliding window stored as a ring of preallocated counter rows (O(1) rollover); retained windows exposed as 15s/1m/2.5m range aggregates.
+2026.10.18 - Added monotonic per-code/per-tier/per-direction counters for rate(), and timestamped values of the last completed window.
+2026.10.18 - /metrics served by a threaded HTTP/1.1 (keep-alive) server from a cached payload rebuilt only when data changes; gzip and OpenMetrics negotiated via Accept-Encoding/Accept.
+2026.10.18 - Self-instrumentation (artifactory_request_exporter_*): lines/bytes read, parse errors by reason, tail lag in bytes and seconds, rotations, lock wait and render duration.
+2026.10.18 - Overload mode: when the tailer falls behind (or exceeds a CPU budget) parse only 1-in-N lines and scale the counts by N; the sample rate is exported and returns to 1 once caught up.
+2026.10.18 - Per-window top-N slowest and largest requests (bounded min-heaps) served as JSON on /debug/slow.
+2026.10.18 - Per-request transfer throughput histogram by direction and size class, and per-window count of slow large transfers.
+2026.10.18 - Multiple request logs (LOG_SOURCES: artifactory/router/access/frontend, pipe or JSON field maps) tailed from one thread with a shared inotify watcher; all series carry a service label.
+2026.10.18 - FileWatcher, log timestamp parsing and ExporterStats moved to the shared jf_monitoring_node/scripts/log_tail.py (also used by the S3 exporter).
+2026.10.18 - (inode, offset) checkpoint handling moved to log_tail.TailPosition, shared with the S3 exporter's tailer.
 """
 
 import time
+import math
+import bisect
+import heapq
 import threading
-from collections import defaultdict, deque
+from collections import defaultdict
 import logging
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
 import json
 import os
+import sys
+
+try:
+    from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+except ImportError:
+    # 在仓库中直接运行时，共用模块位于 jf_monitoring_node/scripts/；部署时与本脚本放在同一目录
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jf_monitoring_node', 'scripts'))
+    from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+from log_tail import ExporterStats as BaseExporterStats, FileWatcher, TailPosition, log_time
 
 # ========== Configuration ==========
 LOG_FILE = '/var/opt/jfrog/artifactory/log/artifactory-request.log'
+# 需要跟踪的请求日志，所有日志在同一个线程内跟踪，指标带 service 标签；format 为 LOG_FORMATS 中的名称
+# 为 None 时只跟踪 LOG_FILE (service="artifactory")。例如同时对比 Router 入口与 Artifactory 的耗时:
+# LOG_SOURCES = [
+#     {'service': 'artifactory', 'path': LOG_FILE, 'format': 'jfrog'},
+#     {'service': 'router', 'path': '/var/opt/jfrog/artifactory/log/router-request.log', 'format': 'traefik'},
+#     {'service': 'access', 'path': '/var/opt/jfrog/artifactory/log/access-request.log', 'format': 'jfrog'},
+#     {'service': 'frontend', 'path': '/var/opt/jfrog/artifactory/log/frontend-request.log', 'format': 'jfrog'},
+# ]
+LOG_SOURCES = None
+# 请求日志格式：pipe 为 | 分隔，fields 为各字段的列号（耗时须为毫秒）；
+# json 为每行一个 JSON 对象，fields 为各字段的键名，duration_unit 为耗时字段每单位对应的毫秒数
+JFROG_FIELDS = {'timestamp': 0, 'trace_id': 1, 'method': 4, 'url': 5, 'status': 6, 'upload': 7, 'download': 8, 'duration': 9}
+LOG_FORMATS = {
+    # artifactory/access/frontend 等服务的 *-request.log:
+    # Timestamp|Trace ID|Remote Address|Username|Method|URL|Status|Request Content Length|Response Content Length|Duration (ms)|User Agent
+    'jfrog': {'type': 'pipe', 'fields': JFROG_FIELDS},
+    # Router (traefik) 的 router-request.log，Duration 为纳秒
+    'traefik': {'type': 'json', 'duration_unit': 1e-6, 'fields': {
+        'timestamp': 'StartUTC', 'trace_id': 'request_Uber-Trace-Id', 'method': 'RequestMethod', 'url': 'RequestPath',
+        'status': 'DownstreamStatus', 'upload': 'RequestContentSize', 'download': 'DownstreamContentSize', 'duration': 'Duration'}},
+}
 METRICS_PORT = 8002
 WINDOW_SIZE = 15  # 统计窗口大小（秒）
+HISTORY_WINDOWS = 10  # 保留的窗口个数，决定可聚合的最长时间范围 (WINDOW_SIZE * HISTORY_WINDOWS)
+AGGREGATION_RANGES = [15, 60, 150]  # 额外导出的聚合时间范围（秒），需 <= WINDOW_SIZE * HISTORY_WINDOWS
+LAST_WINDOW_TIMESTAMPS = True  # 导出上一个完整窗口的值，并带上窗口结束时间作为样本时间戳
+READ_CHUNK_SIZE = 1024 * 1024  # 每次读取的字节数，一个块内的所有行合并为一次更新
+STEP_CHUNKS = 8  # 跟踪多个日志时，每轮最多从一个文件读取的块数，其余留到下一轮
+POLL_MIN_INTERVAL = 0.01  # inotify 不可用时的最小轮询间隔（秒）
+POLL_MAX_INTERVAL = 1.0   # 日志空闲时退避到的最大轮询间隔（秒）
+# 读取位置检查点 (inode, offset)，重启后从上次停止处继续读取；置为 None 则不持久化
+CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.artifactory_request_exporter.checkpoint')
+CHECKPOINT_INTERVAL = 5  # 检查点最短写入间隔（秒）
+GZIP_MIN_SIZE = 1024  # 客户端支持 gzip 且输出超过此字节数时压缩
+
+# 过载保护：日志突发导致读取落后时只解析 1/N 的行，计数乘以 N 估算，追上后自动恢复逐行统计
+OVERLOAD_LAG_BYTES = 64 * 1024 * 1024  # 未读字节数超过此值时提高采样间隔 N；降到 1/4 以下时逐步恢复
+OVERLOAD_CPU_BUDGET = None  # 日志跟踪线程占用单核 CPU 的比例上限 (如 0.5)，超过时同样提高 N；None 表示不限制
+OVERLOAD_MAX_SAMPLE_RATE = 64  # N 的上限；置为 1 则关闭过载保护
+OVERLOAD_CHECK_INTERVAL = 1.0  # 调整采样间隔的最短间隔（秒）
+
+# 每个窗口内耗时最长、传输字节最多的请求各保留 SLOW_REQUESTS_TOP_N 条，通过 /debug/slow 以 JSON 查看；0 关闭
+SLOW_REQUESTS_TOP_N = 20
+
+# 耗时直方图：对数刻度的桶边界（秒），默认 0.005s 起每档翻倍，共 14 档 (最大 40.96s)
+HISTOGRAM_BUCKET_START = 0.005
+HISTOGRAM_BUCKET_FACTOR = 2
+HISTOGRAM_BUCKET_COUNT = 14
+# 耗时分位数，置为空元组则关闭；SKETCH_RELATIVE_ACCURACY 为分位数的相对误差
+LATENCY_QUANTILES = (0.5, 0.9, 0.99)
+SKETCH_RELATIVE_ACCURACY = 0.01
+QUANTILE_WINDOWS = 4  # 分位数按最近 N 个窗口（含当前窗口）合并计算，即滑动的 WINDOW_SIZE * N 秒
+
+# 单请求有效吞吐 (字节数 / 耗时) 直方图的桶边界（字节/秒），按方向和大小分档 (<1MB, 1-100MB, >=100MB) 统计；默认 64KB/s 起每档 x4
+THROUGHPUT_BUCKETS = [65536, 262144, 1048576, 4194304, 16777216, 67108864, 268435456]
+# 慢速大文件传输：字节数 >= SLOW_TRANSFER_MIN_BYTES 且吞吐低于 SLOW_TRANSFER_FLOOR（字节/秒），按窗口计数
+SLOW_TRANSFER_MIN_BYTES = 100 * 1024 * 1024
+SLOW_TRANSFER_FLOOR = 1024 * 1024
+
+# 按仓库统计：>0 时开启，只跟踪请求量最高的 REPO_TOP_K 个仓库 (Space-Saving)，其余计入 repo="_other"
+REPO_TOP_K = 0
+# 形如 /api/<type>/<repo>/... 的 URL 中，以下 <type> 后面紧跟仓库名
+REPO_API_TYPES = [
+    'docker', 'npm', 'pypi', 'go', 'helm', 'nuget', 'conan', 'gems', 'composer',
+    'cargo', 'conda', 'terraform', 'cocoapods', 'pub', 'swift', 'huggingfaceml',
+    'cran', 'chef', 'puppet', 'ansible', 'vcs', 'storage', 'bower', 'gitlfs', 'deb', 'opkg'
+]
 
 COMMON_STATUS_CODES = [
     '200', '201', '204', '206', 
@@ -56,174 +149,1228 @@ class LogEntry:
         
         self.duration_ms = int(parts[9]) if parts[9].replace('-','').isdigit() else 0
 
-class ArtifactoryMetrics:
+TRANSFER_DIRECTIONS = ('upload', 'download')
+TRANSFER_SIZE_CLASSES = ('lt_1mb', '1mb_100mb', 'ge_100mb')
+TRANSFER_SIZE_1MB = 1024 * 1024
+TRANSFER_SIZE_100MB = 100 * 1024 * 1024
+TRANSFER_SLOTS = len(TRANSFER_DIRECTIONS) * len(TRANSFER_SIZE_CLASSES)
+
+class RequestBatch:
+    """一批日志行聚合后的增量：解析在锁外完成，应用时只需持锁一次"""
+    __slots__ = ['total', 'status_counts', 'duration_counts', 'upload_bytes', 'download_bytes', 'repo_stats', 'errors',
+                 'transfer_counts', 'transfer_sums', 'slow_transfers']
+
     def __init__(self):
+        self.total = 0
+        self.status_counts = {}    # bytes 状态码 -> 次数
+        self.duration_counts = {}  # 耗时 (ms) -> 次数，同一耗时值只需换算一次桶/分层
+        self.upload_bytes = 0
+        self.download_bytes = 0
+        self.repo_stats = None     # 开启按仓库统计时：bytes 仓库名 -> REPO_STAT_FIELDS 对应的数组
+        self.errors = {}           # 解析失败原因 -> 行数，只记录出现过的原因
+        # 吞吐直方图：按 (方向, 大小分档) 展开的桶计数、吞吐之和；慢速大文件传输数 [upload, download]
+        self.transfer_counts = [0] * TRANSFER_SLOTS * (len(THROUGHPUT_BUCKETS) + 1)  # 每组最后一个为 +Inf
+        self.transfer_sums = [0.0] * TRANSFER_SLOTS
+        self.slow_transfers = [0, 0]
+
+    def scale(self, n):
+        """采样解析 1/n 的行后，把各项计数乘以 n 作为整批的估计值"""
+        self.total *= n
+        self.upload_bytes *= n
+        self.download_bytes *= n
+        for counts in (self.status_counts, self.duration_counts, self.errors,
+                       self.transfer_counts, self.transfer_sums, self.slow_transfers):
+            for key in (counts if isinstance(counts, dict) else range(len(counts))):
+                counts[key] *= n
+        if self.repo_stats:
+            for stats in self.repo_stats.values():
+                for i in range(len(stats)):
+                    stats[i] *= n
+
+LATENCY_TIERS = ('lt_5s', '5s_10s', '10s_20s', 'ge_20s')
+
+def latency_tier(duration_ms):
+    if duration_ms < 5000:
+        return 'lt_5s'
+    elif duration_ms < 10000:
+        return '5s_10s'
+    elif duration_ms < 20000:
+        return '10s_20s'
+    return 'ge_20s'
+
+# 每个仓库的统计数组布局
+REPO_STAT_FIELDS = ('requests', '1xx', '2xx', '3xx', '4xx', '5xx', 'upload', 'download', 'duration_ms')
+STATUS_CLASS_INDEX = {b'1': 1, b'2': 2, b'3': 3, b'4': 4, b'5': 5}
+REPO_API_TYPE_SET = {t.encode() for t in REPO_API_TYPES}
+
+def repo_key(url: bytes) -> bytes:
+    """
+    从请求 URL（第 5 列）提取仓库名：
+    /maven-virtual/org/...、/api/docker/docker-remote/v2/...、/v2/docker-local/...
+    其他 REST API 统一归为 "api"
+    """
+    segs = url.split(b'?', 1)[0].split(b'/', 5)
+    i = 1
+    if len(segs) > 2 and segs[1] == b'artifactory':
+        i = 2
+    first = segs[i] if len(segs) > i else b''
+    if first == b'api':
+        if len(segs) > i + 2 and segs[i + 1] in REPO_API_TYPE_SET and segs[i + 2]:
+            return segs[i + 2]
+        return b'api'
+    if first == b'v2' and len(segs) > i + 1 and segs[i + 1]:
+        return segs[i + 1]
+    return first or b'/'
+
+def int_field(value: str) -> int:
+    return int(value) if value.lstrip('-').isdigit() else 0
+
+class SlowRequestTracker:
+    """
+    当前窗口和上一个窗口内耗时最长、传输字节 (上传 + 下载) 最多的 capacity 个请求，各用一个最小堆保存 (值, 原始日志行)。
+    解析时只有超过堆顶（当前第 capacity 名）的请求才调用 offer，更新为 O(log N)；日志行在 /debug/slow 读取时才拆分字段。
+    """
+    def __init__(self, capacity, window_size, fields=None):
+        self.capacity = capacity
+        self.window_size = window_size
+        self.fields = fields or JFROG_FIELDS  # 日志行的列号，读取时按此拆分
+        self.lock = threading.Lock()
+        self.window_id = int(time.time() / window_size)
+        self.slowest = []
+        self.largest = []
+        self.last = (self.window_id - 1, [], [])  # 上一个窗口的 (window_id, slowest, largest)
+
+    def _floor(self, heap):
+        return heap[0][0] if len(heap) >= self.capacity else 0
+
+    def floors(self):
+        """每批日志解析前调用：必要时切换到新窗口，返回 (耗时下限 ms, 字节数下限)"""
+        now_id = int(time.time() / self.window_size)
+        with self.lock:
+            if now_id != self.window_id:
+                if now_id == self.window_id + 1:
+                    self.last = (self.window_id, self.slowest, self.largest)
+                else:
+                    self.last = (now_id - 1, [], [])
+                self.window_id = now_id
+                self.slowest = []
+                self.largest = []
+            return self._floor(self.slowest), self._floor(self.largest)
+
+    def _offer(self, heap, value, line):
+        with self.lock:
+            if len(heap) < self.capacity:
+                heapq.heappush(heap, (value, line))
+            else:
+                heapq.heapreplace(heap, (value, line))
+            return self._floor(heap)
+
+    def offer_slow(self, duration_ms, line):
+        """duration_ms 需大于当前下限，返回新的下限"""
+        return self._offer(self.slowest, duration_ms, line)
+
+    def offer_large(self, size, line):
+        return self._offer(self.largest, size, line)
+
+    def _entries(self, heap):
+        fields = self.fields
+        width = max(fields.values()) + 1
+        entries = []
+        for _, line in sorted(heap, reverse=True):
+            parts = line.decode('utf-8', 'replace').split('|', width)
+            text = {key: parts[i].strip() if i < len(parts) else '' for key, i in fields.items()}
+            entries.append({
+                'timestamp': text.get('timestamp', ''),
+                'trace_id': text.get('trace_id', ''),
+                'method': text.get('method', ''),
+                'path': text.get('url', ''),
+                'status': text.get('status', ''),
+                'upload_bytes': max(int_field(text.get('upload', '')), 0),
+                'download_bytes': max(int_field(text.get('download', '')), 0),
+                'duration_ms': int_field(text.get('duration', '')),
+            })
+        return entries
+
+    def to_dict(self):
+        with self.lock:
+            windows = [(self.window_id, list(self.slowest), list(self.largest)), self.last]
+        return {
+            'window_size': self.window_size,
+            'top_n': self.capacity,
+            'windows': [{
+                'window_start': window_id * self.window_size,
+                'complete': i > 0,
+                'slowest': self._entries(slowest),
+                'largest': self._entries(largest),
+            } for i, (window_id, slowest, largest) in enumerate(windows)],
+        }
+
+def pipe_fields(log_format):
+    """日志格式对应的 | 分隔列号；json 格式先由 json_to_pipe 转换为 jfrog 的列布局"""
+    return log_format['fields'] if log_format['type'] == 'pipe' else JFROG_FIELDS
+
+def json_to_pipe(lines, log_format):
+    """
+    JSON 格式的请求日志行（如 router-request.log）转换为 jfrog 列布局的 | 分隔行，耗时换算为毫秒，
+    之后与其它日志走同一个批量解析。返回 (转换后的行, 无法解析的行数)；不是 JSON 对象或字段类型不对的行
+    逐行丢弃并计数（计入 bad_json），不影响同一批次的其它行。
+    """
+    fields = log_format['fields']
+    unit = log_format.get('duration_unit', 1)
+    width = max(JFROG_FIELDS.values()) + 1
+    columns = [(JFROG_FIELDS[key], key, fields[key]) for key in JFROG_FIELDS if key in fields]
+    out = []
+    bad = 0
+    for line in lines:
+        if not line.strip():
+            out.append(line)
+            continue
+        try:
+            entry = json.loads(line)
+            values = [''] * width
+            for index, key, name in columns:
+                value = entry.get(name)
+                if value is None:
+                    continue
+                if key == 'duration':
+                    value = int(float(value) * unit)
+                values[index] = str(value).replace('|', '%7C')
+            out.append('|'.join(values).encode('utf-8'))
+        except (ValueError, AttributeError, TypeError, OverflowError):
+            # 非 JSON、不是对象（如 [1]）、耗时不是数字（如 {"duration": {...}}）或为 inf
+            bad += 1
+    return out, bad
+
+def parse_request_lines(lines, tracker: SlowRequestTracker = None, fields=None) -> RequestBatch:
+    """
+    批量解析 bytes 日志行，只取状态码、上传/下载字节、耗时列（开启按仓库统计时还取 URL 列），直接累加到局部变量。
+    fields 为列号映射，默认为 JFROG_FIELDS（第 6、7、8、9、5 列）。
+    传入 tracker 时，耗时或字节数超过其当前下限的行交给 tracker 记录。
+    """
+    fields = fields or JFROG_FIELDS
+    i_url, i_status, i_upload, i_download, i_duration = (
+        fields['url'], fields['status'], fields['upload'], fields['download'], fields['duration'])
+    min_fields = max(i_url, i_status, i_upload, i_download, i_duration) + 1
+    batch = RequestBatch()
+    status_counts = batch.status_counts
+    duration_counts = batch.duration_counts
+    repo_stats = batch.repo_stats = {} if REPO_TOP_K > 0 else None
+    upload = download = total = 0
+    short_lines = bad_bytes = bad_duration = 0
+    slow_floor, size_floor = tracker.floors() if tracker is not None else (math.inf, math.inf)
+    transfer_counts = batch.transfer_counts
+    transfer_sums = batch.transfer_sums
+    slow_transfers = batch.slow_transfers
+    throughput_bounds = THROUGHPUT_BUCKETS
+    width = len(throughput_bounds) + 1
+    bisect_left = bisect.bisect_left
+    slow_min_bytes = SLOW_TRANSFER_MIN_BYTES
+    slow_floor_bps = SLOW_TRANSFER_FLOOR
+
+    for line in lines:
+        # 只切到需要的最后一列，user agent 等尾部字段不再继续拆分
+        parts = line.split(b'|', min_fields)
+        if len(parts) < min_fields:
+            if line.strip():
+                short_lines += 1
+            continue
+
+        code = parts[i_status]
+        status_counts[code] = status_counts.get(code, 0) + 1
+        total += 1
+
+        try:
+            up = int(parts[i_upload])
+            if up > 0:
+                upload += up
+            else:
+                up = 0
+        except ValueError:
+            up = 0
+            bad_bytes += 1
+        try:
+            dw = int(parts[i_download])
+            if dw > 0:
+                download += dw
+            else:
+                dw = 0
+        except ValueError:
+            dw = 0
+            bad_bytes += 1
+        try:
+            d = int(parts[i_duration])
+        except ValueError:
+            d = 0
+            bad_duration += 1
+        duration_counts[d] = duration_counts.get(d, 0) + 1
+        if d > slow_floor:
+            slow_floor = tracker.offer_slow(d, line)
+        if up + dw > size_floor:
+            size_floor = tracker.offer_large(up + dw, line)
+        # 吞吐 = 字节数 / 耗时，耗时为 0 的请求按 1ms 计；槽位 0-2 为 upload、3-5 为 download 的三个大小分档
+        if dw:
+            throughput = dw * 1000 / (d if d > 0 else 1)
+            slot = 3 if dw < TRANSFER_SIZE_1MB else 4 if dw < TRANSFER_SIZE_100MB else 5
+            transfer_counts[slot * width + bisect_left(throughput_bounds, throughput)] += 1
+            transfer_sums[slot] += throughput
+            if dw >= slow_min_bytes and throughput < slow_floor_bps:
+                slow_transfers[1] += 1
+        if up:
+            throughput = up * 1000 / (d if d > 0 else 1)
+            slot = 0 if up < TRANSFER_SIZE_1MB else 1 if up < TRANSFER_SIZE_100MB else 2
+            transfer_counts[slot * width + bisect_left(throughput_bounds, throughput)] += 1
+            transfer_sums[slot] += throughput
+            if up >= slow_min_bytes and throughput < slow_floor_bps:
+                slow_transfers[0] += 1
+
+        if repo_stats is not None:
+            key = repo_key(parts[i_url])
+            stats = repo_stats.get(key)
+            if stats is None:
+                stats = repo_stats[key] = [0] * len(REPO_STAT_FIELDS)
+            stats[0] += 1
+            cls = STATUS_CLASS_INDEX.get(code.strip()[:1])
+            if cls:
+                stats[cls] += 1
+            stats[6] += up
+            stats[7] += dw
+            if d > 0:
+                stats[8] += d
+
+    batch.total = total
+    batch.upload_bytes = upload
+    batch.download_bytes = download
+    if short_lines or bad_bytes or bad_duration:
+        for reason, n in (('short_line', short_lines), ('bad_bytes', bad_bytes), ('bad_duration', bad_duration)):
+            if n:
+                batch.errors[reason] = n
+    return batch
+
+PARSE_ERROR_REASONS = ('short_line', 'bad_bytes', 'bad_duration', 'bad_json', 'exception')
+
+class ExporterStats(BaseExporterStats):
+    """exporter 自身的运行指标，另外记录过载保护的采样状态"""
+    def __init__(self):
+        super().__init__(PARSE_ERROR_REASONS)
+        self.sample_rate = 1        # 当前采样间隔 N，1 表示逐行统计
+        self.lines_skipped = 0      # 过载模式下未解析、按采样估算的行数
+
+class LatencySketch:
+    """
+    DDSketch 风格的流式分位数估计：按 gamma 为底的对数桶计数，
+    任意分位数的相对误差不超过 relative_accuracy，桶数只与耗时取值范围有关（内存有界）。
+    """
+    def __init__(self, relative_accuracy=SKETCH_RELATIVE_ACCURACY):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins = defaultdict(int)
+        self.zero_count = 0  # 耗时 <= 0 的请求
+        self.count = 0
+
+    def key(self, value):
+        return math.ceil(math.log(value) / self.log_gamma) if value > 0 else None
+
+    def add_key(self, key, n=1):
+        if key is None:
+            self.zero_count += n
+        else:
+            self.bins[key] += n
+        self.count += n
+
+    def clear(self):
+        self.bins.clear()
+        self.zero_count = 0
+        self.count = 0
+
+    def merge(self, other):
+        """累加另一个相同精度的 sketch 的计数"""
+        for key, n in other.bins.items():
+            self.bins[key] += n
+        self.zero_count += other.zero_count
+        self.count += other.count
+
+    def quantile(self, q):
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                return 2 * self.gamma ** key / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.bins) / (self.gamma + 1)
+
+class SketchRing:
+    """
+    最近 size 个窗口各自的 LatencySketch，按 window_id % size 定位，进入新窗口时只清空被复用的那一个。
+    分位数由这些窗口合并后计算（滑动窗口），不会在窗口切换后只剩刚开始的少量请求。
+    """
+    def __init__(self, size):
+        self.size = size
+        self.sketches = [LatencySketch() for _ in range(size)]
+        self.sketch_ids = [None] * size
+
+    def key(self, value):
+        return self.sketches[0].key(value)
+
+    def sketch(self, window_id):
+        i = window_id % self.size
+        sketch = self.sketches[i]
+        if self.sketch_ids[i] != window_id:
+            sketch.clear()
+            self.sketch_ids[i] = window_id
+        return sketch
+
+    def merged(self, window_id):
+        """最近 size 个窗口（含当前窗口）合并后的 sketch"""
+        low = window_id - self.size + 1
+        result = LatencySketch()
+        for sketch, sketch_id in zip(self.sketches, self.sketch_ids):
+            if sketch_id is not None and low <= sketch_id <= window_id:
+                result.merge(sketch)
+        return result
+
+class TopKTracker:
+    """
+    Space-Saving 算法跟踪请求量最高的 capacity 个 key，内存和导出的标签数都有上限。
+    counts 为算法的估计计数（只用于排名/淘汰），stats 为 key 被跟踪以来的精确统计；
+    被淘汰 key 的统计合并进 other。
+    """
+    def __init__(self, capacity, width):
+        self.capacity = capacity
+        self.counts = {}
+        self.stats = {}
+        self.other = [0] * width
+
+    def add(self, key, stats):
+        n = stats[0]
+        tracked = self.stats.get(key)
+        if tracked is not None:
+            self.counts[key] += n
+            for i, v in enumerate(stats):
+                tracked[i] += v
+            return
+        floor = 0
+        if len(self.counts) >= self.capacity:
+            # 仅在出现未跟踪的新 key 时才需要 O(K) 查找最小值
+            victim = min(self.counts, key=self.counts.get)
+            floor = self.counts.pop(victim)
+            for i, v in enumerate(self.stats.pop(victim)):
+                self.other[i] += v
+        self.counts[key] = floor + n
+        self.stats[key] = list(stats)
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class WindowRing:
+    """
+    固定大小的窗口环：每个槽位是一行预分配的计数器，按 window_id % size 定位。
+    进入新窗口时只清零被复用的那一行 (O(1))，读取时按槽位记录的 window_id 过滤过期的行，
+    因此长时间没有日志也不需要逐个窗口补零。
+    """
+    def __init__(self, size, width):
+        self.size = size
+        self.width = width
+        self.rows = [[0] * width for _ in range(size)]
+        self.row_ids = [None] * size
+
+    def row(self, window_id):
+        i = window_id % self.size
+        row = self.rows[i]
+        if self.row_ids[i] != window_id:
+            for j in range(self.width):
+                row[j] = 0
+            self.row_ids[i] = window_id
+        return row
+
+    def add_column(self):
+        """新增一列（例如首次出现的状态码），返回列下标"""
+        for row in self.rows:
+            row.append(0)
+        self.width += 1
+        return self.width - 1
+
+    def totals(self, window_id, count=1):
+        """最近 count 个窗口（含当前窗口）每一列的和"""
+        low = window_id - count + 1
+        result = [0] * self.width
+        for row, row_id in zip(self.rows, self.row_ids):
+            if row_id is not None and low <= row_id <= window_id:
+                for j, v in enumerate(row):
+                    result[j] += v
+        return result
+
+# WindowRing 中固定列的下标，状态码的列在其后按首次出现的顺序追加
+COL_TIERS = {tier: i for i, tier in enumerate(LATENCY_TIERS)}
+COL_UPLOAD = len(LATENCY_TIERS)
+COL_DOWNLOAD = COL_UPLOAD + 1
+COL_REQUESTS = COL_DOWNLOAD + 1
+COL_SLOW_TRANSFERS = (COL_REQUESTS + 1, COL_REQUESTS + 2)  # 按 TRANSFER_DIRECTIONS 的顺序
+FIXED_COLUMNS = COL_REQUESTS + 3
+
+class ArtifactoryMetrics:
+    def __init__(self, fields=None):
         self.window_size = WINDOW_SIZE
         self.lock = threading.Lock()
         
         # 累计连接数值 (Counter)
         self.total_requests_counter = 0
+        # 每合并一批数据加 1，/metrics 据此判断缓存的输出是否过期
+        self.version = 0
         
-        self.status_history = defaultdict(lambda: deque([0]*10, maxlen=10))
+        # 最近 HISTORY_WINDOWS 个窗口的计数：耗时分层、上传/下载字节、请求数、各状态码
+        self.windows = WindowRing(HISTORY_WINDOWS, FIXED_COLUMNS)
+        # 与窗口行同样布局的累计计数 (Counter)，不随窗口清零，供 rate()/increase() 使用
+        self.totals = [0] * FIXED_COLUMNS
+        self.status_columns = {}   # 状态码 -> 列下标
+        self.status_codes = []     # 有序的 (状态码, 列下标)，只在出现新状态码时更新
+        for code in COMMON_STATUS_CODES:
+            self._status_column(code)
         
-        self.latency_history = {
-            'lt_5s': deque([0]*10, maxlen=10),
-            '5s_10s': deque([0]*10, maxlen=10),
-            '10s_20s': deque([0]*10, maxlen=10),
-            'ge_20s': deque([0]*10, maxlen=10)
-        }
+        # 耗时直方图 (累计值)：桶边界同时保存毫秒形式，便于按日志中的 ms 直接二分定位
+        self.histogram_bounds = [round(HISTOGRAM_BUCKET_START * HISTOGRAM_BUCKET_FACTOR ** i, 6)
+                                 for i in range(HISTOGRAM_BUCKET_COUNT)]
+        self.histogram_bounds_ms = [b * 1000 for b in self.histogram_bounds]
+        self.histogram_counts = [0] * (HISTOGRAM_BUCKET_COUNT + 1)  # 最后一个为 +Inf
+        self.duration_sum_ms = 0
         
-        self.traffic_history = {
-            'upload': deque([0]*10, maxlen=10),
-            'download': deque([0]*10, maxlen=10)
-        }
+        # 吞吐直方图 (累计值)，布局与 RequestBatch.transfer_counts 相同
+        self.transfer_counts = [0] * TRANSFER_SLOTS * (len(THROUGHPUT_BUCKETS) + 1)
+        self.transfer_sums = [0.0] * TRANSFER_SLOTS
+        
+        # 最近 QUANTILE_WINDOWS 个窗口的分位数估计
+        self.latency_sketches = SketchRing(max(1, QUANTILE_WINDOWS)) if LATENCY_QUANTILES else None
+        
+        # 按仓库统计 (累计值)
+        self.repo_tracker = TopKTracker(REPO_TOP_K, len(REPO_STAT_FIELDS)) if REPO_TOP_K > 0 else None
         
         self.current_window_id = int(time.time() / self.window_size)
+        
+        self.stats = ExporterStats()
+        
+        # 每个窗口内最慢/最大的请求，供 /debug/slow 查看
+        self.slow_requests = SlowRequestTracker(SLOW_REQUESTS_TOP_N, self.window_size, fields) if SLOW_REQUESTS_TOP_N > 0 else None
+
+    def _status_column(self, code):
+        col = self.status_columns.get(code)
+        if col is None:
+            col = self.status_columns[code] = self.windows.add_column()
+            self.totals.append(0)
+            bisect.insort(self.status_codes, (code, col))
+        return col
 
     def _sync_window(self):
+        """返回当前窗口的计数行"""
         now_id = int(time.time() / self.window_size)
-        gap = now_id - self.current_window_id
-        
-        if gap > 0:
-            steps = min(gap, 10)
-            for _ in range(steps):
-                for q in self.status_history.values(): q.append(0)
-                for q in self.latency_history.values(): q.append(0)
-                for q in self.traffic_history.values(): q.append(0)
-            self.current_window_id = now_id
+        self.current_window_id = now_id
+        return self.windows.row(now_id)
 
     def process_log_entry(self, entry: LogEntry):
+        batch = RequestBatch()
+        batch.total = 1
+        batch.status_counts[entry.status_code.encode('ascii', 'ignore')] = 1
+        batch.duration_counts[entry.duration_ms] = 1
+        batch.upload_bytes = entry.upload_bytes
+        batch.download_bytes = entry.download_bytes
+        self.process_batch(batch)
+
+    def process_batch(self, batch: RequestBatch):
+        """将一批已聚合的增量合并进当前窗口，整批只获取一次锁"""
+        if not batch.total:
+            return
+        # 状态码解码、耗时分层/分桶都在锁外完成，每批只处理去重后的少量 key
+        status_counts = [(code.strip().decode('ascii', 'ignore'), n) for code, n in batch.status_counts.items()]
+        tier_counts = defaultdict(int)
+        bucket_counts = defaultdict(int)
+        sketch_counts = []
+        duration_sum = 0
+        sketches = self.latency_sketches
+        for d, n in batch.duration_counts.items():
+            tier_counts[latency_tier(d)] += n
+            bucket_counts[bisect.bisect_left(self.histogram_bounds_ms, d)] += n
+            if d > 0:
+                duration_sum += d * n
+            if sketches is not None:
+                sketch_counts.append((sketches.key(d), n))
+        
+        wait_start = time.perf_counter()
         with self.lock:
-            self._sync_window()
-            # 1. 增加窗口内的状态码统计
-            self.status_history[entry.status_code][-1] += 1
-            
-            # 2. 增加全局累计请求数 (Counter)
-            self.total_requests_counter += 1
-            
-            # 耗时分段
-            d = entry.duration_ms
-            if d < 5000:
-                self.latency_history['lt_5s'][-1] += 1
-            elif 5000 <= d < 10000:
-                self.latency_history['5s_10s'][-1] += 1
-            elif 10000 <= d < 20000:
-                self.latency_history['10s_20s'][-1] += 1
-            else:
-                self.latency_history['ge_20s'][-1] += 1
-            
-            self.traffic_history['upload'][-1] += entry.upload_bytes
-            self.traffic_history['download'][-1] += entry.download_bytes
+            self.stats.lock_wait['ingest'] += time.perf_counter() - wait_start
+            row = self._sync_window()
+            totals = self.totals
+            for code, n in status_counts:
+                col = self.status_columns.get(code)
+                if col is None:
+                    col = self._status_column(code)
+                    row = self.windows.row(self.current_window_id)
+                row[col] += n
+                totals[col] += n
+            row[COL_REQUESTS] += batch.total
+            totals[COL_REQUESTS] += batch.total
+            self.total_requests_counter += batch.total
+            self.version += 1
+            for tier, n in tier_counts.items():
+                row[COL_TIERS[tier]] += n
+                totals[COL_TIERS[tier]] += n
+            for idx, n in bucket_counts.items():
+                self.histogram_counts[idx] += n
+            self.duration_sum_ms += duration_sum
+            if sketches is not None:
+                sketch = sketches.sketch(self.current_window_id)
+                for key, n in sketch_counts:
+                    sketch.add_key(key, n)
+            row[COL_UPLOAD] += batch.upload_bytes
+            row[COL_DOWNLOAD] += batch.download_bytes
+            totals[COL_UPLOAD] += batch.upload_bytes
+            totals[COL_DOWNLOAD] += batch.download_bytes
+            transfer_counts = self.transfer_counts
+            for i, n in enumerate(batch.transfer_counts):
+                if n:
+                    transfer_counts[i] += n
+            for i, v in enumerate(batch.transfer_sums):
+                self.transfer_sums[i] += v
+            for direction, n in enumerate(batch.slow_transfers):
+                if n:
+                    row[COL_SLOW_TRANSFERS[direction]] += n
+                    totals[COL_SLOW_TRANSFERS[direction]] += n
+            if batch.repo_stats and self.repo_tracker is not None:
+                for key, stats in batch.repo_stats.items():
+                    self.repo_tracker.add(key, stats)
 
-    def generate_metrics(self) -> str:
+    def snapshot(self) -> dict:
+        """在锁内只复制渲染所需的数据，格式化在锁外进行，尽量缩短与日志跟踪线程的锁竞争"""
+        wait_start = time.perf_counter()
         with self.lock:
-            self._sync_window()
-            m = []
-            
-            # 1. 状态码 (Gauge)
-            m.append(f"# HELP artifactory_status_codes_total Requests in last {self.window_size}s window")
-            m.append("# TYPE artifactory_status_codes_total gauge")
-            all_known_codes = sorted(list(set(COMMON_STATUS_CODES) | set(self.status_history.keys())))
-            for code in all_known_codes:
-                val = self.status_history[code][-1] if code in self.status_history else 0
-                m.append(f'artifactory_status_codes_total{{code="{code}"}} {val}')
-            
-            # 2. 耗时分布 (Gauge)
-            m.append(f"\n# HELP artifactory_request_duration_seconds Request count by duration tier in last {self.window_size}s")
-            m.append("# TYPE artifactory_request_duration_seconds gauge")
-            for tier, history in self.latency_history.items():
-                m.append(f'artifactory_request_duration_seconds{{tier="{tier}"}} {history[-1]}')
-            
-            # 3. 流量 (Gauge)
-            m.append(f"\n# HELP artifactory_traffic_bytes Traffic in last {self.window_size}s window")
-            m.append("# TYPE artifactory_traffic_bytes gauge")
-            m.append(f'artifactory_traffic_bytes{{direction="upload"}} {self.traffic_history["upload"][-1]}')
-            m.append(f'artifactory_traffic_bytes{{direction="download"}} {self.traffic_history["download"][-1]}')
-            
-            # 4. 请求数汇总
-            # 4a. 实时窗口请求数 (Gauge)
-            total_req_window = sum(h[-1] for h in self.status_history.values())
-            m.append(f"\n# HELP artifactory_requests_in_window Total requests in current {self.window_size}s window")
-            m.append("# TYPE artifactory_requests_in_window gauge")
-            m.append(f'artifactory_requests_in_window {total_req_window}')
-            
-            # 4b. 历史累积请求总数 (Counter)
-            m.append("\n# HELP artifactory_requests_total Cumulative total requests since exporter start")
-            m.append("# TYPE artifactory_requests_total counter")
-            m.append(f'artifactory_requests_total {self.total_requests_counter}')
-
-            m.append(f'\nartifactory_metrics_timestamp {time.time()}')
-            
-            return "\n".join(m)
-
-class LogTailer:
-    def __init__(self, log_file: str, metrics: ArtifactoryMetrics):
-        self.log_file = log_file
+            self.stats.lock_wait['render'] += time.perf_counter() - wait_start
+            current = list(self._sync_window())
+            window_id = self.current_window_id
+            snap = {
+                'current': current,
+                'totals': list(self.totals),
+                'status_codes': list(self.status_codes),
+                'histogram_counts': list(self.histogram_counts),
+                'duration_sum_ms': self.duration_sum_ms,
+                'transfer_counts': list(self.transfer_counts),
+                'transfer_sums': list(self.transfer_sums),
+                'total_requests': self.total_requests_counter,
+                'window_id': window_id,
+            }
+            if self.latency_sketches is not None:
+                sketch = self.latency_sketches.merged(window_id)
+                snap['quantiles'] = [(q, sketch.quantile(q)) for q in LATENCY_QUANTILES]
+            if LAST_WINDOW_TIMESTAMPS:
+                snap['last_window'] = self.windows.totals(window_id - 1)
+            snap['ranges'] = []
+            for seconds in AGGREGATION_RANGES:
+                count = min(max(1, -(-seconds // self.window_size)), HISTORY_WINDOWS)
+                snap['ranges'].append((f'{count * self.window_size}s', self.windows.totals(window_id, count)))
+            if self.repo_tracker is not None:
+                snap['repos'] = [(k, list(v)) for k, v in self.repo_tracker.stats.items()]
+                snap['repo_other'] = list(self.repo_tracker.other)
+        return snap
+
+    def _generate_repo_metrics(self, m, snap):
+        """按仓库的累计指标，仓库名为 top-K 中的 key，其余为 _other"""
+        repos = [(escape_label(k.decode('utf-8', 'ignore')), v) for k, v in snap['repos']]
+        repos.sort()
+        repos.append(('_other', snap['repo_other']))
+        
+        m.append(f"\n# HELP artifactory_repo_requests_total Requests per repository (top {REPO_TOP_K}, rest in _other)")
+        m.append("# TYPE artifactory_repo_requests_total counter")
+        for repo, stats in repos:
+            m.append(f'artifactory_repo_requests_total{{repo="{repo}"}} {stats[0]}')
+        
+        m.append("\n# HELP artifactory_repo_status_total Requests per repository by status class")
+        m.append("# TYPE artifactory_repo_status_total counter")
+        for repo, stats in repos:
+            for i in range(1, 6):
+                m.append(f'artifactory_repo_status_total{{repo="{repo}",class="{REPO_STAT_FIELDS[i]}"}} {stats[i]}')
+        
+        m.append("\n# HELP artifactory_repo_traffic_bytes_total Traffic per repository")
+        m.append("# TYPE artifactory_repo_traffic_bytes_total counter")
+        for repo, stats in repos:
+            m.append(f'artifactory_repo_traffic_bytes_total{{repo="{repo}",direction="upload"}} {stats[6]}')
+            m.append(f'artifactory_repo_traffic_bytes_total{{repo="{repo}",direction="download"}} {stats[7]}')
+        
+        m.append("\n# HELP artifactory_repo_latency_seconds Request latency per repository")
+        m.append("# TYPE artifactory_repo_latency_seconds summary")
+        for repo, stats in repos:
+            m.append(f'artifactory_repo_latency_seconds_sum{{repo="{repo}"}} {stats[8] / 1000}')
+            m.append(f'artifactory_repo_latency_seconds_count{{repo="{repo}"}} {stats[0]}')
+
+    def _generate_transfer_metrics(self, m, snap):
+        """单请求吞吐直方图 (累计值) 和慢速大文件传输数"""
+        counts = snap['transfer_counts']
+        sums = snap['transfer_sums']
+        width = len(THROUGHPUT_BUCKETS) + 1
+        m.append("\n# HELP artifactory_transfer_throughput_bytes_per_second Per-request transfer throughput (bytes / duration) by direction and size class")
+        m.append("# TYPE artifactory_transfer_throughput_bytes_per_second histogram")
+        for d, direction in enumerate(TRANSFER_DIRECTIONS):
+            for c, size in enumerate(TRANSFER_SIZE_CLASSES):
+                slot = d * len(TRANSFER_SIZE_CLASSES) + c
+                labels = f'direction="{direction}",size="{size}"'
+                cumulative = 0
+                for bound, n in zip(THROUGHPUT_BUCKETS, counts[slot * width:]):
+                    cumulative += n
+                    m.append(f'artifactory_transfer_throughput_bytes_per_second_bucket{{{labels},le="{bound}"}} {cumulative}')
+                cumulative += counts[(slot + 1) * width - 1]
+                m.append(f'artifactory_transfer_throughput_bytes_per_second_bucket{{{labels},le="+Inf"}} {cumulative}')
+                m.append(f'artifactory_transfer_throughput_bytes_per_second_sum{{{labels}}} {round(sums[slot], 3)}')
+                m.append(f'artifactory_transfer_throughput_bytes_per_second_count{{{labels}}} {cumulative}')
+        
+        current = snap['current']
+        totals = snap['totals']
+        m.append(f"\n# HELP artifactory_slow_transfers_in_window Transfers of at least {SLOW_TRANSFER_MIN_BYTES} bytes below {SLOW_TRANSFER_FLOOR} bytes/s in current {self.window_size}s window")
+        m.append("# TYPE artifactory_slow_transfers_in_window gauge")
+        for d, direction in enumerate(TRANSFER_DIRECTIONS):
+            m.append(f'artifactory_slow_transfers_in_window{{direction="{direction}"}} {current[COL_SLOW_TRANSFERS[d]]}')
+        m.append(f"\n# HELP artifactory_slow_transfers_total Transfers of at least {SLOW_TRANSFER_MIN_BYTES} bytes below {SLOW_TRANSFER_FLOOR} bytes/s since exporter start")
+        m.append("# TYPE artifactory_slow_transfers_total counter")
+        for d, direction in enumerate(TRANSFER_DIRECTIONS):
+            m.append(f'artifactory_slow_transfers_total{{direction="{direction}"}} {totals[COL_SLOW_TRANSFERS[d]]}')
+
+    def _generate_counter_metrics(self, m, snap):
+        """累计计数 (Counter)，结果与抓取间隔、抓取时刻无关"""
+        totals = snap['totals']
+        m.append("\n# HELP artifactory_requests_by_code_total Cumulative requests by status code since exporter start")
+        m.append("# TYPE artifactory_requests_by_code_total counter")
+        for code, col in snap['status_codes']:
+            m.append(f'artifactory_requests_by_code_total{{code="{code}"}} {totals[col]}')
+        
+        m.append("\n# HELP artifactory_requests_by_tier_total Cumulative requests by duration tier since exporter start")
+        m.append("# TYPE artifactory_requests_by_tier_total counter")
+        for tier in LATENCY_TIERS:
+            m.append(f'artifactory_requests_by_tier_total{{tier="{tier}"}} {totals[COL_TIERS[tier]]}')
+        
+        m.append("\n# HELP artifactory_traffic_bytes_total Cumulative traffic since exporter start")
+        m.append("# TYPE artifactory_traffic_bytes_total counter")
+        m.append(f'artifactory_traffic_bytes_total{{direction="upload"}} {totals[COL_UPLOAD]}')
+        m.append(f'artifactory_traffic_bytes_total{{direction="download"}} {totals[COL_DOWNLOAD]}')
+
+    def _generate_last_window_metrics(self, m, snap):
+        """上一个完整窗口的值，样本时间戳为该窗口的结束时间 (ms)"""
+        last = snap['last_window']
+        ts = snap['window_id'] * self.window_size * 1000
+        m.append(f"\n# HELP artifactory_status_codes_last_window Requests by status code in the last completed {self.window_size}s window")
+        m.append("# TYPE artifactory_status_codes_last_window gauge")
+        for code, col in snap['status_codes']:
+            m.append(f'artifactory_status_codes_last_window{{code="{code}"}} {last[col]} {ts}')
+        
+        m.append(f"\n# HELP artifactory_request_duration_last_window Request count by duration tier in the last completed {self.window_size}s window")
+        m.append("# TYPE artifactory_request_duration_last_window gauge")
+        for tier in LATENCY_TIERS:
+            m.append(f'artifactory_request_duration_last_window{{tier="{tier}"}} {last[COL_TIERS[tier]]} {ts}')
+        
+        m.append(f"\n# HELP artifactory_traffic_bytes_last_window Traffic in the last completed {self.window_size}s window")
+        m.append("# TYPE artifactory_traffic_bytes_last_window gauge")
+        m.append(f'artifactory_traffic_bytes_last_window{{direction="upload"}} {last[COL_UPLOAD]} {ts}')
+        m.append(f'artifactory_traffic_bytes_last_window{{direction="download"}} {last[COL_DOWNLOAD]} {ts}')
+        
+        m.append(f"\n# HELP artifactory_requests_last_window Total requests in the last completed {self.window_size}s window")
+        m.append("# TYPE artifactory_requests_last_window gauge")
+        m.append(f'artifactory_requests_last_window {last[COL_REQUESTS]} {ts}')
+        
+        m.append(f"\n# HELP artifactory_slow_transfers_last_window Slow large transfers in the last completed {self.window_size}s window")
+        m.append("# TYPE artifactory_slow_transfers_last_window gauge")
+        for d, direction in enumerate(TRANSFER_DIRECTIONS):
+            m.append(f'artifactory_slow_transfers_last_window{{direction="{direction}"}} {last[COL_SLOW_TRANSFERS[d]]} {ts}')
+
+    def _generate_range_metrics(self, m, snap):
+        """对保留的窗口按 AGGREGATION_RANGES 聚合，range 标签为时间范围"""
+        ranges = snap['ranges']
+        m.append(f"\n# HELP artifactory_status_codes_range Requests by status code over the last range (windows of {self.window_size}s)")
+        m.append("# TYPE artifactory_status_codes_range gauge")
+        for label, totals in ranges:
+            for code, col in snap['status_codes']:
+                m.append(f'artifactory_status_codes_range{{code="{code}",range="{label}"}} {totals[col]}')
+        
+        m.append("\n# HELP artifactory_request_duration_range Request count by duration tier over the last range")
+        m.append("# TYPE artifactory_request_duration_range gauge")
+        for label, totals in ranges:
+            for tier in LATENCY_TIERS:
+                m.append(f'artifactory_request_duration_range{{tier="{tier}",range="{label}"}} {totals[COL_TIERS[tier]]}')
+        
+        m.append("\n# HELP artifactory_traffic_bytes_range Traffic over the last range")
+        m.append("# TYPE artifactory_traffic_bytes_range gauge")
+        for label, totals in ranges:
+            m.append(f'artifactory_traffic_bytes_range{{direction="upload",range="{label}"}} {totals[COL_UPLOAD]}')
+            m.append(f'artifactory_traffic_bytes_range{{direction="download",range="{label}"}} {totals[COL_DOWNLOAD]}')
+        
+        m.append("\n# HELP artifactory_requests_range Total requests over the last range")
+        m.append("# TYPE artifactory_requests_range gauge")
+        for label, totals in ranges:
+            m.append(f'artifactory_requests_range{{range="{label}"}} {totals[COL_REQUESTS]}')
+
+    def _generate_self_metrics(self, m):
+        """exporter 自身的运行指标，渲染耗时为此前各次渲染的累计值"""
+        stats = self.stats
+        m.append("\n# HELP artifactory_request_exporter_lines_read_total Log lines read by the exporter")
+        m.append("# TYPE artifactory_request_exporter_lines_read_total counter")
+        m.append(f'artifactory_request_exporter_lines_read_total {stats.lines_read}')
+        
+        m.append("\n# HELP artifactory_request_exporter_bytes_read_total Log bytes read by the exporter")
+        m.append("# TYPE artifactory_request_exporter_bytes_read_total counter")
+        m.append(f'artifactory_request_exporter_bytes_read_total {stats.bytes_read}')
+        
+        m.append("\n# HELP artifactory_request_exporter_parse_errors_total Log lines (or batches, reason=exception) that failed to parse")
+        m.append("# TYPE artifactory_request_exporter_parse_errors_total counter")
+        for reason, n in stats.parse_errors.items():
+            m.append(f'artifactory_request_exporter_parse_errors_total{{reason="{reason}"}} {n}')
+        
+        m.append("\n# HELP artifactory_request_exporter_rotations_total Log rotations (rotate) and copytruncate truncations (truncate) seen")
+        m.append("# TYPE artifactory_request_exporter_rotations_total counter")
+        for kind, n in stats.rotations.items():
+            m.append(f'artifactory_request_exporter_rotations_total{{type="{kind}"}} {n}')
+        
+        lag = stats.tail_lag()
+        if lag is not None:
+            m.append("\n# HELP artifactory_request_exporter_tail_lag_bytes Log file size minus the exporter's read offset")
+            m.append("# TYPE artifactory_request_exporter_tail_lag_bytes gauge")
+            m.append(f'artifactory_request_exporter_tail_lag_bytes {lag[0]}')
+            m.append("\n# HELP artifactory_request_exporter_tail_lag_seconds Now minus the timestamp of the last line read (0 when caught up)")
+            m.append("# TYPE artifactory_request_exporter_tail_lag_seconds gauge")
+            m.append(f'artifactory_request_exporter_tail_lag_seconds {round(lag[1], 3)}')
+        
+        m.append("\n# HELP artifactory_request_exporter_sample_rate Lines per parsed line (1 = full fidelity, N = overload mode parsing 1-in-N lines)")
+        m.append("# TYPE artifactory_request_exporter_sample_rate gauge")
+        m.append(f'artifactory_request_exporter_sample_rate {stats.sample_rate}')
+        
+        m.append("\n# HELP artifactory_request_exporter_lines_skipped_total Lines estimated from sampling instead of parsed in overload mode")
+        m.append("# TYPE artifactory_request_exporter_lines_skipped_total counter")
+        m.append(f'artifactory_request_exporter_lines_skipped_total {stats.lines_skipped}')
+        
+        m.append("\n# HELP artifactory_request_exporter_lock_wait_seconds_total Time spent waiting for the metrics lock")
+        m.append("# TYPE artifactory_request_exporter_lock_wait_seconds_total counter")
+        for op, seconds in stats.lock_wait.items():
+            m.append(f'artifactory_request_exporter_lock_wait_seconds_total{{op="{op}"}} {round(seconds, 6)}')
+        
+        m.append("\n# HELP artifactory_request_exporter_render_duration_seconds Time spent rendering /metrics")
+        m.append("# TYPE artifactory_request_exporter_render_duration_seconds summary")
+        m.append(f'artifactory_request_exporter_render_duration_seconds_sum {round(stats.render_seconds, 6)}')
+        m.append(f'artifactory_request_exporter_render_duration_seconds_count {stats.render_count}')
+
+    def generate_metrics(self) -> str:
+        render_start = time.perf_counter()
+        snap = self.snapshot()
+        current = snap['current']
+        m = []
+        
+        # 1. 状态码 (Gauge)
+        m.append(f"# HELP artifactory_status_codes_total Requests in last {self.window_size}s window")
+        m.append("# TYPE artifactory_status_codes_total gauge")
+        for code, col in snap['status_codes']:
+            m.append(f'artifactory_status_codes_total{{code="{code}"}} {current[col]}')
+        
+        # 2. 耗时分布 (Gauge)
+        m.append(f"\n# HELP artifactory_request_duration_seconds Request count by duration tier in last {self.window_size}s")
+        m.append("# TYPE artifactory_request_duration_seconds gauge")
+        for tier in LATENCY_TIERS:
+            m.append(f'artifactory_request_duration_seconds{{tier="{tier}"}} {current[COL_TIERS[tier]]}')
+        
+        # 2a. 耗时直方图 (Histogram，累计值)
+        m.append("\n# HELP artifactory_request_latency_seconds Request latency histogram since exporter start")
+        m.append("# TYPE artifactory_request_latency_seconds histogram")
+        cumulative = 0
+        histogram_counts = snap['histogram_counts']
+        for bound, n in zip(self.histogram_bounds, histogram_counts):
+            cumulative += n
+            m.append(f'artifactory_request_latency_seconds_bucket{{le="{bound}"}} {cumulative}')
+        cumulative += histogram_counts[-1]
+        m.append(f'artifactory_request_latency_seconds_bucket{{le="+Inf"}} {cumulative}')
+        m.append(f'artifactory_request_latency_seconds_sum {snap["duration_sum_ms"] / 1000}')
+        m.append(f'artifactory_request_latency_seconds_count {cumulative}')
+        
+        # 2b. 窗口内耗时分位数 (Gauge)
+        if 'quantiles' in snap:
+            quantile_seconds = self.latency_sketches.size * self.window_size
+            m.append(f"\n# HELP artifactory_request_latency_quantile_seconds Request latency quantiles over the last {quantile_seconds}s (sliding)")
+            m.append("# TYPE artifactory_request_latency_quantile_seconds gauge")
+            for q, value in snap['quantiles']:
+                value = 'NaN' if value is None else round(value / 1000, 6)
+                m.append(f'artifactory_request_latency_quantile_seconds{{quantile="{q}"}} {value}')
+        
+        # 3. 流量 (Gauge)
+        m.append(f"\n# HELP artifactory_traffic_bytes Traffic in last {self.window_size}s window")
+        m.append("# TYPE artifactory_traffic_bytes gauge")
+        m.append(f'artifactory_traffic_bytes{{direction="upload"}} {current[COL_UPLOAD]}')
+        m.append(f'artifactory_traffic_bytes{{direction="download"}} {current[COL_DOWNLOAD]}')
+        
+        # 3a. 单请求吞吐 (Histogram) 与慢速大文件传输
+        self._generate_transfer_metrics(m, snap)
+        
+        # 3b. 多个时间范围的聚合 (Gauge)
+        if snap['ranges']:
+            self._generate_range_metrics(m, snap)
+        
+        # 4. 请求数汇总
+        # 4a. 实时窗口请求数 (Gauge)
+        m.append(f"\n# HELP artifactory_requests_in_window Total requests in current {self.window_size}s window")
+        m.append("# TYPE artifactory_requests_in_window gauge")
+        m.append(f'artifactory_requests_in_window {current[COL_REQUESTS]}')
+        
+        # 4b. 历史累积请求总数 (Counter)
+        m.append("\n# HELP artifactory_requests_total Cumulative total requests since exporter start")
+        m.append("# TYPE artifactory_requests_total counter")
+        m.append(f'artifactory_requests_total {snap["total_requests"]}')
+        
+        # 4c. 按状态码/耗时分层/方向的累计计数 (Counter)
+        self._generate_counter_metrics(m, snap)
+        
+        # 4d. 上一个完整窗口 (Gauge，带时间戳)
+        if 'last_window' in snap:
+            self._generate_last_window_metrics(m, snap)
+        
+        # 5. 按仓库统计 (Counter)
+        if 'repos' in snap:
+            self._generate_repo_metrics(m, snap)
+        
+        # 6. exporter 自身指标
+        self._generate_self_metrics(m)
+
+        m.append(f'\nartifactory_metrics_timestamp {time.time()}')
+        
+        text = "\n".join(m)
+        self.stats.render_count += 1
+        self.stats.render_seconds += time.perf_counter() - render_start
+        return text
+
+class OverloadController:
+    """
+    过载保护：每隔 OVERLOAD_CHECK_INTERVAL 根据未读字节数和日志跟踪线程的 CPU 占用调整采样间隔 N。
+    落后超过 OVERLOAD_LAG_BYTES（或超过 CPU 预算）时 N 翻倍，落后降到 1/4 以下且 CPU 有一倍余量时 N 减半，直到恢复为 1。
+    采样按行号等间隔进行，并跨批次保持间隔连续，计数乘以 N 后是无偏估计。
+    """
+    def __init__(self, stats):
+        self.stats = stats
+        self.rate = 1
+        self.offset = 0  # 下一批中第一个采样行的下标
+        self.checked_at = time.monotonic()
+        self.cpu_at = None  # 日志跟踪线程的 CPU 时间，需在该线程内读取
+
+    def update(self, lag_bytes):
+        if OVERLOAD_MAX_SAMPLE_RATE <= 1:
+            return
+        now = time.monotonic()
+        elapsed = now - self.checked_at
+        if elapsed < OVERLOAD_CHECK_INTERVAL:
+            return
+        cpu_now = time.thread_time()
+        cpu = (cpu_now - self.cpu_at) / elapsed if self.cpu_at is not None else 0.0
+        self.checked_at, self.cpu_at = now, cpu_now
+        over_budget = OVERLOAD_CPU_BUDGET is not None and cpu > OVERLOAD_CPU_BUDGET
+        if lag_bytes > OVERLOAD_LAG_BYTES or over_budget:
+            rate = min(self.rate * 2, OVERLOAD_MAX_SAMPLE_RATE)
+        elif lag_bytes <= OVERLOAD_LAG_BYTES // 4 and (OVERLOAD_CPU_BUDGET is None or cpu * 2 <= OVERLOAD_CPU_BUDGET):
+            rate = max(self.rate // 2, 1)
+        else:
+            rate = self.rate
+        if rate != self.rate:
+            logger.info(f"Sample rate {self.rate} -> {rate} (lag {lag_bytes} bytes, cpu {cpu:.2f})")
+            self.rate = self.stats.sample_rate = rate
+            self.offset = 0
+
+    def sample(self, lines):
+        """返回 (需要解析的行, 采样间隔)"""
+        n = self.rate
+        if n == 1:
+            return lines, 1
+        sampled = lines[self.offset::n]
+        self.offset = (self.offset - len(lines)) % n
+        return sampled, n
+
+class LogTailer(TailPosition):
+    """跟踪一个请求日志文件：读取位置/检查点 (TailPosition)、按块批量解析、轮转与截断处理；由 MultiTailer 在同一线程内驱动"""
+    def __init__(self, log_file: str, metrics: ArtifactoryMetrics, checkpoint_file=CHECKPOINT_FILE, log_format='jfrog'):
+        super().__init__(log_file, checkpoint_file, CHECKPOINT_INTERVAL)
         self.metrics = metrics
-        self.running = False
+        self.format = LOG_FORMATS[log_format]
+        self.fields = pipe_fields(self.format)
+        self.file = None
+        self.pending = b''  # 上一个块末尾未写完的半行
+        self.retry_at = 0   # 文件不存在或出错后，下次尝试打开的时间 (monotonic)
+        self.missing = False
+        metrics.stats.tailer = self
+        self.overload = OverloadController(metrics.stats)
+
+    def consume(self, chunk, pending, f):
+        """把读到的块切分成整行并批量处理，返回末尾未写完的半行"""
+        if pending:
+            chunk = pending + chunk
+        lines = chunk.split(b'\n')
+        pending = lines.pop()
+        self.process_lines(lines, len(chunk) - len(pending))
+        self.offset = f.tell() - len(pending)
+        self.overload.update(os.fstat(f.fileno()).st_size - self.offset)
+        return pending
+
+    def process_lines(self, lines, size):
+        """处理一批完整的行，并记录读取量、解析错误和最后一行的时间戳"""
+        stats = self.metrics.stats
+        stats.lines_read += len(lines)
+        stats.bytes_read += size
+        bad_json = 0
+        try:
+            sampled, n = self.overload.sample(lines)
+            if self.format['type'] == 'json':
+                sampled, bad_json = json_to_pipe(sampled, self.format)
+            batch = parse_request_lines(sampled, self.metrics.slow_requests, self.fields)
+            if n > 1:
+                stats.lines_skipped += len(lines) - len(sampled)
+                batch.scale(n)
+            self.metrics.process_batch(batch)
+        except Exception as e:
+            stats.parse_errors['exception'] += 1
+            logger.debug(f"Batch parse error in {self.log_file}: {e}")
+            return
+        for reason, n in batch.errors.items():
+            stats.parse_errors[reason] += n
+        stats.parse_errors['bad_json'] += bad_json
+        # 末尾可能是空行，取最后一个非空行的时间
+        recent = sampled if self.format['type'] == 'json' else lines
+        for line in reversed(recent):
+            if line:
+                ts_field = self.fields['timestamp']
+                ts = log_time(line if ts_field == 0 else line.split(b'|', ts_field + 1)[ts_field])
+                if ts is not None:
+                    stats.last_line_time = ts
+                break
+
+    def drain(self, f, pending):
+        """轮转后旧文件描述符仍然有效，读完旧文件中剩余的内容"""
+        while True:
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            pending = self.consume(chunk, pending, f)
+        if pending:
+            # 旧文件最后一行没有换行符，也按完整行处理
+            self.process_lines([pending], len(pending))
 
-    def get_inode(self):
-        """获取当前日志文件的 inode，如果文件不存在返回 None"""
+    def open(self, watcher):
+        """打开日志文件并确定起始位置；文件不存在时等目录事件或 5s 后重试"""
         try:
-            return os.stat(self.log_file).st_ino
+            f = open(self.log_file, 'rb')
         except FileNotFoundError:
-            return None
+            if not self.missing:
+                logger.warning(f"Log file {self.log_file} not found, retrying...")
+                self.missing = True
+            watcher.forget(self.log_file)
+            self.retry_at = time.monotonic() + 5
+            return
+        self.seek_start_position(f, created=self.missing)
+        self.missing = False
+        self.file = f
+        self.pending = b''
+        watcher.track(self.log_file, f)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def step(self, watcher):
+        """
+        读取文件中已有的新内容，每轮最多 STEP_CHUNKS 块，避免一个繁忙的日志占满整个循环。
+        返回 True 表示还有未读完的内容，调用方不应阻塞等待。
+        """
+        if self.file is None:
+            if time.monotonic() < self.retry_at:
+                return False
+            self.open(watcher)
+            if self.file is None:
+                return False
+        f = self.file
+        for _ in range(STEP_CHUNKS):
+            chunk = f.read(READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            self.pending = self.consume(chunk, self.pending, f)
+        else:
+            self.save_checkpoint()
+            return True
+        self.save_checkpoint()
+        self.overload.update(0)  # 已读到末尾，逐步恢复逐行统计
+        # copytruncate：inode 不变但文件变小，从头开始读
+        if os.fstat(f.fileno()).st_size < f.tell():
+            logger.info(f"Log truncation detected in {self.log_file}, reading from offset 0...")
+            self.metrics.stats.rotations['truncate'] += 1
+            f.seek(0)
+            self.pending = b''
+            self.offset = 0
+            return True
+        return False
+
+    def reopen(self, watcher):
+        """文件被轮转或新出现：先读完旧文件剩余的内容，再打开新文件"""
+        if self.file is not None:
+            self.drain(self.file, self.pending)
+            self.close()
+            logger.info(f"Log rotation detected in {self.log_file}, reopening file...")
+            self.metrics.stats.rotations['rotate'] += 1
+        self.open(watcher)
+
+    def fail(self, error):
+        """读取出错：关闭文件，1s 后从上次的位置重新打开"""
+        logger.error(f"Tailer error ({self.log_file}): {error}")
+        self.close()
+        self.retry_at = time.monotonic() + 1
+
+    def start(self):
+        """单独跟踪这一个文件"""
+        MultiTailer([self]).start()
+
+class MultiTailer:
+    """
+    在一个线程内跟踪多个日志文件：所有文件共用一个 FileWatcher (一个 inotify fd) 等待事件，
+    每轮依次读取各文件新增的内容，没有待读内容时才阻塞等待，不再为每个文件单独起线程。
+    """
+    def __init__(self, tailers):
+        self.tailers = {tailer.log_file: tailer for tailer in tailers}
+        self.running = False
 
     def start(self):
         self.running = True
-        logger.info(f"Monitoring {self.log_file}")
+        for tailer in self.tailers.values():
+            logger.info(f"Monitoring {tailer.log_file}")
+            tailer.load_checkpoint()
+        watcher = FileWatcher(self.tailers, POLL_MIN_INTERVAL, POLL_MAX_INTERVAL)
         
         while self.running:
-            last_inode = self.get_inode()
-            try:
-                with open(self.log_file, 'r', errors='ignore') as f:
-                    # 首次启动跳到末尾；如果是轮转后重新打开，则从头开始读
-                    # 注意：这里通过判断上一次 inode 是否存在来决定
-                    f.seek(0, 2) 
-                    
-                    while self.running:
-                        line = f.readline()
-                        if not line:
-                            # 读到末尾，检查文件是否被轮转
-                            current_inode = self.get_inode()
-                            if current_inode != last_inode:
-                                logger.info("Log rotation detected, reopening file...")
-                                break  # 跳出内层循环，重新触发 with open
-                            
-                            time.sleep(0.1)
-                            continue
-                            
-                        try:
-                            self.metrics.process_log_entry(LogEntry(line))
-                        except Exception:
-                            continue
-                            
-            except FileNotFoundError:
-                logger.warning(f"Log file {self.log_file} not found, retrying...")
-                time.sleep(5)
-            except Exception as e:
-                logger.error(f"Tailer error: {e}")
-                time.sleep(1)
+            busy = False
+            for tailer in self.tailers.values():
+                try:
+                    busy = tailer.step(watcher) or busy
+                except Exception as e:
+                    tailer.fail(e)
+            # 还有未读完的文件时只检查轮转事件，不等待
+            for path in watcher.wait(0 if busy else 1.0):
+                tailer = self.tailers[path]
+                try:
+                    tailer.reopen(watcher)
+                except Exception as e:
+                    tailer.fail(e)
+        for tailer in self.tailers.values():
+            tailer.save_checkpoint(force=True)
+            tailer.close()
+        watcher.close()
+
+class RequestMonitor:
+    """
+    按 LOG_SOURCES 为每个 service 创建一组 ArtifactoryMetrics + LogTailer，所有日志由一个 MultiTailer 在同一线程内跟踪；
+    /metrics 输出中同名指标族合并在一起，以 service 标签区分。
+    """
+    def __init__(self, sources=None):
+        if sources is None:
+            sources = [{'service': 'artifactory', 'path': LOG_FILE, 'format': 'jfrog'}]
+        self.services = {}  # service -> ArtifactoryMetrics
+        tailers = []
+        for source in sources:
+            service = source['service']
+            log_format = source.get('format', 'jfrog')
+            metrics = ArtifactoryMetrics(pipe_fields(LOG_FORMATS[log_format]))
+            checkpoint = source.get('checkpoint', service_checkpoint_file(service))
+            tailers.append(LogTailer(source['path'], metrics, checkpoint, log_format))
+            self.services[service] = metrics
+        self.tailer = MultiTailer(tailers)
+
+    def start(self):
+        self.tailer.start()
+
+    def generate_metrics(self) -> str:
+        return merge_service_metrics([(service, metrics.generate_metrics()) for service, metrics in self.services.items()])
+
+    def version(self):
+        """任一 service 有新数据、发生轮转、读取落后量变化或进入新窗口时变化"""
+        return (tuple((metrics.version, sum(metrics.stats.rotations.values()), metrics.stats.lag_key())
+                      for metrics in self.services.values()),
+                int(time.time() / WINDOW_SIZE))
+
+    def slow_requests(self, service=None):
+        """service 的 SlowRequestTracker，默认为第一个 service；未开启或不存在时为 None"""
+        metrics = self.services.get(service or next(iter(self.services)))
+        return metrics.slow_requests if metrics is not None else None
+
+def service_checkpoint_file(service):
+    """artifactory 沿用 CHECKPOINT_FILE，其它 service 在其后加上 .<service>"""
+    if not CHECKPOINT_FILE:
+        return None
+    return CHECKPOINT_FILE if service == 'artifactory' else f'{CHECKPOINT_FILE}.{service}'
+
+def merge_service_metrics(parts) -> str:
+    """
+    合并多个 service 的 Prometheus 文本输出：每个样本加上 service 标签，同名指标族的样本放在一起，
+    HELP/TYPE 只保留第一个 service 的（同一族的样本在输出中必须连续）。parts 为 [(service, text)]。
+    """
+    families = {}  # 族名 -> (HELP/TYPE 行, 样本行)，保持首次出现的顺序
+    for service, text in parts:
+        label = f'service="{escape_label(service)}"'
+        name = None
+        headers = samples = None
+        for line in text.split('\n'):
+            if not line:
+                continue
+            if line.startswith('#'):
+                name = line.split(' ', 3)[2]
+                if name not in families:
+                    families[name] = ([], [], service)
+                headers, samples, owner = families[name]
+                if owner == service:
+                    headers.append(line)
+                continue
+            metric, brace, rest = line.partition('{')
+            if brace:
+                line = f'{metric}{{{label},{rest}'
+            else:
+                metric, rest = line.split(' ', 1)
+                line = f'{metric}{{{label}}} {rest}'
+            # 没有 HELP/TYPE 的样本（如 artifactory_metrics_timestamp）自成一族
+            if name is None or not (metric == name or metric.startswith(name + '_')):
+                name = metric
+                if name not in families:
+                    families[name] = ([], [], service)
+                headers, samples, _ = families[name]
+            samples.append(line)
+    return '\n\n'.join('\n'.join(headers + samples) for headers, samples, _ in families.values())
+
+# ========== /metrics 输出 ==========
+def debug_service(path):
+    """/debug/slow?service=router 中的 service，未指定时为 None"""
+    return parse_qs(urlsplit(path).query).get('service', [None])[0]
 
 class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，Prometheus 可复用连接
+
     def do_GET(self):
         if self.path == '/metrics':
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body, compressed = metrics_cache.get(openmetrics, 'gzip' in self.headers.get('Accept-Encoding', ''))
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+        elif self.path.split('?', 1)[0] == '/debug/slow' and request_monitor.slow_requests(debug_service(self.path)) is not None:
+            body = json.dumps(request_monitor.slow_requests(debug_service(self.path)).to_dict(), indent=2).encode('utf-8')
             self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; version=0.0.4')
-            self.end_headers()
-            self.wfile.write(metrics_collector.generate_metrics().encode('utf-8'))
+            self.send_header('Content-Type', 'application/json')
         else:
+            body = b"OK"
             self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"OK")
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     def log_message(self, format, *args): return
 
 def main():
-    global metrics_collector
-    metrics_collector = ArtifactoryMetrics()
-    tailer = LogTailer(LOG_FILE, metrics_collector)
-    threading.Thread(target=tailer.start, daemon=True).start()
-    server = HTTPServer(('0.0.0.0', METRICS_PORT), MetricsHandler)
+    global request_monitor, metrics_cache
+    request_monitor = RequestMonitor(LOG_SOURCES)
+    threading.Thread(target=request_monitor.start, daemon=True).start()
+    # 数据未变化且仍在同一窗口内时复用上次的输出
+    metrics_cache = MetricsCache(request_monitor.generate_metrics, request_monitor.version, GZIP_MIN_SIZE)
+    server = ThreadingHTTPServer(('0.0.0.0', METRICS_PORT), MetricsHandler)
+    server.daemon_threads = True
     logger.info(f"Server started on port {METRICS_PORT} (15s Window)")
     try:
         server.serve_forever()
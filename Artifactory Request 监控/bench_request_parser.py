@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+artifactory_request_exporter 解析性能基准:
+生成一份合成的 artifactory-request.log，分别用逐行模式 (LogEntry + process_log_entry)
+和批量模式 (parse_request_lines + process_batch) 回放，输出每秒处理行数。
+
+python3 bench_request_parser.py --lines 500000
+"""
+
+import argparse
+import random
+import time
+
+from artifactory_request_exporter import (
+    ArtifactoryMetrics, LogEntry, READ_CHUNK_SIZE, parse_request_lines
+)
+
+METHODS = ['GET', 'GET', 'GET', 'HEAD', 'PUT', 'POST']
+STATUS = ['200', '200', '200', '200', '304', '404', '401', '201', '500']
+
+def generate_lines(count, seed=1):
+    """生成合成日志行，字段布局与 artifactory-request.log 一致"""
+    rnd = random.Random(seed)
+    lines = []
+    for i in range(count):
+        lines.append('|'.join([
+            '2026-10-18T08:00:00.%03dZ' % (i % 1000),
+            '%016x' % rnd.getrandbits(64),
+            '10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(1, 254)),
+            'ci-user',
+            rnd.choice(METHODS),
+            '/api/docker/docker-remote/v2/library/busybox/blobs/sha256:%08x' % rnd.getrandbits(32),
+            rnd.choice(STATUS),
+            str(rnd.choice([-1, 0, 512, 4096])),
+            str(rnd.randint(0, 50 * 1024 * 1024)),
+            str(int(rnd.expovariate(1 / 300.0))),
+            'docker/24.0.7 go/go1.20.10',
+        ]) + '\n')
+    return ''.join(lines)
+
+def bench_per_line(text):
+    metrics = ArtifactoryMetrics()
+    start = time.perf_counter()
+    for line in text.splitlines(True):
+        try:
+            metrics.process_log_entry(LogEntry(line))
+        except Exception:
+            continue
+    return time.perf_counter() - start, metrics.total_requests_counter
+
+def bench_batched(data):
+    metrics = ArtifactoryMetrics()
+    start = time.perf_counter()
+    pending = b''
+    for offset in range(0, len(data), READ_CHUNK_SIZE):
+        chunk = data[offset:offset + READ_CHUNK_SIZE]
+        if pending:
+            chunk = pending + chunk
+        lines = chunk.split(b'\n')
+        pending = lines.pop()
+        metrics.process_batch(parse_request_lines(lines))
+    return time.perf_counter() - start, metrics.total_requests_counter
+
+def main():
+    parser = argparse.ArgumentParser(description='Request log parser benchmark')
+    parser.add_argument('--lines', type=int, default=500000, help='合成日志行数')
+    args = parser.parse_args()
+
+    text = generate_lines(args.lines)
+    data = text.encode('utf-8')
+    print(f"Synthetic log: {args.lines} lines, {len(data) / 1024 / 1024:.1f} MiB")
+
+    elapsed, counted = bench_per_line(text)
+    before = counted / elapsed
+    print(f"per-line : {before:12,.0f} lines/s  ({counted} lines in {elapsed:.2f}s)")
+
+    elapsed, counted = bench_batched(data)
+    after = counted / elapsed
+    print(f"batched  : {after:12,.0f} lines/s  ({counted} lines in {elapsed:.2f}s)")
+
+    print(f"speedup  : {after / before:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -4,9 +4,19 @@
 由监控一个端口增加到了可以多个端口, 使用:
 pip3 install prometheus_client
 python3 artifactory_tcp_exporter.py
+
+默认直接读取 /proc/net/tcp 和 /proc/net/tcp6 (Docker 模式下读取 /proc/<容器 PID>/net/tcp*),
+每个周期只读一次即可统计所有端口的所有 TCP 状态, 不再 fork netstat|grep|wc 和 docker exec.
+外部命令 (netstat / docker inspect) 的耗时导出为 tcp_exporter_command_duration_seconds 直方图.
 '''
 
-from prometheus_client import start_http_server, Gauge
+try:
+    from prometheus_client import start_http_server, Gauge, Histogram
+except ImportError:
+    # 作为 jf_node_agent 的采集器加载时只用到计数逻辑，不需要 prometheus_client
+    start_http_server = Gauge = Histogram = None
+from collections import defaultdict
+import bisect
 import subprocess
 import time
 import os
@@ -18,31 +28,62 @@ CONFIG = {
     "monitor_ports": ["8081", "8082"],    # 【改造点1】要监控的端口列表
     "exporter_port": 8000,               # Exporter服务端口
     "refresh_interval": 5,               # 数据刷新间隔(秒)
+    "collector": "procfs",               # procfs: 读取 /proc/net/tcp{,6}; netstat: 旧的 netstat|grep|wc 方式
     
     # 命令配置
     "commands": {
         "base_netstat": "netstat -anpt",  # 基础netstat命令
         "established_filter": "ESTABLISHED",
         "timewait_filter": "TIME_WAIT"
-    }
+    },
+    # execute_command 耗时直方图的桶边界（秒）
+    "command_duration_buckets": [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
 }
 # ======================================================================
 
 # 创建Prometheus指标
 # 【改造点2】指标定义不变，但标签 'port' 的值会是列表中的每一个端口
-metrics = {
+metrics = {} if Gauge is None else {
     'established': Gauge('tcp_port_established', 'Number of ESTABLISHED connections', ['port']),
-    'timewait': Gauge('tcp_port_timewait', 'Number of TIME_WAIT connections', ['port'])
+    'timewait': Gauge('tcp_port_timewait', 'Number of TIME_WAIT connections', ['port']),
+    'state': Gauge('tcp_port_connections', 'Number of TCP connections by state', ['port', 'state']),
+    'command_duration': Histogram('tcp_exporter_command_duration_seconds', 'Duration of external commands run by the exporter',
+                                  ['command'], buckets=CONFIG["command_duration_buckets"])
+}
+
+# /proc/net/tcp 中 st 列的十六进制取值 (见 include/net/tcp_states.h)
+TCP_STATES = {
+    '01': 'established', '02': 'syn_sent', '03': 'syn_recv', '04': 'fin_wait1',
+    '05': 'fin_wait2', '06': 'time_wait', '07': 'close', '08': 'close_wait',
+    '09': 'last_ack', '0A': 'listen', '0B': 'closing', '0C': 'new_syn_recv'
 }
 
+container_pid = 0  # Docker 模式下缓存的容器主进程 PID
+
+# 命令名 (netstat / docker) -> [各桶计数 (最后一个为 +Inf), 总耗时]；不依赖 prometheus_client，供 jf_node_agent 输出
+command_durations = {}
+
+def observe_command_duration(cmd, seconds):
+    command = cmd.split(None, 1)[0] if cmd.strip() else 'unknown'
+    stats = command_durations.get(command)
+    if stats is None:
+        stats = command_durations[command] = [[0] * (len(CONFIG["command_duration_buckets"]) + 1), 0.0]
+    stats[0][bisect.bisect_left(CONFIG["command_duration_buckets"], seconds)] += 1
+    stats[1] += seconds
+    if 'command_duration' in metrics:
+        metrics['command_duration'].labels(command=command).observe(seconds)
+
 def execute_command(cmd):
     """执行命令并返回整数结果"""
+    start = time.perf_counter()
     try:
         result = subprocess.getoutput(cmd)
         return int(result.strip() or 0)
     except Exception as e:
         print(f"Command execution error: {e}\nCommand: {cmd}")
         return 0
+    finally:
+        observe_command_duration(cmd, time.perf_counter() - start)
 
 def build_netstat_cmd(port, filter_type): # 【改造点3】函数增加 port 参数
     """构建netstat命令，接收端口和过滤类型作为参数"""
@@ -66,15 +107,67 @@ def get_connection_counts_for_port(port): # 【改造点4】为新函数命名
         execute_command(timewait_cmd)
     )
 
+def get_proc_net_dir():
+    """返回 tcp/tcp6 表所在目录；Docker 模式下为容器网络命名空间对应的 /proc/<pid>/net"""
+    global container_pid
+    if not CONFIG["use_docker"]:
+        return '/proc/net'
+    if not container_pid:
+        # 只在首次或容器重启后解析一次 PID
+        container_pid = execute_command(f'docker inspect -f "{{{{.State.Pid}}}}" {CONFIG["container_name"]}')
+    return f'/proc/{container_pid}/net'
+
+def read_socket_states(ports):
+    """一次遍历 tcp 与 tcp6 表，返回 {port: {state: count}}；本地或远端端口匹配即计入（与 grep :port 一致）"""
+    global container_pid
+    wanted = {'%04X' % int(port): port for port in ports}
+    counts = {port: defaultdict(int) for port in ports}
+    net_dir = get_proc_net_dir()
+
+    for table in ('tcp', 'tcp6'):
+        try:
+            with open(os.path.join(net_dir, table)) as f:
+                next(f, None)  # 表头
+                for line in f:
+                    # sl local_address rem_address st ...，地址格式为 HEXIP:HEXPORT
+                    fields = line.split(None, 4)
+                    local_port = wanted.get(fields[1][-4:])
+                    remote_port = wanted.get(fields[2][-4:])
+                    if local_port is None and remote_port is None:
+                        continue
+                    state = TCP_STATES.get(fields[3], fields[3])
+                    if local_port is not None:
+                        counts[local_port][state] += 1
+                    if remote_port is not None and remote_port != local_port:
+                        counts[remote_port][state] += 1
+        except FileNotFoundError:
+            if table == 'tcp' and CONFIG["use_docker"]:
+                # 容器已重启，下个周期重新解析 PID
+                print(f"Cannot read {net_dir}/tcp, container PID {container_pid} is gone")
+                container_pid = 0
+                break
+            # tcp6 不存在说明未启用 IPv6，忽略
+    return counts
+
 def update_metrics():
     """定期更新所有端口的指标"""
     while True:
         all_ports = CONFIG["monitor_ports"]
         print(f"Updating metrics for ports: {', '.join(all_ports)}...") # 打印正在更新的端口
         
+        use_procfs = CONFIG["collector"] == "procfs"
+        if use_procfs:
+            socket_states = read_socket_states(all_ports)
+        
         for port in all_ports: # 【改造点5】遍历端口列表
-            established, timewait = get_connection_counts_for_port(port)
             port_label = {'port': port} # 为每个端口创建标签
+            if use_procfs:
+                states = socket_states[port]
+                established, timewait = states['established'], states['time_wait']
+                for state in TCP_STATES.values():
+                    metrics['state'].labels(port=port, state=state).set(states[state])
+            else:
+                established, timewait = get_connection_counts_for_port(port)
             
             # 更新 Prometheus 指标，标签为当前端口
             metrics['established'].labels(**port_label).set(established)
@@ -4,24 +4,130 @@
 S3 Connection Pool Monitor:
 chmod +x s3_connection_exporter.py
 nohup python3 s3_connection_exporter.py &
+
+日志轮转时先读完旧文件剩余内容，新文件从头读取；兼容 copytruncate 方式的轮转。
+按路由（S3 endpoint）解析 HttpClient 连接池的 request/leased/released 日志：leased/pending/allocated 及上一个完整
+统计窗口（WINDOW_SIZE 秒，按墙上时钟对齐）内的最小值、最大值、时间加权平均值，
+以及 Connection request -> Connection leased 的等待时间直方图。
+/metrics 为多线程 HTTP/1.1 (keep-alive) 服务，输出在数据变化时才重新生成；按 Accept-Encoding/Accept 支持 gzip 和 OpenMetrics。
+s3_connection_exporter_* 为 exporter 自身的运行指标：读取行数/字节数、按原因的解析错误、读取延迟、轮转次数、锁等待和渲染耗时。
 """
 
 import os
 import time
 import re
+import bisect
 import threading
 import logging
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import sys
+
+try:
+    from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+except ImportError:
+    # 在仓库中直接运行时，共用模块位于 jf_monitoring_node/scripts/；部署时与本脚本放在同一目录
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jf_monitoring_node', 'scripts'))
+    from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+from log_tail import ExporterStats, FileWatcher, TailPosition, log_time
 
 # ============ 变量配置 ============
 LOG_FILE_PATH = '/var/opt/jfrog/artifactory/log/artifactory-connectionpool.log'
 HTTP_PORT = 8001
 WINDOW_SIZE = 15
+POLL_MIN_INTERVAL = 0.01  # inotify 不可用时的最小轮询间隔（秒）
+POLL_MAX_INTERVAL = 1.0   # 日志空闲时退避到的最大轮询间隔（秒）
+# 读取位置检查点 (inode, offset)，重启后从上次停止处继续读取；置为 None 则不持久化
+CHECKPOINT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.s3_connection_exporter.checkpoint')
+CHECKPOINT_INTERVAL = 5  # 检查点最短写入间隔（秒）
+GZIP_MIN_SIZE = 1024  # 客户端支持 gzip 且输出超过此字节数时压缩
+# 从 Connection request 到 Connection leased 的等待时间直方图的桶边界（秒）
+LEASE_WAIT_BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# Connection request 超过此秒数（按日志时间）仍未 leased 视为已超时或取消，不再计入 pending
+LEASE_REQUEST_TIMEOUT = 120
 # =================================
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# HttpClient PoolingHttpClientConnectionManager 的 debug 日志，例如:
+# ... [http-nio-8081-exec-5] - Connection request: [route: {s}->https://bucket.s3.amazonaws.com:443][total available: 0; route allocated: 2 of 50; total allocated: 2 of 50]
+# ... [http-nio-8081-exec-5] - Connection leased: [id: 7][route: {s}->https://bucket.s3.amazonaws.com:443][total available: 0; route allocated: 3 of 50; total allocated: 3 of 50]
+POOL_LINE_RE = re.compile(
+    rb'^(\S+) .*\[([^\]]*)\] - Connection (request|leased|released): (?:\[id: (\d+)\])?'
+    rb'\[route: ([^\]]*)\](?:\[state: [^\]]*\])?'
+    rb'\[total (?:available|kept alive): (\d+); route allocated: (\d+) of (\d+); total allocated: (\d+) of (\d+)\]'
+)
+# 其它格式中只能识别连接池总数的行
+ALLOCATED_RE = re.compile(rb'total allocated: (\d+) of (\d+)')
+
+def route_label(route: bytes) -> str:
+    """{s}->https://bucket.s3.amazonaws.com:443 -> https://bucket.s3.amazonaws.com:443（经代理时取最后一跳）"""
+    return route.rsplit(b'->', 1)[-1].decode('utf-8', 'ignore').replace('\\', '\\\\').replace('"', '\\"')
+
+class GaugeStats:
+    """一个瞬时值在固定的 WINDOW_SIZE 秒时间窗口（按墙上时钟对齐）内的最小值、最大值和按时间加权的平均值；
+    读取时只返回上一个完整窗口的结果而不重置，多个抓取方看到的是同一组数据"""
+    __slots__ = ['value', 'min', 'max', 'area', 'window', 'since', 'last', 'completed']
+
+    def __init__(self, value, now):
+        self.value = self.min = self.max = value
+        self.area = 0.0
+        self.window = int(now // WINDOW_SIZE)
+        self.since = self.last = now
+        # 上一个完整窗口的 (最小值, 最大值, 平均值)
+        self.completed = (value, value, value)
+
+    def advance(self, now):
+        """把当前值累加到 now，跨过窗口边界时结束当前窗口"""
+        window = int(now // WINDOW_SIZE)
+        if window > self.window:
+            end = (self.window + 1) * WINDOW_SIZE
+            self.area += self.value * (end - self.last)
+            if window == self.window + 1:
+                span = end - self.since
+                self.completed = (self.min, self.max, self.area / span if span > 0 else self.value)
+            else:
+                # 中间隔着没有任何变化的完整窗口
+                self.completed = (self.value, self.value, self.value)
+            self.window = window
+            self.min = self.max = self.value
+            self.area = 0.0
+            self.since = self.last = window * WINDOW_SIZE
+        if now > self.last:
+            self.area += self.value * (now - self.last)
+            self.last = now
+
+    def set(self, value, now):
+        self.advance(now)
+        self.value = value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def collect(self, now):
+        """返回 (当前值, 最小值, 最大值, 平均值)，后三项为上一个完整窗口的统计，读取不改变统计区间"""
+        self.advance(now)
+        return (self.value,) + self.completed
+
+class RouteState:
+    """一个路由（S3 endpoint）的连接池状态"""
+    def __init__(self, allocated, now):
+        self.leased = GaugeStats(0, now)
+        self.pending = GaugeStats(0, now)
+        self.allocated = GaugeStats(allocated, now)
+        self.route_max = 0
+        # 所在连接池的总数（一个 binary provider 对应一个连接池）
+        self.total_allocated = 0
+        self.total_max = 0
+        self.total_available = 0
+        self.leased_ids = set()
+        self.waiting = {}  # 线程 -> 发出 Connection request 的日志时间（时间戳无法解析时为 None）
+        self.wait_counts = [0] * (len(LEASE_WAIT_BUCKETS) + 1)  # 最后一个为 +Inf
+        self.wait_sum = 0.0
+
+PARSE_ERROR_REASONS = ('bad_format', 'bad_timestamp', 'exception')
+
 class S3ConnectionMetrics:
     def __init__(self):
         self.lock = threading.Lock()
@@ -29,32 +135,190 @@ class S3ConnectionMetrics:
         self.max_connections = 50
         # 记录最近一次看到的值，防止日志静默时指标直接跳 0（针对连接池状态）
         self.last_update_time = time.time()
+        # 每次更新加 1，/metrics 据此判断缓存的输出是否过期
+        self.version = 0
+        # 按路由的连接池状态，route 标签 -> RouteState
+        self.routes = {}
+        self.stats = ExporterStats(PARSE_ERROR_REASONS)
+        self.next_expire = 0  # 下次检查过期 Connection request 的日志时间
         
-    def parse_log_line(self, line):
-        """解析日志行，提取连接数信息"""
-        # 匹配逻辑：Connection request ... total allocated: 12 of 50
-        if 'total allocated:' in line:
-            pattern = r'total allocated: (\d+) of (\d+)'
-            match = re.search(pattern, line)
-            if match:
-                try:
-                    return int(match.group(1)), int(match.group(2))
-                except ValueError:
-                    pass
-        return None, None
+    def process_line(self, line: bytes):
+        """解析一行连接池日志；完整的 request/leased/released 行按路由更新，其它行只更新总数"""
+        match = POOL_LINE_RE.match(line)
+        if match is None:
+            if b'total allocated:' in line:
+                m = ALLOCATED_RE.search(line)
+                if m:
+                    self.update(int(m.group(1)), int(m.group(2)))
+                else:
+                    self.stats.parse_errors['bad_format'] += 1
+            return
+        ts, thread, event, conn_id, route, total_available, allocated, route_max, total_allocated, total_max = match.groups()
+        label = route_label(route)
+        allocated = int(allocated)
+        at = log_time(ts)
+        if at is None:
+            self.stats.parse_errors['bad_timestamp'] += 1
+        else:
+            self.stats.last_line_time = at
+        now = time.time()
+        wait_start = time.perf_counter()
+        with self.lock:
+            self.stats.lock_wait['ingest'] += time.perf_counter() - wait_start
+            state = self.routes.get(label)
+            if state is None:
+                state = self.routes[label] = RouteState(allocated, now)
+            state.allocated.set(allocated, now)
+            state.route_max = int(route_max)
+            state.total_allocated = int(total_allocated)
+            state.total_max = int(total_max)
+            state.total_available = int(total_available)
+            if event == b'request':
+                # 一个线程同时只等待一次租用，同一线程的新请求说明此前（可能在其它路由上）的请求已超时或取消
+                for other in self.routes.values():
+                    if other is not state and thread in other.waiting:
+                        del other.waiting[thread]
+                        other.pending.set(len(other.waiting), now)
+                state.waiting[thread] = at
+            elif event == b'leased':
+                started = state.waiting.pop(thread, None)
+                if started is not None and at is not None:
+                    wait = max(0.0, at - started)
+                    state.wait_counts[bisect.bisect_left(LEASE_WAIT_BUCKETS, wait)] += 1
+                    state.wait_sum += wait
+                state.leased_ids.add(conn_id)
+            else:
+                state.leased_ids.discard(conn_id)
+            state.leased.set(len(state.leased_ids), now)
+            state.pending.set(len(state.waiting), now)
+            self.expire_waiting(at, now)
+            self.current_connections = state.total_allocated
+            self.max_connections = state.total_max
+            self.last_update_time = now
+            self.version += 1
+
+    def expire_waiting(self, at, now):
+        """
+        丢弃超过 LEASE_REQUEST_TIMEOUT 仍未 leased 的 Connection request（超时、取消或 leased 行在轮转中丢失），
+        否则 pending 只增不减。按日志时间至多每秒检查一次，调用方持有 self.lock
+        """
+        if at is None or at < self.next_expire:
+            return
+        self.next_expire = at + 1
+        deadline = at - LEASE_REQUEST_TIMEOUT
+        for state in self.routes.values():
+            expired = [thread for thread, started in state.waiting.items() if started is None or started < deadline]
+            if expired:
+                for thread in expired:
+                    del state.waiting[thread]
+                state.pending.set(len(state.waiting), now)
 
     def update(self, current, max_conn):
+        wait_start = time.perf_counter()
         with self.lock:
+            self.stats.lock_wait['ingest'] += time.perf_counter() - wait_start
             self.current_connections = current
             self.max_connections = max_conn
             self.last_update_time = time.time()
+            self.version += 1
+
+    def _generate_route_metrics(self, m, routes):
+        """按路由的连接池指标；*_min/_max/_avg 为上一个完整统计窗口（WINDOW_SIZE 秒）内的最小值、最大值和时间加权平均值"""
+        for name, help_text in (('leased', 'Connections leased from the pool'),
+                                ('pending', 'Threads waiting for a connection lease'),
+                                ('allocated', 'Connections allocated (leased + idle)')):
+            m.append(f'\n# HELP s3_pool_{name} {help_text} per route')
+            m.append(f'# TYPE s3_pool_{name} gauge')
+            for route, r in routes:
+                m.append(f's3_pool_{name}{{route="{route}"}} {r[name][0]}')
+            for i, stat in ((1, 'min'), (2, 'max'), (3, 'avg')):
+                m.append(f'# HELP s3_pool_{name}_{stat} {help_text} per route, {stat} over the last completed {WINDOW_SIZE}s window')
+                m.append(f'# TYPE s3_pool_{name}_{stat} gauge')
+                for route, r in routes:
+                    value = round(r[name][i], 3) if stat == 'avg' else r[name][i]
+                    m.append(f's3_pool_{name}_{stat}{{route="{route}"}} {value}')
+        
+        m.append('\n# HELP s3_pool_available Idle connections per route (allocated - leased)')
+        m.append('# TYPE s3_pool_available gauge')
+        for route, r in routes:
+            m.append(f's3_pool_available{{route="{route}"}} {max(0, r["allocated"][0] - r["leased"][0])}')
+        for name, key, help_text in (('route_max', 'route_max', 'Maximum connections per route'),
+                                     ('total_allocated', 'total_allocated', 'Connections allocated in the pool serving the route'),
+                                     ('total_available', 'total_available', 'Idle connections in the pool serving the route'),
+                                     ('total_max', 'total_max', 'Maximum connections of the pool serving the route')):
+            m.append(f'# HELP s3_pool_{name} {help_text}')
+            m.append(f'# TYPE s3_pool_{name} gauge')
+            for route, r in routes:
+                m.append(f's3_pool_{name}{{route="{route}"}} {r[key]}')
+        
+        m.append('\n# HELP s3_pool_lease_wait_seconds Time from Connection request to Connection leased per route')
+        m.append('# TYPE s3_pool_lease_wait_seconds histogram')
+        for route, r in routes:
+            cumulative = 0
+            for bound, n in zip(LEASE_WAIT_BUCKETS, r['wait_counts']):
+                cumulative += n
+                m.append(f's3_pool_lease_wait_seconds_bucket{{route="{route}",le="{bound}"}} {cumulative}')
+            cumulative += r['wait_counts'][-1]
+            m.append(f's3_pool_lease_wait_seconds_bucket{{route="{route}",le="+Inf"}} {cumulative}')
+            m.append(f's3_pool_lease_wait_seconds_sum{{route="{route}"}} {round(r["wait_sum"], 6)}')
+            m.append(f's3_pool_lease_wait_seconds_count{{route="{route}"}} {cumulative}')
+
+    def _generate_self_metrics(self, m):
+        """exporter 自身的运行指标，渲染耗时为此前各次渲染的累计值"""
+        stats = self.stats
+        m.append('\n# HELP s3_connection_exporter_lines_read_total Log lines read by the exporter')
+        m.append('# TYPE s3_connection_exporter_lines_read_total counter')
+        m.append(f's3_connection_exporter_lines_read_total {stats.lines_read}')
+        m.append('# HELP s3_connection_exporter_bytes_read_total Log bytes read by the exporter')
+        m.append('# TYPE s3_connection_exporter_bytes_read_total counter')
+        m.append(f's3_connection_exporter_bytes_read_total {stats.bytes_read}')
+        m.append('# HELP s3_connection_exporter_parse_errors_total Connection pool log lines that failed to parse')
+        m.append('# TYPE s3_connection_exporter_parse_errors_total counter')
+        for reason, n in stats.parse_errors.items():
+            m.append(f's3_connection_exporter_parse_errors_total{{reason="{reason}"}} {n}')
+        m.append('# HELP s3_connection_exporter_rotations_total Log rotations (rotate) and copytruncate truncations (truncate) seen')
+        m.append('# TYPE s3_connection_exporter_rotations_total counter')
+        for kind, n in stats.rotations.items():
+            m.append(f's3_connection_exporter_rotations_total{{type="{kind}"}} {n}')
+        lag = stats.tail_lag()
+        if lag is not None:
+            m.append("# HELP s3_connection_exporter_tail_lag_bytes Log file size minus the exporter's read offset")
+            m.append('# TYPE s3_connection_exporter_tail_lag_bytes gauge')
+            m.append(f's3_connection_exporter_tail_lag_bytes {lag[0]}')
+            m.append('# HELP s3_connection_exporter_tail_lag_seconds Now minus the timestamp of the last pool line read (0 when caught up)')
+            m.append('# TYPE s3_connection_exporter_tail_lag_seconds gauge')
+            m.append(f's3_connection_exporter_tail_lag_seconds {round(lag[1], 3)}')
+        m.append('# HELP s3_connection_exporter_lock_wait_seconds_total Time spent waiting for the metrics lock')
+        m.append('# TYPE s3_connection_exporter_lock_wait_seconds_total counter')
+        for op, seconds in stats.lock_wait.items():
+            m.append(f's3_connection_exporter_lock_wait_seconds_total{{op="{op}"}} {round(seconds, 6)}')
+        m.append('# HELP s3_connection_exporter_render_duration_seconds Time spent rendering /metrics')
+        m.append('# TYPE s3_connection_exporter_render_duration_seconds summary')
+        m.append(f's3_connection_exporter_render_duration_seconds_sum {round(stats.render_seconds, 6)}')
+        m.append(f's3_connection_exporter_render_duration_seconds_count {stats.render_count}')
 
     def generate_metrics(self):
+        render_start = time.perf_counter()
+        now = time.time()
+        wait_start = time.perf_counter()
         with self.lock:
+            self.stats.lock_wait['render'] += time.perf_counter() - wait_start
             # 如果超过 60s 没收到新日志，连接池可能已空或静默
             # 这里可以根据业务决定是否要清零。连接池通常在没日志时代表没变化，所以保留旧值
             curr = self.current_connections
             mx = self.max_connections
+            # 锁内只复制数据（collect 按墙上时钟滚动到当前窗口，返回上一个完整窗口的统计），格式化在锁外进行
+            routes = [(route, {
+                'leased': state.leased.collect(now),
+                'pending': state.pending.collect(now),
+                'allocated': state.allocated.collect(now),
+                'route_max': state.route_max,
+                'total_allocated': state.total_allocated,
+                'total_available': state.total_available,
+                'total_max': state.total_max,
+                'wait_counts': list(state.wait_counts),
+                'wait_sum': state.wait_sum,
+            }) for route, state in sorted(self.routes.items())]
         
         usage_pct = (curr / mx * 100) if mx > 0 else 0
         
@@ -74,72 +338,121 @@ class S3ConnectionMetrics:
             f'# HELP s3_connection_available Available S3 connections',
             f'# TYPE s3_connection_available gauge',
             f's3_connection_available{{source="artifactory",target="localhost:8046"}} {mx - curr}',
-            f'',
-            f'artifactory_s3_metrics_timestamp {time.time()}'
         ]
-        return "\n".join(metrics)
+        if routes:
+            self._generate_route_metrics(metrics, routes)
+        self._generate_self_metrics(metrics)
+        metrics.append(f'\nartifactory_s3_metrics_timestamp {time.time()}')
+        text = "\n".join(metrics)
+        self.stats.render_count += 1
+        self.stats.render_seconds += time.perf_counter() - render_start
+        return text
 
-class LogTailer:
-    def __init__(self, log_file, metrics):
-        self.log_file = log_file
+class LogTailer(TailPosition):
+    """跟踪连接池日志：读取位置/检查点 (TailPosition)、逐行解析、轮转与截断处理"""
+    def __init__(self, log_file, metrics, checkpoint_file=CHECKPOINT_FILE):
+        super().__init__(log_file, checkpoint_file, CHECKPOINT_INTERVAL)
         self.metrics = metrics
+        self.missing = False  # 上次打开时文件不存在
+        metrics.stats.tailer = self
 
-    def get_inode(self):
+    def handle_line(self, line):
+        stats = self.metrics.stats
+        stats.lines_read += 1
+        stats.bytes_read += len(line)
         try:
-            return os.stat(self.log_file).st_ino
-        except FileNotFoundError:
-            return None
+            self.metrics.process_line(line)
+        except Exception as e:
+            # 单行解析失败只计数，不影响后续行的读取
+            stats.parse_errors['exception'] += 1
+            logger.debug(f"Line parse error: {e}")
 
     def start(self):
         logger.info(f"Starting LogTailer for {self.log_file}")
+        # 从检查点继续，重启期间写入的 request/leased 行仍能配对，直方图不丢数据
+        self.load_checkpoint()
+        watcher = FileWatcher([self.log_file], POLL_MIN_INTERVAL, POLL_MAX_INTERVAL)
         while True:
-            last_inode = self.get_inode()
             try:
-                with open(self.log_file, 'r', errors='ignore') as f:
-                    # 第一次打开跳到末尾
-                    f.seek(0, 2)
+                with open(self.log_file, 'rb') as f:
+                    self.seek_start_position(f, created=self.missing)
+                    self.missing = False
+                    watcher.track(self.log_file, f)
+                    pending = b''  # 尚未写完（没有换行符）的半行
                     while True:
                         line = f.readline()
-                        if not line:
-                            # 检查 inode 是否变化（轮转检查）
-                            if self.get_inode() != last_inode:
-                                logger.info("Log rotation detected in connectionpool.log")
-                                break
-                            time.sleep(1)
+                        if line:
+                            if not line.endswith(b'\n'):
+                                pending += line
+                                continue
+                            self.handle_line(pending + line)
+                            pending = b''
+                            self.offset = f.tell()
+                            self.save_checkpoint()
+                            continue
+
+                        # copytruncate：inode 不变但文件变小，从头开始读
+                        if os.fstat(f.fileno()).st_size < f.tell():
+                            logger.info("Log truncation detected in connectionpool.log")
+                            self.metrics.stats.rotations['truncate'] += 1
+                            f.seek(0)
+                            pending = b''
+                            self.offset = 0
                             continue
-                        
-                        curr, mx = self.metrics.parse_log_line(line)
-                        if curr is not None:
-                            self.metrics.update(curr, mx)
+                        # 已读到末尾：写入限频期间未保存的位置，再等待 inotify 事件；轮转时先读完旧文件剩余内容再重新打开
+                        self.save_checkpoint()
+                        if watcher.wait():
+                            for line in f:
+                                self.handle_line(pending + line)
+                                pending = b''
+                            logger.info("Log rotation detected in connectionpool.log")
+                            self.metrics.stats.rotations['rotate'] += 1
+                            break
             except FileNotFoundError:
-                time.sleep(5)
+                # 等文件重新出现（目录事件）或 5s 后重试
+                self.missing = True
+                watcher.forget(self.log_file)
+                watcher.wait(5)
             except Exception as e:
                 logger.error(f"Tailer Error: {e}")
                 time.sleep(2)
 
+# ========== /metrics 输出 ==========
 class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，Prometheus 可复用连接
+
     def do_GET(self):
         if self.path == '/metrics':
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body, compressed = metrics_cache.get(openmetrics, 'gzip' in self.headers.get('Accept-Encoding', ''))
             self.send_response(200)
-            self.send_header('Content-Type', 'text/plain; version=0.0.4')
-            self.end_headers()
-            self.wfile.write(metrics_collector.generate_metrics().encode('utf-8'))
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
         else:
+            body = b""
             self.send_response(404)
-            self.end_headers()
-
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
     def log_message(self, format, *args): return
 
 def main():
-    global metrics_collector
+    global metrics_collector, metrics_cache
     metrics_collector = S3ConnectionMetrics()
     
     # 启动日志监听线程
     tailer = LogTailer(LOG_FILE_PATH, metrics_collector)
     threading.Thread(target=tailer.start, daemon=True).start()
     
-    # 启动服务器
-    server = HTTPServer(('0.0.0.0', HTTP_PORT), MetricsHandler)
+    # 启动服务器，数据未变化且仍在同一窗口内时复用上次的输出（读取行数、轮转次数、读取落后量变化也视为数据变化）
+    stats = metrics_collector.stats
+    metrics_cache = MetricsCache(metrics_collector.generate_metrics,
+                                 lambda: (metrics_collector.version, stats.lines_read, sum(stats.rotations.values()),
+                                          stats.lag_key(), int(time.time() / WINDOW_SIZE)),
+                                 GZIP_MIN_SIZE)
+    server = ThreadingHTTPServer(('0.0.0.0', HTTP_PORT), MetricsHandler)
+    server.daemon_threads = True
     logger.info(f"S3 Metrics Exporter running on port {HTTP_PORT}")
     try:
         server.serve_forever()
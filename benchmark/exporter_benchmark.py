@@ -0,0 +1,564 @@
+#!/usr/bin/env python3
+"""
+exporter 端到端基准:
+按设定的速率写入合成的 artifactory-request.log / artifactory-connectionpool.log（期间交替做 rename 和 copytruncate 轮转），
+以子进程启动对应的 exporter 跟踪这些日志，同时有多个客户端并发抓取 /metrics，输出:
+- 持续处理速率（行/秒）和每百万行消耗的 CPU 秒数、RSS
+- 读取延迟分位数（写入一行到 exporter 计入该行的时间）
+- 并发抓取时 /metrics 的响应时间分位数
+- 准确性: 写完并等 exporter 追上后，把计数类指标与生成器记录的真实值逐项比对（含轮转次数）
+结果为 JSON，可保存下来对比不同版本之间的回归。只支持 Linux（从 /proc 读取 exporter 进程的 CPU 和内存）。
+
+python3 exporter_benchmark.py --rate 20000 --duration 30 --rotate-every 10 -o result.json
+python3 exporter_benchmark.py --exporter request --rate 0 --duration 20 --compare result.json
+"""
+
+import argparse
+import bisect
+import gzip
+import http.client
+import json
+import os
+import platform
+import random
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 在子进程中加载 exporter 脚本，覆盖配置常量后运行 main()
+LAUNCHER = '''
+import importlib.util, json, sys
+path, settings = sys.argv[1], json.loads(sys.argv[2])
+spec = importlib.util.spec_from_file_location('exporter', path)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+for key, value in settings.items():
+    setattr(module, key, value)
+module.main()
+'''
+
+METHODS = ['GET', 'GET', 'GET', 'HEAD', 'PUT', 'POST']
+STATUS = ['200', '200', '200', '200', '304', '404', '401', '201', '500']
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+def utc_timestamp(t):
+    """2026-10-18T08:00:00.123Z，与 Artifactory 日志第 0 列格式一致"""
+    return time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(t)) + '.%03dZ' % (int(t * 1000) % 1000)
+
+class RequestLogGenerator:
+    """artifactory-request.log 的合成流量，同时记录写入内容的真实计数"""
+    log_name = 'artifactory-request.log'
+
+    def __init__(self, seed=1, bad_line_ratio=0.0, pool_size=10000):
+        rnd = random.Random(seed)
+        # 预先生成一批行（不含时间戳）及其计数，写入时只拼接时间戳
+        self.pool = []
+        for _ in range(pool_size):
+            if rnd.random() < bad_line_ratio:
+                self.pool.append(('|%016x|10.0.0.1|ci-user|GET\n' % rnd.getrandbits(64), None, 0, 0))
+                continue
+            status = rnd.choice(STATUS)
+            upload = rnd.choice([-1, 0, 512, 4096])
+            download = rnd.randint(0, 50 * 1024 * 1024)
+            self.pool.append(('|'.join([
+                '',
+                '%016x' % rnd.getrandbits(64),
+                '10.0.%d.%d' % (rnd.randint(0, 255), rnd.randint(1, 254)),
+                'ci-user',
+                rnd.choice(METHODS),
+                '/api/docker/docker-remote/v2/library/busybox/blobs/sha256:%08x' % rnd.getrandbits(32),
+                status,
+                str(upload),
+                str(download),
+                str(int(rnd.expovariate(1 / 300.0))),
+                'docker/24.0.7 go/go1.20.10',
+            ]) + '\n', status, max(upload, 0), download))
+        self.index = 0
+        self.requests = 0
+        self.short_lines = 0
+        self.by_code = {}
+        self.upload = 0
+        self.download = 0
+
+    def lines(self, count, now):
+        ts = utc_timestamp(now)
+        pool, size = self.pool, len(self.pool)
+        out = []
+        for _ in range(count):
+            suffix, status, upload, download = pool[self.index]
+            self.index = (self.index + 1) % size
+            out.append(ts + suffix)
+            if status is None:
+                self.short_lines += 1
+                continue
+            self.requests += 1
+            self.by_code[status] = self.by_code.get(status, 0) + 1
+            self.upload += upload
+            self.download += download
+        return ''.join(out)
+
+    def checks(self, samples, lines_written, rotations):
+        """[(指标, 期望值, 实际值)]；多服务输出带 service 标签，这里只有一个 service，比对时忽略"""
+        checks = [
+            ('artifactory_request_exporter_lines_read_total', lines_written,
+             metric_value(samples, 'artifactory_request_exporter_lines_read_total')),
+            ('artifactory_requests_total', self.requests, metric_value(samples, 'artifactory_requests_total')),
+            ('artifactory_request_exporter_parse_errors_total{reason="short_line"}', self.short_lines,
+             metric_value(samples, 'artifactory_request_exporter_parse_errors_total', reason='short_line')),
+            ('artifactory_traffic_bytes_total{direction="upload"}', self.upload,
+             metric_value(samples, 'artifactory_traffic_bytes_total', direction='upload')),
+            ('artifactory_traffic_bytes_total{direction="download"}', self.download,
+             metric_value(samples, 'artifactory_traffic_bytes_total', direction='download')),
+        ]
+        for code, n in sorted(self.by_code.items()):
+            checks.append((f'artifactory_requests_by_code_total{{code="{code}"}}', n,
+                           metric_value(samples, 'artifactory_requests_by_code_total', code=code)))
+        for kind, n in rotations.items():
+            checks.append((f'artifactory_request_exporter_rotations_total{{type="{kind}"}}', n,
+                           metric_value(samples, 'artifactory_request_exporter_rotations_total', type=kind)))
+        return checks
+
+class PoolLogGenerator:
+    """artifactory-connectionpool.log 的合成流量：若干线程按 request -> leased -> released 循环借还连接"""
+    log_name = 'artifactory-connectionpool.log'
+
+    def __init__(self, seed=1, threads=40, routes=2, pool_max=50):
+        self.rnd = random.Random(seed)
+        self.routes = ['{s}->https://bucket-%d.s3.amazonaws.com:443' % i for i in range(routes)]
+        self.threads = ['http-nio-8081-exec-%d' % (i + 1) for i in range(threads)]
+        # 线程 -> (状态, 路由, 连接 id)；状态 idle/waiting/leased
+        self.state = {thread: ('idle', None, None) for thread in self.threads}
+        self.pool_max = pool_max
+        self.next_id = 0
+        self.leased = {route: set() for route in self.routes}
+        self.route_allocated = {route: 0 for route in self.routes}
+        # 真实值
+        self.lease_waits = {route: 0 for route in self.routes}
+        self.total_allocated = 0
+
+    def _pool(self, route):
+        leased = sum(len(ids) for ids in self.leased.values())
+        self.route_allocated[route] = max(self.route_allocated[route], len(self.leased[route]))
+        self.total_allocated = min(self.pool_max, sum(self.route_allocated.values()))
+        return (f'[route: {route}][total available: {max(0, self.total_allocated - leased)}; '
+                f'route allocated: {self.route_allocated[route]} of {self.pool_max}; '
+                f'total allocated: {self.total_allocated} of {self.pool_max}]')
+
+    def lines(self, count, now):
+        head = utc_timestamp(now) + ' [jfrt ] [DEBUG] [9a2c4e1f0b3d5a7c] [PoolingHttpClientConnectionManager:%d] [%s] - '
+        out = []
+        while len(out) < count:
+            thread = self.rnd.choice(self.threads)
+            state, route, conn_id = self.state[thread]
+            if state == 'idle':
+                route = self.rnd.choice(self.routes)
+                self.state[thread] = ('waiting', route, None)
+                out.append(head % (266, thread) + 'Connection request: ' + self._pool(route) + '\n')
+            elif state == 'waiting':
+                self.next_id += 1
+                conn_id = self.next_id
+                self.leased[route].add(conn_id)
+                self.lease_waits[route] += 1
+                self.state[thread] = ('leased', route, conn_id)
+                out.append(head % (310, thread) + f'Connection leased: [id: {conn_id}]' + self._pool(route) + '\n')
+            else:
+                # released 前的 keep-alive 行不含连接池总数，exporter 应忽略
+                self.leased[route].discard(conn_id)
+                self.state[thread] = ('idle', None, None)
+                out.append(head % (344, thread) + f'Connection [id: {conn_id}][route: {route}] can be kept alive for 60.0 seconds\n')
+                out.append(head % (351, thread) + f'Connection released: [id: {conn_id}]' + self._pool(route) + '\n')
+        return ''.join(out)
+
+    def checks(self, samples, lines_written, rotations):
+        checks = [
+            ('s3_connection_exporter_lines_read_total', lines_written,
+             metric_value(samples, 's3_connection_exporter_lines_read_total')),
+            ('s3_connection_exporter_parse_errors_total (sum)', 0,
+             metric_value(samples, 's3_connection_exporter_parse_errors_total')),
+            ('s3_connection_current', self.total_allocated, metric_value(samples, 's3_connection_current')),
+        ]
+        for route in self.routes:
+            label = route.rsplit('->', 1)[-1]
+            checks.append((f's3_pool_lease_wait_seconds_count{{route="{label}"}}', self.lease_waits[route],
+                           metric_value(samples, 's3_pool_lease_wait_seconds_count', route=label)))
+            checks.append((f's3_pool_leased{{route="{label}"}}', len(self.leased[route]),
+                           metric_value(samples, 's3_pool_leased', route=label)))
+        for kind, n in rotations.items():
+            checks.append((f's3_connection_exporter_rotations_total{{type="{kind}"}}', n,
+                           metric_value(samples, 's3_connection_exporter_rotations_total', type=kind)))
+        return checks
+
+# name -> (exporter 脚本, 日志路径配置项, 端口配置项, 读取行数指标, 生成器, 其它配置)
+EXPORTERS = {
+    'request': ('Artifactory Request 监控/artifactory_request_exporter.py', 'LOG_FILE', 'METRICS_PORT',
+                'artifactory_request_exporter_lines_read_total', RequestLogGenerator, {'CHECKPOINT_FILE': 'checkpoint'}),
+    's3': ('S3 连接数监控/s3_connection_exporter.py', 'LOG_FILE_PATH', 'HTTP_PORT',
+           's3_connection_exporter_lines_read_total', PoolLogGenerator, {}),
+}
+
+SAMPLE_RE = re.compile(r'^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})? (\S+)')
+LABEL_RE = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+def parse_metrics(text):
+    """Prometheus 文本格式 -> {指标名: [(标签 dict, 值)]}"""
+    samples = {}
+    for line in text.split('\n'):
+        if not line or line.startswith('#'):
+            continue
+        m = SAMPLE_RE.match(line)
+        if m is None:
+            continue
+        name, labels, value = m.groups()
+        samples.setdefault(name, []).append((dict(LABEL_RE.findall(labels or '')), float(value)))
+    return samples
+
+def metric_value(samples, name, **labels):
+    """标签匹配的样本值之和（未出现时为 None）"""
+    values = [value for sample_labels, value in samples.get(name, ())
+              if all(sample_labels.get(k) == v for k, v in labels.items())]
+    return sum(values) if values else None
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'count': len(values), 'p50': round(pick(0.5), 6), 'p90': round(pick(0.9), 6),
+            'p99': round(pick(0.99), 6), 'max': round(values[-1], 6)}
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def scrape(conn, gzip_ok=True):
+    """一次 /metrics 请求，返回文本；conn 为复用的 keep-alive 连接"""
+    conn.request('GET', '/metrics', headers={'Accept-Encoding': 'gzip'} if gzip_ok else {})
+    resp = conn.getresponse()
+    body = resp.read()
+    if resp.status != 200:
+        raise RuntimeError(f'/metrics returned {resp.status}')
+    if resp.getheader('Content-Encoding') == 'gzip':
+        body = gzip.decompress(body)
+    return body.decode('utf-8')
+
+def proc_usage(pid):
+    """(CPU 秒数, RSS 字节数)，从 /proc 读取"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLK_TCK  # utime + stime
+    rss = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1]) * 1024
+    return cpu, rss
+
+class Scrapers:
+    """并发抓取 /metrics 的客户端，记录每次抓取的耗时"""
+
+    def __init__(self, port, count, interval):
+        self.port = port
+        self.interval = interval
+        self.latencies = []
+        self.errors = 0
+        self.running = True
+        self.threads = [threading.Thread(target=self.run, args=(i,), daemon=True) for i in range(count)]
+
+    def start(self):
+        for thread in self.threads:
+            thread.start()
+
+    def run(self, index):
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        while self.running:
+            start = time.perf_counter()
+            try:
+                scrape(conn, gzip_ok=index % 2 == 0)  # 一半客户端要求 gzip
+                self.latencies.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException, RuntimeError):
+                self.errors += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            time.sleep(self.interval)
+        conn.close()
+
+    def stop(self):
+        self.running = False
+        for thread in self.threads:
+            thread.join()
+
+class Benchmark:
+    """运行一个 exporter：启动子进程、写日志、采样、等待追上后校验"""
+
+    def __init__(self, name, args, workdir):
+        script, log_key, port_key, self.lines_metric, generator, settings = EXPORTERS[name]
+        self.name = name
+        self.args = args
+        self.workdir = os.path.join(workdir, name)
+        os.makedirs(self.workdir, exist_ok=True)
+        self.generator = generator(seed=args.seed, **({'bad_line_ratio': args.bad_line_ratio} if name == 'request' else {}))
+        self.log_file = os.path.join(self.workdir, generator.log_name)
+        self.port = free_port()
+        self.settings = {key: os.path.join(self.workdir, value) if key == 'CHECKPOINT_FILE' else value
+                         for key, value in settings.items()}
+        self.settings.update({log_key: self.log_file, port_key: self.port})
+        self.settings.update(args.settings)
+        self.script = os.path.join(ROOT, script)
+        self.lines_written = 0
+        self.bytes_written = 0
+        self.rotations = {'rotate': 0, 'truncate': 0}
+        self.rotation_pause = 0.0
+        # 每次写入的时间和累计行数，用于计算每行的读取延迟
+        self.written_at = []
+        self.written_counts = []
+        self.lag_seconds = []
+        self.lag_lines = []
+        self.rss = []
+        self.writing = True
+        self.conn = None
+
+    def lines_read(self):
+        return metric_value(parse_metrics(scrape(self.conn)), self.lines_metric) or 0
+
+    def wait_for(self, predicate, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                if predicate():
+                    return True
+            except (OSError, http.client.HTTPException, RuntimeError):
+                self.conn.close()
+            time.sleep(0.05)
+        return False
+
+    def rotate(self, f, kind):
+        """rename: 改名后新建文件；copytruncate: 等 exporter 读完后复制再截断，并等它发现截断"""
+        started = time.time()
+        f.close()
+        if kind == 'rotate':
+            os.replace(self.log_file, self.log_file + '.1')
+        else:
+            # 截断前未读完的内容会丢失（logrotate copytruncate 的固有问题），基准只衡量 exporter 自身的正确性
+            self.wait_for(lambda: self.lines_read() >= self.lines_written, self.args.drain_timeout)
+            shutil.copyfile(self.log_file, self.log_file + '.1')
+            os.truncate(self.log_file, 0)
+            expected = self.rotations['truncate'] + 1
+            self.wait_for(lambda: metric_value(parse_metrics(scrape(self.conn)), self.lines_metric.replace(
+                'lines_read_total', 'rotations_total'), type='truncate') == expected, self.args.drain_timeout)
+        self.rotations[kind] += 1
+        self.rotation_pause += time.time() - started
+        return open(self.log_file, 'a')
+
+    def write(self):
+        """按 --rate 写入 --duration 秒（rate 为 0 时尽快写入），每 --rotate-every 秒交替一次 rename / copytruncate"""
+        args = self.args
+        f = open(self.log_file, 'a')
+        start = time.time()
+        next_rotation = start + args.rotate_every if args.rotate_every else None
+        kinds = ['rotate', 'truncate']
+        while True:
+            now = time.time()
+            elapsed = now - start - self.rotation_pause
+            if elapsed >= args.duration:
+                break
+            if next_rotation is not None and now >= next_rotation:
+                f = self.rotate(f, kinds[(self.rotations['rotate'] + self.rotations['truncate']) % 2])
+                next_rotation = time.time() + args.rotate_every
+                continue
+            if args.rate:
+                count = int(elapsed * args.rate) - self.lines_written
+                if count <= 0:
+                    time.sleep(0.005)
+                    continue
+                count = min(count, args.rate)
+            else:
+                count = 10000
+            text = self.generator.lines(count, now)
+            f.write(text)
+            f.flush()
+            # pool 生成器一步可能多写一行
+            self.lines_written += text.count('\n')
+            self.bytes_written += len(text)
+            self.written_at.append(time.time())
+            self.written_counts.append(self.lines_written)
+        f.close()
+        self.write_seconds = time.time() - start - self.rotation_pause
+
+    def sample(self, pid):
+        """每 0.2s 记录一次读取延迟（已写入未被读取的行数，以及最早一条未读行写入至今的时间）和 RSS"""
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        while self.writing:
+            try:
+                read = metric_value(parse_metrics(scrape(conn)), self.lines_metric) or 0
+            except (OSError, http.client.HTTPException, RuntimeError):
+                conn.close()
+                time.sleep(0.2)
+                continue
+            now = time.time()
+            n = len(self.written_counts)
+            written = self.written_counts[n - 1] if n else 0
+            self.lag_lines.append(max(0, written - read))
+            if read >= written:
+                self.lag_seconds.append(0.0)
+            else:
+                # 第一条未读的行所在的那次写入
+                i = bisect.bisect_right(self.written_counts, read, 0, n)
+                self.lag_seconds.append(now - self.written_at[i])
+            self.rss.append(proc_usage(pid)[1])
+            time.sleep(0.2)
+        conn.close()
+
+    def run(self):
+        args = self.args
+        open(self.log_file, 'w').close()
+        log = open(os.path.join(self.workdir, 'exporter.log'), 'w')
+        proc = subprocess.Popen([sys.executable, '-c', LAUNCHER, self.script, json.dumps(self.settings)],
+                                stdout=log, stderr=subprocess.STDOUT, cwd=self.workdir)
+        try:
+            self.conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+            if not self.wait_for(lambda: scrape(self.conn) is not None, 15):
+                raise RuntimeError(f'{self.name} exporter did not start, see {log.name}')
+            time.sleep(1)  # exporter 首次打开日志时定位到末尾，等它打开后再写
+            cpu_start, _ = proc_usage(proc.pid)
+            scrapers = Scrapers(self.port, args.scrapers, args.scrape_interval)
+            scrapers.start()
+            sampler = threading.Thread(target=self.sample, args=(proc.pid,), daemon=True)
+            sampler.start()
+            start = time.time()
+            self.write()
+            drain_start = time.time()
+            caught_up = self.wait_for(lambda: self.lines_read() >= self.lines_written, args.drain_timeout)
+            end = time.time()
+            cpu_end, rss = proc_usage(proc.pid)
+            self.writing = False
+            sampler.join()
+            scrapers.stop()
+            samples = parse_metrics(scrape(self.conn))
+        finally:
+            self.conn.close()
+            proc.terminate()
+            proc.wait()
+            log.close()
+        read = metric_value(samples, self.lines_metric) or 0
+        # 过载模式下按采样估算，计数只能近似相等（小类别的误差较大）；需要精确比对时加 --set OVERLOAD_MAX_SAMPLE_RATE=1
+        skipped = metric_value(samples, 'artifactory_request_exporter_lines_skipped_total') or 0
+        tolerance = 0.1 if skipped else 0
+        checks = []
+        for metric, expected, observed in self.generator.checks(samples, self.lines_written, self.rotations):
+            ok = observed is not None and abs(observed - expected) <= tolerance * expected
+            if observed is None and expected == 0:
+                ok = True  # 从未出现过的计数（如解析错误）不导出
+            checks.append({'metric': metric, 'expected': expected, 'observed': observed, 'ok': ok})
+        cpu = cpu_end - cpu_start
+        elapsed = end - start - self.rotation_pause
+        return {
+            'lines_written': self.lines_written,
+            'bytes_written': self.bytes_written,
+            'rotations': self.rotations,
+            'caught_up': caught_up,
+            'write_seconds': round(self.write_seconds, 3),
+            'catch_up_seconds': round(end - drain_start, 3),
+            'offered_lines_per_second': round(self.lines_written / self.write_seconds, 1),
+            'lines_per_second': round(read / elapsed, 1) if elapsed > 0 else None,
+            'cpu_seconds': round(cpu, 3),
+            'cpu_seconds_per_million_lines': round(cpu / read * 1e6, 3) if read else None,
+            'rss_bytes': {'max': max(self.rss + [rss]), 'final': rss},
+            'tail_lag_seconds': percentiles(self.lag_seconds),
+            'tail_lag_lines': percentiles(self.lag_lines),
+            'scrape_latency_seconds': dict(percentiles(scrapers.latencies) or {'count': 0}, errors=scrapers.errors),
+            'lines_skipped': skipped,
+            'accuracy': {'ok': caught_up and all(check['ok'] for check in checks), 'approximate': bool(skipped),
+                         'checks': checks},
+        }
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_file):
+    """与之前保存的结果对比主要指标，打印变化比例"""
+    with open(baseline_file) as f:
+        baseline = json.load(f)['results']
+    keys = [('lines_per_second', lambda r: r['lines_per_second']),
+            ('cpu_seconds_per_million_lines', lambda r: r['cpu_seconds_per_million_lines']),
+            ('rss_max_bytes', lambda r: r['rss_bytes']['max']),
+            ('tail_lag_p99_seconds', lambda r: (r['tail_lag_seconds'] or {}).get('p99')),
+            ('scrape_p99_seconds', lambda r: r['scrape_latency_seconds'].get('p99'))]
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        for key, get in keys:
+            old, new = get(baseline[name]), get(result)
+            change = f'{(new - old) / old * 100:+.1f}%' if old and new is not None else '-'
+            print(f'{name:8} {key:32} {old!s:>14} -> {new!s:>14}  {change}', file=sys.stderr)
+
+def parse_setting(text):
+    key, _, value = text.partition('=')
+    try:
+        return key, json.loads(value)
+    except ValueError:
+        return key, value
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end benchmark for the log-tailing exporters')
+    parser.add_argument('--exporter', choices=['all'] + list(EXPORTERS), default='all')
+    parser.add_argument('--rate', type=int, default=20000, help='lines per second to write (0 = as fast as possible)')
+    parser.add_argument('--duration', type=float, default=30, help='seconds of traffic to write')
+    parser.add_argument('--rotate-every', type=float, default=10,
+                        help='seconds between rotations, alternating rename and copytruncate (0 = never)')
+    parser.add_argument('--scrapers', type=int, default=4, help='concurrent /metrics clients')
+    parser.add_argument('--scrape-interval', type=float, default=0.1, help='seconds between scrapes per client')
+    parser.add_argument('--drain-timeout', type=float, default=60, help='seconds to wait for the exporter to catch up')
+    parser.add_argument('--bad-line-ratio', type=float, default=0.001, help='fraction of malformed request log lines')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--set', dest='settings', action='append', default=[], type=parse_setting, metavar='KEY=VALUE',
+                        help='override an exporter config constant, e.g. --set OVERLOAD_MAX_SAMPLE_RATE=1')
+    parser.add_argument('--workdir', help='directory for logs (default: a temporary directory)')
+    parser.add_argument('--compare', metavar='JSON', help='earlier result file to compare against')
+    parser.add_argument('-o', '--output', help='write the JSON result here (default: stdout)')
+    args = parser.parse_args()
+    args.settings = dict(args.settings)
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='exporter-bench-')
+    names = list(EXPORTERS) if args.exporter == 'all' else [args.exporter]
+    results = {}
+    for name in names:
+        print(f'running {name} exporter: {args.rate or "max"} lines/s for {args.duration}s ...', file=sys.stderr)
+        results[name] = Benchmark(name, args, workdir).run()
+        r = results[name]
+        print(f'  {r["lines_per_second"]} lines/s, {r["cpu_seconds_per_million_lines"]} CPU s / 1M lines, '
+              f'accuracy {"ok" if r["accuracy"]["ok"] else "FAILED"}', file=sys.stderr)
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'git_commit': git_commit(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'cpu_count': os.cpu_count(),
+        'config': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.compare:
+        compare(results, args.compare)
+    sys.exit(0 if all(r['accuracy']['ok'] for r in results.values()) else 1)
+
+if __name__ == '__main__':
+    main()
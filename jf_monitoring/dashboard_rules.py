@@ -0,0 +1,536 @@
+#!/usr/bin/env python3
+"""
+Dashboard Recording Rules:
+扫描 grafana/dashboard/ 下 Dashboard 的 PromQL，把开销大的聚合改为 Prometheus recording rule 预先计算，
+并把 Dashboard 改为查询记录好的序列，打开 30 天等长时间范围时不再对原始 5s 数据逐点计算 rate 再求和:
+python3 dashboard_rules.py            # 改写 Dashboard，更新 recording_rules.yml
+python3 dashboard_rules.py --check    # 只检查，有未改写的表达式或缺少的 rule 时返回 1
+
+- 直接包在原始 selector 的 rate/irate/increase 等区间函数外层的 sum/count/min/max 聚合，按 instance、job、原 by 标签
+  及面板过滤用到的标签预聚合为 <标签>:<指标>:<函数><窗口>；Dashboard 中对记录的序列过滤后再聚合一次（count 改为 sum），
+  结果与原表达式相同；对序列计数的 count(x) 同样处理
+- instance/job 及其它标签过滤（包括 $node 等 Grafana 变量）都留在 Dashboard 中，一条 rule 供所有节点和面板共用
+- rule 中的窗口固定为 RULE_WINDOW（$__rate_interval 同）；rate/increase 统一记录为 RULE_WINDOW 的 rate，
+  更长的窗口（如 [24h]、[$__interval]）在 Dashboard 中为 avg_over_time(记录的 rate[窗口])，increase 再乘以窗口秒数
+- 时间序列面板中不聚合、直接按序列显示的 SERIES_RULES 指标（JVM GC、堆内存、S3 连接池、TCP 连接状态）同样记录：
+  计数器的 rate/increase 按上面的方式记录为 RULE_WINDOW 的 rate，gauge 记录 RULE_WINDOW 内的 max_over_time/avg_over_time，
+  每个序列保留 instance、job 及区分序列的标签；stat/gauge 等只显示当前值的面板保留原始查询
+- 其余不聚合的查询保留原始查询，长时间范围由 start.sh 的低分辨率长期存储提供
+recording_rules.yml 由 start.sh 安装到 prometheus/rules/；已记录的 rule 会保留，重复运行结果不变。
+"""
+
+import argparse
+import json
+import os
+import re
+import sys
+
+# ========== Configuration ==========
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DASHBOARD_DIR = os.path.join(BASE_DIR, 'grafana', 'dashboard')
+RULES_FILE = os.path.join(BASE_DIR, 'recording_rules.yml')
+RULE_WINDOW = '1m'          # rule 中区间函数的固定窗口（$__rate_interval 同），需不小于 4 倍抓取间隔
+# 时间序列面板中不聚合、直接按序列显示的指标: 指标名 -> (instance/job 之外区分序列的标签, gauge 的降采样函数)；
+# 降采样函数为 None 表示计数器，其 rate/increase 记录为 RULE_WINDOW 的 rate
+SERIES_RULES = {
+    'jvm_gc_collection_seconds_sum': (['gc'], None),
+    'jvm_gc_collection_seconds_count': (['gc'], None),
+    'jvm_memory_bytes_used': (['area'], 'avg'),
+    'jvm_memory_bytes_max': (['area'], 'max'),
+    's3_connection_current': ([], 'max'),
+    's3_connection_max': ([], 'max'),
+    'tcp_port_established': (['port'], 'max'),
+    'tcp_port_timewait': (['port'], 'max'),
+}
+SERIES_PANELS = {'timeseries', 'graph'}  # 改写 SERIES_RULES 指标的面板类型
+# rule 分组（按指标名前缀，第一个匹配的生效）
+RULE_GROUPS = [
+    (r'node_', 'jf_node_recording'),
+    (r'jvm_|java_|process_', 'jf_jvm_recording'),
+    (r's3_|tcp_', 'jf_connection_recording'),
+    (r'', 'jf_artifactory_recording'),
+]
+# ===================================
+
+RANGE_FUNCTIONS = {'rate', 'irate', 'increase', 'changes', 'resets', 'delta', 'idelta', 'deriv'}
+# 可拆成两层计算的聚合: rule 中的聚合 -> Dashboard 中对记录序列的再聚合
+DECOMPOSABLE = {'sum': 'sum', 'count': 'sum', 'min': 'min', 'max': 'max'}
+AGGREGATIONS = {'sum', 'min', 'max', 'avg', 'group', 'stddev', 'stdvar', 'count', 'count_values',
+                'bottomk', 'topk', 'quantile', 'limitk', 'limit_ratio'}
+GRAFANA_WINDOWS = {'$__rate_interval', '$__interval'}
+IDENTITY_LABELS = ['instance', 'job']
+
+TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)
+  | (?P<range>\[[^\]]*\])
+  | (?P<number>0x[0-9a-fA-F]+|\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+)
+  | (?P<ident>[a-zA-Z_:$][\w:$]*)
+  | (?P<op>==|!=|>=|<=|=~|!~|[-+*/%^<>=,(){}@])
+''', re.VERBOSE)
+MATCHER_RE = re.compile(r'''\s*([a-zA-Z_]\w*)\s*(=~|!~|!=|=)\s*("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*'|`[^`]*`)\s*,?''')
+RULE_LINE_RE = re.compile(r"^\s+- record: (\S+)\n\s+expr: '((?:[^']|'')*)'$", re.MULTILINE)
+
+
+class ParseError(Exception):
+    pass
+
+
+class Node:
+    """表达式中的一段: kind 为 selector/call/agg/paren/other，start/end 为在原表达式中的位置"""
+
+    def __init__(self, kind, start, end, **fields):
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.children = []
+        self.__dict__.update(fields)
+
+
+def tokenize(expr):
+    tokens = []
+    pos = 0
+    while pos < len(expr):
+        m = TOKEN_RE.match(expr, pos)
+        if not m:
+            raise ParseError(f'unexpected character at {pos}: {expr[pos:pos + 20]!r}')
+        if m.lastgroup != 'space':
+            tokens.append((m.lastgroup, m.group(), m.start(), m.end()))
+        pos = m.end()
+    return tokens
+
+
+class Parser:
+    """只识别改写需要的结构（selector、函数调用、聚合），二元运算按顺序跳过，不处理优先级"""
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.tokens = tokenize(expr)
+        self.i = 0
+
+    def peek(self, offset=0):
+        j = self.i + offset
+        return self.tokens[j] if j < len(self.tokens) else (None, None, len(self.expr), len(self.expr))
+
+    def take(self, value=None):
+        tok = self.peek()
+        if tok[0] is None or (value is not None and tok[1] != value):
+            raise ParseError(f'expected {value!r} at {tok[2]} in {self.expr!r}')
+        self.i += 1
+        return tok
+
+    def parse(self):
+        nodes = self.sequence()
+        if self.peek()[0] is not None:
+            raise ParseError(f'unexpected {self.peek()[1]!r} in {self.expr!r}')
+        return nodes
+
+    def sequence(self):
+        """一个或多个由二元运算符连接的操作数，直到 ')' ',' 或结尾"""
+        nodes = []
+        while True:
+            kind, value, _, _ = self.peek()
+            if kind is None or value in (')', ','):
+                return nodes
+            if kind == 'op' and value in ('-', '+', '*', '/', '%', '^', '==', '!=', '>', '<', '>=', '<='):
+                self.take()
+                continue
+            if kind == 'ident' and value in ('and', 'or', 'unless', 'bool'):
+                self.take()
+                continue
+            if kind == 'ident' and value in ('on', 'ignoring', 'group_left', 'group_right'):
+                self.take()
+                if self.peek()[1] == '(':
+                    self.label_list()
+                continue
+            nodes.append(self.operand())
+
+    def label_list(self):
+        self.take('(')
+        labels = []
+        while self.peek()[1] != ')':
+            kind, value, _, _ = self.take()
+            if kind == 'ident':
+                labels.append(value)
+        self.take(')')
+        return labels
+
+    def operand(self):
+        kind, value, start, _ = self.peek()
+        if kind in ('number', 'string'):
+            self.take()
+            node = Node('other', start, self.peek(-1)[3])
+        elif value == '(':
+            self.take()
+            node = Node('paren', start, 0)
+            node.children = self.sequence()
+            self.take(')')
+            node.end = self.peek(-1)[3]
+        elif kind == 'ident' and value in AGGREGATIONS and self.peek(1)[1] in ('(', 'by', 'without'):
+            node = self.aggregation()
+        elif kind == 'ident' and self.peek(1)[1] == '(':
+            self.take()
+            self.take('(')
+            node = Node('call', start, 0, name=value, args=self.arguments())
+            node.end = self.peek(-1)[3]
+        elif kind == 'ident' or value == '{':
+            node = self.selector()
+        else:
+            raise ParseError(f'unexpected {value!r} at {start} in {self.expr!r}')
+        # 子查询、offset、@ 修饰符: 不改写
+        while self.peek()[0] == 'range' or self.peek()[1] in ('offset', '@'):
+            if self.peek()[0] != 'range':
+                self.take()
+            self.take()
+            node.modified = True
+            node.end = self.peek(-1)[3]
+        return node
+
+    def arguments(self):
+        args = []
+        while True:
+            if self.peek()[1] == ')':
+                self.take()
+                return args
+            arg = Node('paren', self.peek()[2], 0)
+            arg.children = self.sequence()
+            arg.end = self.peek(-1)[3]
+            args.append(arg)
+            if self.peek()[1] == ',':
+                self.take()
+
+    def aggregation(self):
+        _, op, start, _ = self.take()
+        grouping = None
+        if self.peek()[1] in ('by', 'without'):
+            grouping = (self.take()[1], self.label_list())
+        self.take('(')
+        args = self.arguments()
+        if self.peek()[1] in ('by', 'without'):
+            grouping = (self.take()[1], self.label_list())
+        return Node('agg', start, self.peek(-1)[3], op=op, grouping=grouping, args=args)
+
+    def selector(self):
+        kind, value, start, end = self.peek()
+        metric = None
+        if kind == 'ident':
+            metric = value
+            self.take()
+        matchers_text = ''
+        matchers = []
+        if self.peek()[1] == '{':
+            brace_start = self.take('{')[2]
+            while self.peek()[1] != '}':
+                self.take()
+            end = self.take('}')[3]
+            matchers_text = self.expr[brace_start + 1:end - 1].strip()
+            matchers = parse_matchers(matchers_text)
+        else:
+            end = self.peek(-1)[3]
+        window = None
+        if self.peek()[0] == 'range':
+            window = self.take()[1][1:-1].strip()
+            end = self.peek(-1)[3]
+        return Node('selector', start, end, metric=metric, matchers=matchers,
+                    matchers_text=matchers_text, window=window)
+
+
+def parse_matchers(text):
+    matchers = []
+    pos = 0
+    while pos < len(text):
+        m = MATCHER_RE.match(text, pos)
+        if not m:
+            raise ParseError(f'bad label matchers: {text!r}')
+        matchers.append((m.group(1), m.group(2), m.group(3)))
+        pos = m.end()
+    return matchers
+
+
+def unwrap(node):
+    """去掉多余的括号，返回唯一的操作数（不是单个操作数时返回 None）"""
+    while node.kind == 'paren':
+        if len(node.children) != 1:
+            return None
+        node = node.children[0]
+    return node
+
+
+def raw_selector(node, with_window):
+    """未经修饰、未记录过的原始 selector（区间函数的参数需要带窗口）"""
+    return (node is not None and node.kind == 'selector' and not getattr(node, 'modified', False)
+            and node.metric is not None and ':' not in node.metric
+            and (node.window is not None) == with_window)
+
+
+def duration_seconds(text):
+    """PromQL 时长（如 1m、24h、1h30m）的秒数，不是固定时长时返回 None"""
+    units = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800, 'y': 31536000}
+    parts = re.findall(r'(\d+)(ms|s|m|h|d|w|y)', text)
+    if not parts or ''.join(n + u for n, u in parts) != text:
+        return None
+    return sum(int(n) * units[u] for n, u in parts)
+
+
+def window_seconds(window):
+    """increase 换算为 rate 时乘的秒数（PromQL 表达式）"""
+    if window in GRAFANA_WINDOWS:
+        return f'{window}_ms / 1000'
+    seconds = duration_seconds(window)
+    return str(int(seconds)) if seconds == int(seconds) else str(seconds)
+
+
+def rule_level(labels):
+    return '_'.join(IDENTITY_LABELS + sorted(set(labels) - set(IDENTITY_LABELS)))
+
+
+def metric_base(metric, func):
+    if func in ('rate', 'irate', 'increase') and metric.endswith('_total'):
+        return metric[:-len('_total')]
+    return metric
+
+
+class Rewriter:
+    """改写表达式并收集 rule: name -> expr"""
+
+    def __init__(self, rules):
+        self.rules = rules
+
+    def add_rule(self, name, expr):
+        if self.rules.get(name, expr) != expr:
+            raise ParseError(f'recording rule {name} already defined as {self.rules[name]!r}, not {expr!r}')
+        self.rules[name] = expr
+
+    def rewrite(self, expr, series=False):
+        """series: 所在面板按时间显示序列，SERIES_RULES 中的指标也改为查询记录的序列"""
+        replacements = []
+        for node in Parser(expr).parse():
+            self.visit(node, replacements, series)
+        for start, end, text in sorted(replacements, reverse=True):
+            expr = expr[:start] + text + expr[end:]
+        return expr
+
+    def visit(self, node, replacements, series):
+        text = None
+        if node.kind == 'agg' and not getattr(node, 'modified', False):
+            text = self.aggregation(node)
+        elif series and node.kind == 'call' and not getattr(node, 'modified', False):
+            text = self.series_counter(node)
+        elif series and node.kind == 'selector':
+            text = self.series_gauge(node)
+        if text is not None:
+            replacements.append((node.start, node.end, text))
+            return
+        for child in node.children + getattr(node, 'args', []):
+            self.visit(child, replacements, series)
+
+    def series(self, name, selector):
+        if selector.matchers_text:
+            return f'{name}{{{selector.matchers_text}}}'
+        return name
+
+    def record(self, op, labels, selector, func, ops, source):
+        """按 instance、job 及 labels 记录 op by (...) (source)，返回 Dashboard 中按原过滤条件查询记录序列的表达式"""
+        labels = labels + [label for label, _, _ in selector.matchers]
+        rule_by = ', '.join(IDENTITY_LABELS + sorted(set(labels) - set(IDENTITY_LABELS)))
+        name = f'{rule_level(labels)}:{metric_base(selector.metric, func)}:{ops}'
+        self.add_rule(name, f'{op} by ({rule_by}) ({source})')
+        return self.series(name, selector)
+
+    def counter_window(self, func, window):
+        """
+        rate/increase 统一记录 RULE_WINDOW 的 rate；更长的窗口在 Dashboard 中对记录的 rate 取 avg_over_time，
+        increase 再乘以窗口秒数，rule 本身不再每次计算长窗口。返回 (avg_over_time 的窗口, 倍数)，不能改写时返回 None
+        """
+        over_time = None
+        if window != '$__rate_interval' and window != RULE_WINDOW:
+            seconds = duration_seconds(window) if window != '$__interval' else None
+            if window != '$__interval' and (seconds is None or seconds <= duration_seconds(RULE_WINDOW)):
+                return None
+            over_time = window
+        scale = f' * {window_seconds(window)}' if func == 'increase' else ''
+        return over_time, scale
+
+    def series_counter(self, node):
+        """不聚合的 increase(x{...}[w]) -> (avg_over_time(<labels>:x:rate1m{...}[w]) * w 的秒数)"""
+        if node.name not in ('rate', 'increase') or len(node.args) != 1:
+            return None
+        selector = unwrap(node.args[0])
+        if not raw_selector(selector, with_window=True) or selector.metric not in SERIES_RULES:
+            return None
+        labels, downsample = SERIES_RULES[selector.metric]
+        windows = self.counter_window(node.name, selector.window)
+        if downsample is not None or windows is None:
+            return None
+        over_time, scale = windows
+        series = self.record('sum', labels, selector, 'rate', f'rate{RULE_WINDOW}',
+                             f'rate({selector.metric}[{RULE_WINDOW}])')
+        if over_time:
+            series = f'avg_over_time({series}[{over_time}])'
+        return f'({series}{scale})' if scale else series
+
+    def series_gauge(self, node):
+        """不聚合的 gauge x{...} -> <labels>:x:max_over_time1m{...}（RULE_WINDOW 内的降采样）"""
+        if not raw_selector(node, with_window=False) or node.metric not in SERIES_RULES:
+            return None
+        labels, downsample = SERIES_RULES[node.metric]
+        if downsample is None:
+            return None
+        func = f'{downsample}_over_time'
+        return self.record(downsample, labels, node, func, f'{func}{RULE_WINDOW}', f'{func}({node.metric}[{RULE_WINDOW}])')
+
+    def aggregation(self, node):
+        """sum by (a) (rate(x{...}[w])) -> sum by (a) (<labels>:x:rate1m{...})"""
+        if node.op not in DECOMPOSABLE or len(node.args) != 1:
+            return None
+        if node.grouping is not None and node.grouping[0] != 'by':
+            return None
+        inner = unwrap(node.args[0])
+        if inner is None:
+            return None
+        by = list(node.grouping[1]) if node.grouping else []
+        func, over_time, scale = None, None, ''
+        if inner.kind == 'call' and inner.name in RANGE_FUNCTIONS and len(inner.args) == 1:
+            selector = unwrap(inner.args[0])
+            if not raw_selector(selector, with_window=True):
+                return None
+            window = selector.window
+            func = inner.name
+            if func in ('rate', 'increase'):
+                windows = self.counter_window(func, window)
+                # 对 avg_over_time 后的 rate 只能再求和
+                if windows is None or (windows[0] and node.op != 'sum'):
+                    return None
+                over_time, scale = windows
+                func = 'rate'
+            elif window != '$__rate_interval' and window != RULE_WINDOW:
+                return None
+            source = f'{func}({selector.metric}[{RULE_WINDOW}])'
+            ops = f'{func}{RULE_WINDOW}' if node.op == 'sum' else f'{node.op}_{func}{RULE_WINDOW}'
+        elif node.op == 'count' and raw_selector(inner, with_window=False):
+            # 对序列计数（如 CPU 核数）；单个 gauge 的 sum/max 等没有可预聚合的部分，保留原始查询
+            selector = inner
+            source = selector.metric
+            ops = node.op
+        else:
+            return None
+        series = self.record(node.op, by, selector, func, ops, source)
+        if over_time:
+            series = f'avg_over_time({series}[{over_time}])'
+        grouping = f' by ({", ".join(by)}) ' if node.grouping else ''
+        text = f'{DECOMPOSABLE[node.op]}{grouping}({series})'
+        if scale:
+            return f'({text}{scale})'
+        return text
+
+
+def iter_targets(obj, panel_type=None):
+    """Dashboard JSON 中所有带 expr 的查询及其所在面板的类型"""
+    if isinstance(obj, dict):
+        if isinstance(obj.get('targets'), list):
+            panel_type = obj.get('type')
+        if isinstance(obj.get('expr'), str):
+            yield obj, panel_type
+        for value in obj.values():
+            yield from iter_targets(value, panel_type)
+    elif isinstance(obj, list):
+        for value in obj:
+            yield from iter_targets(value, panel_type)
+
+
+def rule_group(name):
+    metric = name.split(':')[1]
+    for pattern, group in RULE_GROUPS:
+        if re.match(pattern, metric):
+            return group
+    return RULE_GROUPS[-1][1]
+
+
+def load_rules(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {name: expr.replace("''", "'") for name, expr in RULE_LINE_RE.findall(f.read())}
+
+
+def render_rules(rules):
+    lines = [
+        '# 由 dashboard_rules.py 根据 grafana/dashboard/*.json 生成，start.sh 安装到 prometheus/rules/，请勿手工修改',
+        'groups:',
+    ]
+    groups = {}
+    for name in sorted(rules):
+        groups.setdefault(rule_group(name), []).append(name)
+    for _, group in RULE_GROUPS:
+        if group not in groups:
+            continue
+        lines.append(f'  - name: {group}')
+        lines.append('    rules:')
+        for name in groups[group]:
+            expr = rules[name].replace("'", "''")
+            lines.append(f'      - record: {name}')
+            lines.append(f"        expr: '{expr}'")
+    return '\n'.join(lines) + '\n'
+
+
+def referenced_rules(expr):
+    """表达式中引用的记录序列名"""
+    names = set()
+    for kind, value, _, _ in tokenize(expr):
+        if kind == 'ident' and value.count(':') == 2:
+            names.add(value)
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Rewrite Grafana dashboards to query Prometheus recording rules')
+    parser.add_argument('--dashboard-dir', default=DASHBOARD_DIR)
+    parser.add_argument('--rules-file', default=RULES_FILE)
+    parser.add_argument('--check', action='store_true', help='只检查，不修改文件')
+    args = parser.parse_args()
+
+    rules = load_rules(args.rules_file)
+    known_rules = set(rules)
+    rewriter = Rewriter(rules)
+    changed_files = []
+    pending = 0
+    for filename in sorted(os.listdir(args.dashboard_dir)):
+        if not filename.endswith('.json'):
+            continue
+        path = os.path.join(args.dashboard_dir, filename)
+        with open(path, encoding='utf-8') as f:
+            dashboard = json.load(f)
+        changed = 0
+        for target, panel_type in iter_targets(dashboard):
+            expr = target['expr']
+            try:
+                new_expr = rewriter.rewrite(expr, series=panel_type in SERIES_PANELS)
+            except ParseError as e:
+                print(f'{filename}: skipped: {e}', file=sys.stderr)
+                continue
+            if new_expr != expr:
+                changed += 1
+                target['expr'] = new_expr
+            missing = referenced_rules(new_expr) - set(rules)
+            if missing:
+                print(f'{filename}: missing recording rules: {", ".join(sorted(missing))}', file=sys.stderr)
+                pending += 1
+        print(f'{filename}: {changed} expressions rewritten')
+        if changed:
+            pending += changed
+            changed_files.append((path, dashboard))
+
+    new_rules = set(rules) - known_rules
+    print(f'{len(rules)} recording rules ({len(new_rules)} new)')
+    if args.check:
+        sys.exit(1 if pending or new_rules else 0)
+
+    for path, dashboard in changed_files:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps(dashboard, indent=2, ensure_ascii=False))
+    with open(args.rules_file, 'w', encoding='utf-8') as f:
+        f.write(render_rules(rules))
+
+
+if __name__ == '__main__':
+    main()
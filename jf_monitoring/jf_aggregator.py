@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+JFrog Artifactory Push Aggregator:
+集群的每个节点上 jf_node_agent 开启 push 后，按固定间隔把 counter 增量和变化的 gauge 打包（一个 gzip JSON 批次）POST 到本服务的 /push，
+本服务合并后在 /metrics 提供按节点 (node="<节点名>") 和集群汇总 (node="_cluster") 的序列，Prometheus 只需抓取这一个 target:
+nohup python3 jf_aggregator.py --state-file /var/lib/jf_aggregator/state.json &
+
+- counter 按节点累加增量，节点重启（agent 的 boot 变化）后新一轮的增量继续累加，不会出现归零和 rate() 尖峰
+- 集群 counter 为所有节点之和（包括已下线的节点，总数不会回退）；集群 gauge 只合并在线的节点，合并方式见 CLUSTER_GAUGE_AGGREGATION
+- 节点超过 STALE_AFTER 秒未推送时不再输出该节点的序列，jf_aggregator_node_up 为 0
+- 按 seq 去重，agent 重发同一批次不会重复计数；开启 --state-file 后每个批次先追加到 journal 并 fsync 再确认，
+  定期保存快照并清空 journal，aggregator 崩溃或被 kill -9 后从快照 + journal 恢复，counter 不会低于已输出的值
+/metrics 为多线程 HTTP/1.1 (keep-alive) 服务，数据未变化时复用上次的输出；支持 gzip 和 OpenMetrics。
+"""
+
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import re
+import signal
+import sys
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+except ImportError:
+    # 在仓库中直接运行时，共用模块位于 jf_monitoring_node/scripts/；部署时与本脚本放在同一目录
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'jf_monitoring_node', 'scripts'))
+    from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+
+# ========== Configuration ==========
+AGGREGATOR_PORT = 8005
+STATE_FILE = None           # 累计值保存路径，None 表示不保存（重启后 counter 从 0 开始）
+STATE_SAVE_INTERVAL = 60    # 快照间隔（秒），两次快照之间的批次先写入 <STATE_FILE>.journal（fsync 后才确认）
+STALE_AFTER = 60            # 节点超过此秒数未推送视为离线
+MAX_BATCH_BYTES = 16 * 1024 * 1024  # 单个批次解压后的大小上限
+GZIP_MIN_SIZE = 1024        # 客户端支持 gzip 且输出超过此字节数时压缩
+NODE_LABEL = 'node'
+CLUSTER_NODE = '_cluster'   # 集群汇总序列的 node 标签值
+# 集群 gauge 的合并方式（正则完整匹配族名，第一个匹配的生效），其余 gauge 求和
+CLUSTER_GAUGE_AGGREGATION = [
+    (r'.*_(percentage|ratio)', 'max'),
+    (r'.*_quantile.*', 'max'),
+    (r'.*timestamp.*', 'max'),
+    (r'.*_tail_lag_.*|.*_sample_rate', 'max'),
+]
+# ===================================
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+GAUGE_AGGREGATORS = {'sum': sum, 'max': max, 'min': min}
+
+def escape_label(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def with_label(key, label):
+    """样本键加上一个标签: name{a="b"} -> name{label,a="b"}"""
+    name, brace, rest = key.partition('{')
+    if not brace or rest == '}':
+        return f'{name}{{{label}}}'
+    return f'{name}{{{label},{rest}'
+
+class NodeState:
+    __slots__ = ['boot', 'seq', 'ids', 'counters', 'gauges', 'last_push', 'restarts', 'batches', 'bytes', 'resync']
+
+    def __init__(self):
+        self.boot = None
+        self.seq = 0
+        self.ids = {}        # 本次 boot 的 id -> 样本键
+        self.counters = {}   # 样本键 -> 累计值（跨 boot 累加）
+        self.gauges = {}     # 样本键 -> (值, 时间戳)
+        self.last_push = 0
+        self.restarts = 0
+        self.batches = {'applied': 0, 'duplicate': 0, 'resync': 0}
+        self.bytes = 0
+        self.resync = False  # 从保存的状态恢复后，需要节点重新发送完整的定义
+
+class Aggregator:
+    def __init__(self, state_file=STATE_FILE):
+        self.lock = threading.Lock()
+        self.nodes = {}
+        self.families = {}     # 族名 -> [类型, HELP]，保持首次出现的顺序
+        self.family_keys = {}  # 族名 -> {样本键: None}，保持样本首次出现的顺序（histogram 的桶按 le 有序）
+        self.kinds = {}        # 样本键 -> counter / gauge
+        self.version = 0
+        self.state_file = state_file
+        self.gauge_rules = [(re.compile(pattern), GAUGE_AGGREGATORS[func]) for pattern, func in CLUSTER_GAUGE_AGGREGATION]
+        self.gauge_funcs = {}  # 族名 -> 集群 gauge 的合并函数
+        self.journal_file = state_file + '.journal' if state_file else None
+        self.journal = None
+        self.load_state()
+
+    def apply(self, batch, size):
+        """合并一个批次，返回 HTTP 状态码: 200 已合并或重复，409 需要节点重新发送完整定义，503 journal 写入失败"""
+        node = batch['node']
+        with self.lock:
+            state = self.nodes.get(node)
+            if state is None:
+                state = self.nodes[node] = NodeState()
+            state.bytes += size
+            ids = {int(sid): series for sid, series in batch['series'].items()}
+            full = bool(batch.get('full'))
+            if batch['boot'] != state.boot:
+                if not full:
+                    state.batches['resync'] += 1
+                    return 409
+            elif batch['seq'] <= state.seq:
+                state.batches['duplicate'] += 1
+                return 200
+            elif state.resync and not full:
+                state.batches['resync'] += 1
+                return 409
+            if any(sid not in state.ids and str(sid) not in batch['series']
+                   for sid, *_ in batch['counters'] + batch['gauges']):
+                state.batches['resync'] += 1
+                return 409
+            # 新的 boot 或重新同步时 id 定义以本批次为准
+            known = {} if full else dict(state.ids)
+            known.update((sid, key) for sid, (name, key, kind) in ids.items())
+            entry = {
+                'v': self.version + 1,
+                'node': node,
+                'boot': batch['boot'],
+                'seq': batch['seq'],
+                'full': full,
+                'families': batch['families'],
+                'series': {key: [name, kind] for name, key, kind in ids.values()},
+                'counters': [[known[sid], delta] for sid, delta in batch['counters']],
+                'gauges': [[known[sid], value, ts[0] if ts else None] for sid, value, *ts in batch['gauges']],
+                'gone': [known[sid] for sid in batch['gone'] if sid in known],
+            }
+            # 先持久化再修改内存和确认，写入失败时节点保留该批次稍后重发
+            if not self.write_journal(entry):
+                return 503
+            state.ids = known
+            self.apply_entry(state, entry)
+            state.last_push = time.time()
+            state.batches['applied'] += 1
+        return 200
+
+    def apply_entry(self, state, entry):
+        """把一个已解析为样本键的批次合并到节点状态（调用方持有 self.lock），恢复时按 journal 重放也走这里"""
+        if entry['boot'] != state.boot:
+            if state.boot is not None:
+                state.restarts += 1
+                logger.info(f"Node {entry['node']} restarted (boot {entry['boot']})")
+            state.boot = entry['boot']
+        if entry['full']:
+            state.gauges = {}
+            state.resync = False
+        for name, (kind, help_text) in entry['families'].items():
+            self.families[name] = [kind, help_text]
+            self.family_keys.setdefault(name, {})
+        for key, (name, kind) in entry['series'].items():
+            self.kinds[key] = kind
+            self.families.setdefault(name, ['untyped', ''])
+            self.family_keys.setdefault(name, {})[key] = None
+        counters = state.counters
+        for key, delta in entry['counters']:
+            counters[key] = counters.get(key, 0) + delta
+        for key, value, ts in entry['gauges']:
+            state.gauges[key] = (value, ts)
+        for key in entry['gone']:
+            state.gauges.pop(key, None)
+        state.seq = entry['seq']
+        self.version = entry['v']
+
+    def gauge_func(self, name):
+        func = self.gauge_funcs.get(name)
+        if func is None:
+            func = next((f for pattern, f in self.gauge_rules if pattern.fullmatch(name)), sum)
+            self.gauge_funcs[name] = func
+        return func
+
+    def generate_metrics(self) -> str:
+        now = time.time()
+        with self.lock:
+            nodes = sorted(self.nodes.items())
+            up = {node for node, state in nodes if now - state.last_push < STALE_AFTER}
+            snapshot = [(node, dict(state.counters), dict(state.gauges)) for node, state in nodes]
+            families = [(name, kind, help_text, list(self.family_keys.get(name, ())))
+                        for name, (kind, help_text) in self.families.items()]
+            kinds = dict(self.kinds)
+            self_stats = [(node, state.last_push, state.restarts, dict(state.batches), state.bytes,
+                           len(state.counters) + len(state.gauges)) for node, state in nodes]
+        m = []
+        for name, kind, help_text, keys in families:
+            lines = []
+            for node, counters, gauges in snapshot:
+                if node not in up:
+                    continue
+                label = f'{NODE_LABEL}="{escape_label(node)}"'
+                for key in keys:
+                    if key in counters:
+                        lines.append(f'{with_label(key, label)} {counters[key]}')
+                    elif key in gauges:
+                        value, ts = gauges[key]
+                        lines.append(f'{with_label(key, label)} {value}' + (f' {ts}' if ts is not None else ''))
+            # 集群汇总：counter 为所有节点之和，gauge 按规则合并在线节点的值
+            label = f'{NODE_LABEL}="{CLUSTER_NODE}"'
+            func = self.gauge_func(name)
+            for key in keys:
+                if kinds.get(key) == 'counter':
+                    values = [counters[key] for _, counters, _ in snapshot if key in counters]
+                    if values:
+                        lines.append(f'{with_label(key, label)} {sum(values)}')
+                else:
+                    values = [gauges[key] for node, _, gauges in snapshot if node in up and key in gauges]
+                    if values:
+                        ts = [t for _, t in values if t is not None]
+                        lines.append(f'{with_label(key, label)} {func(v for v, _ in values)}' +
+                                     (f' {max(ts)}' if ts else ''))
+            if lines:
+                if help_text:
+                    m.append(f'# HELP {name} {help_text}')
+                if kind != 'untyped':
+                    m.append(f'# TYPE {name} {kind}')
+                m.extend(lines)
+        self._generate_self_metrics(m, self_stats, up)
+        return '\n'.join(m)
+
+    def _generate_self_metrics(self, m, self_stats, up):
+        m.append('# HELP jf_aggregator_node_up Whether the node pushed within STALE_AFTER seconds')
+        m.append('# TYPE jf_aggregator_node_up gauge')
+        for node, *_ in self_stats:
+            m.append(f'jf_aggregator_node_up{{node="{escape_label(node)}"}} {int(node in up)}')
+        m.append('# HELP jf_aggregator_node_last_push_timestamp_seconds Time of the last applied batch per node')
+        m.append('# TYPE jf_aggregator_node_last_push_timestamp_seconds gauge')
+        for node, last_push, *_ in self_stats:
+            m.append(f'jf_aggregator_node_last_push_timestamp_seconds{{node="{escape_label(node)}"}} {round(last_push, 3)}')
+        m.append('# HELP jf_aggregator_node_restarts_total Agent restarts seen per node (counters carried over)')
+        m.append('# TYPE jf_aggregator_node_restarts_total counter')
+        for node, _, restarts, *_ in self_stats:
+            m.append(f'jf_aggregator_node_restarts_total{{node="{escape_label(node)}"}} {restarts}')
+        m.append('# HELP jf_aggregator_batches_total Batches received per node by result')
+        m.append('# TYPE jf_aggregator_batches_total counter')
+        for node, _, _, batches, *_ in self_stats:
+            for result, n in batches.items():
+                m.append(f'jf_aggregator_batches_total{{node="{escape_label(node)}",result="{result}"}} {n}')
+        m.append('# HELP jf_aggregator_received_bytes_total Compressed batch bytes received per node')
+        m.append('# TYPE jf_aggregator_received_bytes_total counter')
+        for node, _, _, _, received, _ in self_stats:
+            m.append(f'jf_aggregator_received_bytes_total{{node="{escape_label(node)}"}} {received}')
+        m.append('# HELP jf_aggregator_series Series held per node')
+        m.append('# TYPE jf_aggregator_series gauge')
+        for node, *_, series in self_stats:
+            m.append(f'jf_aggregator_series{{node="{escape_label(node)}"}} {series}')
+
+    def cache_key(self):
+        """有新批次，或有节点在线状态可能变化时（每 5s 检查一次）重新生成"""
+        return (self.version, int(time.time() / 5))
+
+    def load_state(self):
+        """读取快照，再重放快照之后写入 journal 的批次"""
+        if not self.state_file:
+            return
+        saved = None
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file) as f:
+                    saved = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error(f"Failed to load state from {self.state_file}: {e}")
+                return
+        if saved is not None:
+            self.version = saved.get('version', 0)
+            self.families = saved['families']
+            self.family_keys = {name: dict.fromkeys(keys) for name, keys in saved['family_keys'].items()}
+            self.kinds = saved['kinds']
+            for node, data in saved['nodes'].items():
+                state = self.nodes[node] = NodeState()
+                state.boot = data['boot']
+                state.seq = data['seq']
+                state.counters = data['counters']
+                state.gauges = {key: tuple(value) for key, value in data['gauges'].items()}
+                state.last_push = data['last_push']
+                state.restarts = data['restarts']
+        replayed = 0
+        if os.path.exists(self.journal_file):
+            with open(self.journal_file) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # 崩溃时写了一半的最后一行，该批次未确认，节点会重发
+                        logger.warning(f"Ignoring truncated entry in {self.journal_file}")
+                        break
+                    # 已包含在快照中的批次（保存快照后、清空 journal 前崩溃）
+                    if entry['v'] <= self.version:
+                        continue
+                    state = self.nodes.get(entry['node'])
+                    if state is None:
+                        state = self.nodes[entry['node']] = NodeState()
+                    self.apply_entry(state, entry)
+                    state.last_push = time.time()
+                    replayed += 1
+        # id 定义不保存，节点的下一个批次需要带完整定义
+        for state in self.nodes.values():
+            state.resync = True
+        if self.nodes:
+            logger.info(f"Restored {len(self.nodes)} nodes from {self.state_file} ({replayed} journal entries)")
+
+    def write_journal(self, entry):
+        """追加一个批次并 fsync（调用方持有 self.lock），未开启 --state-file 时直接返回 True"""
+        if not self.journal_file:
+            return True
+        try:
+            if self.journal is None:
+                self.journal = open(self.journal_file, 'a')
+            self.journal.write(json.dumps(entry, separators=(',', ':')) + '\n')
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+            return True
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to write journal {self.journal_file}: {e}")
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
+            return False
+
+    def save_state(self):
+        """原子写入所有节点的累计值，成功后清空 journal；持有锁直到完成，保证快照与 journal 不重叠"""
+        if not self.state_file:
+            return
+        with self.lock:
+            saved = {
+                'version': self.version,
+                'families': self.families,
+                'family_keys': {name: list(keys) for name, keys in self.family_keys.items()},
+                'kinds': self.kinds,
+                'nodes': {node: {'boot': state.boot, 'seq': state.seq, 'counters': state.counters,
+                                 'gauges': state.gauges, 'last_push': state.last_push, 'restarts': state.restarts}
+                          for node, state in self.nodes.items()},
+            }
+            tmp = self.state_file + '.tmp'
+            try:
+                with open(tmp, 'w') as f:
+                    json.dump(saved, f, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.state_file)
+                if self.journal is not None:
+                    self.journal.close()
+                    self.journal = None
+                open(self.journal_file, 'w').close()
+            except OSError as e:
+                logger.error(f"Failed to save state to {self.state_file}: {e}")
+
+    def run_saver(self):
+        while True:
+            time.sleep(STATE_SAVE_INTERVAL)
+            self.save_state()
+
+# ========== /metrics 输出 ==========
+class AggregatorHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，agent 与 Prometheus 都可复用连接
+
+    def do_POST(self):
+        if self.path != '/push':
+            return self.reply(404, b'Not Found')
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            length = -1
+        if length < 0 or length > MAX_BATCH_BYTES:
+            # 不读取请求体，回复后关闭连接
+            self.close_connection = True
+            return self.reply(413 if length > 0 else 400, b'Batch too large' if length > 0 else b'Bad Request')
+        body = self.rfile.read(length)
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                # 限制解压后的大小，避免异常批次占满内存
+                decompressor = gzip.GzipFile(fileobj=io.BytesIO(body))
+                data = decompressor.read(MAX_BATCH_BYTES + 1)
+            else:
+                data = body
+            if len(data) > MAX_BATCH_BYTES:
+                return self.reply(413, b'Batch too large')
+            batch = json.loads(data)
+            status = aggregator.apply(batch, length)
+        except (OSError, ValueError, KeyError, TypeError, EOFError) as e:
+            logger.error(f"Bad batch from {self.client_address[0]}: {e}")
+            return self.reply(400, b'Bad Request')
+        self.reply(status, b'OK' if status == 200 else b'Resync')
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body, compressed = metrics_cache.get(openmetrics, 'gzip' in self.headers.get('Accept-Encoding', ''))
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.reply(200, b'OK')
+
+    def reply(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args): return
+
+def main():
+    global aggregator, metrics_cache
+    parser = argparse.ArgumentParser(description='Central aggregator for metrics pushed by jf_node_agent')
+    parser.add_argument('--port', type=int, default=AGGREGATOR_PORT)
+    parser.add_argument('--state-file', default=STATE_FILE, help='累计值保存路径，重启后 counter 不归零')
+    args = parser.parse_args()
+
+    aggregator = Aggregator(args.state_file)
+    metrics_cache = MetricsCache(aggregator.generate_metrics, aggregator.cache_key, GZIP_MIN_SIZE)
+    if args.state_file:
+        threading.Thread(target=aggregator.run_saver, daemon=True).start()
+    # docker stop 发送 SIGTERM，退出前保存一次
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), AggregatorHandler)
+    server.daemon_threads = True
+    logger.info(f"Aggregator started on port {args.port}")
+    try:
+        server.serve_forever()
+    except (KeyboardInterrupt, SystemExit):
+        server.server_close()
+    finally:
+        aggregator.save_state()
+
+if __name__ == "__main__":
+    main()
@@ -47,6 +47,39 @@ readonly PROMETHEUS_RETENTION_TIME="90d"
 readonly PROMETHEUS_SCRAPE_INTERVAL="15s"
 readonly PROMETHEUS_EVALUATION_INTERVAL="15s"
 
+# ============================================
+# 长期存储配置（可选）
+# ============================================
+# true: 另启动 prometheus-longterm 容器，每 LONGTERM_SCRAPE_INTERVAL 从主 Prometheus 的 /federate 拉取一次，
+#       以低分辨率保存 LONGTERM_RETENTION_TIME；主 Prometheus 的 PROMETHEUS_RETENTION_TIME 可相应缩短（如 15d）。
+#       查看长时间范围时在 Dashboard 的数据源变量中切换到 prometheus-longterm 数据源
+readonly LONGTERM_ENABLED="false"
+readonly LONGTERM_PORT="9091"
+readonly LONGTERM_SCRAPE_INTERVAL="1m"  # 不能超过 5m，否则超出查询的回溯窗口（lookback delta），曲线断开
+readonly LONGTERM_RETENTION_TIME="2y"
+# 拉取的序列: 默认全部（未预聚合的 gauge 面板和 Dashboard 变量也可查询）；只保留 recording rule 的结果可改为 '{__name__=~".+:.+"}'
+readonly LONGTERM_FEDERATE_MATCH='{__name__=~".+"}'
+
+# ============================================
+# 节点 Agent 配置
+# ============================================
+# true: 每个 Artifactory 节点只抓取 jf_node_agent 一个 target（request/s3/tcp 采集器合并在一个进程中）
+# false: 分别抓取 artifactory_request_exporter、s3_connection_exporter、artifactory_tcp_exporter
+readonly NODE_AGENT_ENABLED="false"
+readonly NODE_AGENT_PORT="8003"
+# true: jvm-exporter 抓取节点上的 jmx_relay.py（按固定间隔拉取 jmx agent 并过滤、缓存），不直接抓取 JVM 内的 agent
+readonly JMX_RELAY_ENABLED="false"
+readonly JMX_RELAY_PORT="30014"
+# true: artifactory-metrics 抓取节点上的 artifactory_metrics_relay.py（缓存 /artifactory/api/v1/metrics，token 配置在 relay 上）
+readonly ARTIFACTORY_METRICS_RELAY_ENABLED="false"
+readonly ARTIFACTORY_METRICS_RELAY_PORT="8004"
+# true: 各节点的 jf_node_agent 开启 push（jf_node_agent.json 中 push.url 指向本机 AGGREGATOR_PORT），
+#       由本机 jf-aggregator 容器合并为按节点 (node 标签) 和集群汇总 (node="_cluster") 的序列，Prometheus 只抓取 aggregator，
+#       不再逐个抓取各节点上的 request/s3/tcp exporter；节点数量变化时无需修改 prometheus.yml
+readonly PUSH_MODE_ENABLED="false"
+readonly AGGREGATOR_PORT="8005"
+readonly AGGREGATOR_IMAGE="python:3.11-slim"
+
 # ============================================
 # 日志函数
 # ============================================
@@ -94,6 +127,11 @@ display_configuration() {
     log "Grafana 端口:         ${GRAFANA_PORT}"
     log "Blackbox Exporter 端口: ${BLACKBOX_EXPORTER_PORT}"
     log "数据保留时间:        ${PROMETHEUS_RETENTION_TIME}"
+    log "节点 Agent:          ${NODE_AGENT_ENABLED} (端口 ${NODE_AGENT_PORT})"
+    log "JMX Relay:           ${JMX_RELAY_ENABLED} (端口 ${JMX_RELAY_PORT})"
+    log "Metrics Relay:       ${ARTIFACTORY_METRICS_RELAY_ENABLED} (端口 ${ARTIFACTORY_METRICS_RELAY_PORT})"
+    log "Push 模式:           ${PUSH_MODE_ENABLED} (Aggregator 端口 ${AGGREGATOR_PORT})"
+    log "长期存储:            ${LONGTERM_ENABLED} (端口 ${LONGTERM_PORT}, ${LONGTERM_SCRAPE_INTERVAL} 分辨率, 保留 ${LONGTERM_RETENTION_TIME})"
     log "========================================="
 }
 
@@ -243,6 +281,110 @@ generate_prometheus_config() {
     mkdir -p "$config_dir"
     mkdir -p "${JF_MONITORING_HOME}/prometheus/rules"
     
+    # JVM 指标：经 jmx_relay 抓取，或直接抓取 JVM 内的 jmx agent
+    local jvm_target="${artifactory_ip}:30013"
+    if [[ "${JMX_RELAY_ENABLED}" == "true" ]]; then
+        log "Using jmx_relay on port ${JMX_RELAY_PORT}"
+        jvm_target="${artifactory_ip}:${JMX_RELAY_PORT}"
+    fi
+    
+    # Artifactory 自身的 metrics：经 artifactory_metrics_relay 抓取，或直接抓取 8082
+    local artifactory_metrics_job
+    if [[ "${ARTIFACTORY_METRICS_RELAY_ENABLED}" == "true" ]]; then
+        log "Using artifactory_metrics_relay on port ${ARTIFACTORY_METRICS_RELAY_PORT}"
+        artifactory_metrics_job=$(cat << EOF
+  - job_name: 'artifactory-metrics'
+    scrape_interval: 5s
+    static_configs:
+      - targets: ['${artifactory_ip}:${ARTIFACTORY_METRICS_RELAY_PORT}']
+EOF
+)
+    else
+        artifactory_metrics_job=$(cat << EOF
+  - job_name: 'artifactory-metrics'
+    scrape_interval: 5s
+    authorization:
+      credentials: '${credentials}'
+    metrics_path: '/artifactory/api/v1/metrics'
+    static_configs:
+      - targets: ['${artifactory_ip}:8082']
+EOF
+)
+    fi
+    
+    # 节点上的自定义 exporter：push 模式下抓取 aggregator，或合并为 jf_node_agent 一个 target，或分别抓取
+    local exporter_jobs
+    if [[ "${PUSH_MODE_ENABLED}" == "true" ]]; then
+        log "Using push mode, scraping jf-aggregator on port ${AGGREGATOR_PORT}"
+        exporter_jobs=$(cat << EOF
+  - job_name: 'jf_aggregator'
+    static_configs:
+      - targets: ['jf-aggregator:8005']
+    scrape_interval: 5s
+    # 按指标名恢复各 exporter 原有的 job 标签，node 标签作为 instance（集群汇总为 instance="_cluster"）；
+    # instance 不再是各 exporter 的地址，Dashboard 通过 request_instance/s3_instance/tcp_instance 变量选择
+    metric_relabel_configs:
+      - source_labels: [__name__]
+        regex: 'artifactory_.*'
+        target_label: job
+        replacement: 'artifactory_request_exporter'
+      - source_labels: [__name__]
+        regex: 's3_.*|artifactory_s3_.*'
+        target_label: job
+        replacement: 'artifactory_s3_connections'
+      - source_labels: [__name__]
+        regex: 'tcp_port_.*|tcp_exporter_.*'
+        target_label: job
+        replacement: 'tcp_8081_exporter'
+      - source_labels: [node]
+        regex: '(.+)'
+        target_label: instance
+EOF
+)
+    elif [[ "${NODE_AGENT_ENABLED}" == "true" ]]; then
+        log "Using jf_node_agent on port ${NODE_AGENT_PORT}"
+        exporter_jobs=$(cat << EOF
+  - job_name: 'jf_node_agent'
+    static_configs:
+      - targets: ['${artifactory_ip}:${NODE_AGENT_PORT}']
+    scrape_interval: 5s
+    # 按指标名恢复各 exporter 原有的 job 标签；instance 为 agent 的地址（${artifactory_ip}:${NODE_AGENT_PORT}），
+    # Dashboard 通过 request_instance/s3_instance/tcp_instance 变量选择，不依赖各 exporter 原来的端口
+    metric_relabel_configs:
+      - source_labels: [__name__]
+        regex: 'artifactory_.*'
+        target_label: job
+        replacement: 'artifactory_request_exporter'
+      - source_labels: [__name__]
+        regex: 's3_.*|artifactory_s3_.*'
+        target_label: job
+        replacement: 'artifactory_s3_connections'
+      - source_labels: [__name__]
+        regex: 'tcp_port_.*|tcp_exporter_.*'
+        target_label: job
+        replacement: 'tcp_8081_exporter'
+EOF
+)
+    else
+        exporter_jobs=$(cat << EOF
+  - job_name: 'artifactory_s3_connections'
+    static_configs:
+      - targets: ['${artifactory_ip}:8001']
+    scrape_interval: 5s
+
+  - job_name: 'tcp_8081_exporter'
+    static_configs:
+      - targets: ['${artifactory_ip}:8000']
+    scrape_interval: 5s
+
+  - job_name: 'artifactory_request_exporter'
+    static_configs:
+      - targets: ['${artifactory_ip}:8002']
+    scrape_interval: 5s
+EOF
+)
+    fi
+    
     cat > "$config_file" << EOF
 global:
   scrape_interval: ${PROMETHEUS_SCRAPE_INTERVAL}
@@ -266,15 +408,9 @@ scrape_configs:
   - job_name: 'jvm-exporter'
     scrape_interval: 5s
     static_configs:
-      - targets: ['${artifactory_ip}:30013']
+      - targets: ['${jvm_target}']
 
-  - job_name: 'artifactory-metrics'
-    scrape_interval: 5s
-    authorization:
-      credentials: '${credentials}'
-    metrics_path: '/artifactory/api/v1/metrics'
-    static_configs:
-      - targets: ['${artifactory_ip}:8082']
+${artifactory_metrics_job}
 
   - job_name: 'blackbox-tcp'
     scrape_interval: 5s
@@ -309,23 +445,68 @@ scrape_configs:
       - target_label: __address__
         replacement: ${local_ip}:9115
 
-  - job_name: 'artifactory_s3_connections'
-    static_configs:
-      - targets: ['${artifactory_ip}:8001']
-    scrape_interval: 5s
+${exporter_jobs}
+EOF
+    
+    success "Prometheus configuration generated at $config_file"
+}
 
-  - job_name: 'tcp_8081_exporter'
-    static_configs:
-      - targets: ['${artifactory_ip}:8000']
-    scrape_interval: 5s
+# 安装 Dashboard 使用的 recording rules（由 dashboard_rules.py 根据 grafana/dashboard/*.json 生成）
+generate_recording_rules() {
+    local rules_source="${JF_MONITORING_HOME}/recording_rules.yml"
+    local rules_file="${JF_MONITORING_HOME}/prometheus/rules/jf_recording_rules.yml"
+    
+    log "Installing recording rules for the Grafana dashboards..."
+    
+    if [[ ! -f "$rules_source" ]]; then
+        warning "Recording rules not found at $rules_source, dashboards will show no data for recorded series"
+        return 0
+    fi
+    
+    mkdir -p "${JF_MONITORING_HOME}/prometheus/rules"
+    cp "$rules_source" "$rules_file"
+    
+    local rule_count
+    rule_count=$(grep -c -- '- record:' "$rules_file" || true)
+    success "Installed ${rule_count} recording rules at $rules_file"
+}
 
-  - job_name: 'artifactory_request_exporter'
+# 生成长期存储 Prometheus 的配置（LONGTERM_ENABLED=true 时）：从主 Prometheus 联邦拉取低分辨率数据
+generate_longterm_config() {
+    if [[ "${LONGTERM_ENABLED}" != "true" ]]; then
+        return 0
+    fi
+    
+    local config_dir="${JF_MONITORING_HOME}/prometheus-longterm/config"
+    local config_file="${config_dir}/prometheus.yml"
+    
+    log "Generating long-term Prometheus configuration..."
+    
+    mkdir -p "$config_dir" "${JF_MONITORING_HOME}/prometheus-longterm/data"
+    chmod 755 "$config_dir"
+    # Prometheus数据目录需要写权限
+    chmod 777 "${JF_MONITORING_HOME}/prometheus-longterm/data"
+    
+    cat > "$config_file" << EOF
+global:
+  scrape_interval: ${LONGTERM_SCRAPE_INTERVAL}
+  evaluation_interval: ${LONGTERM_SCRAPE_INTERVAL}
+  external_labels:
+    monitor: 'jf-monitor-longterm'
+
+scrape_configs:
+  - job_name: 'federate'
+    scrape_interval: ${LONGTERM_SCRAPE_INTERVAL}
+    honor_labels: true
+    metrics_path: '/federate'
+    params:
+      'match[]':
+        - '${LONGTERM_FEDERATE_MATCH}'
     static_configs:
-      - targets: ['${artifactory_ip}:8002']
-    scrape_interval: 5s
+      - targets: ['prometheus:9090']
 EOF
     
-    success "Prometheus configuration generated at $config_file"
+    success "Long-term Prometheus configuration generated at $config_file"
 }
 
 # 生成Grafana配置文件（可选）
@@ -469,6 +650,7 @@ setup_directory_permissions() {
         "${JF_MONITORING_HOME}/prometheus/config"
         "${JF_MONITORING_HOME}/prometheus/rules"
         "${JF_MONITORING_HOME}/blackbox-config"
+        "${JF_MONITORING_HOME}/aggregator"
     )
     
     for dir in "${all_dirs[@]}"; do
@@ -488,6 +670,58 @@ generate_docker_compose() {
     
     log "Generating docker-compose.yml with configuration variables..."
     
+    # push 模式：接收各节点 jf_node_agent 推送的 jf-aggregator，累计值保存在 ./aggregator/ 下，重启后 counter 不归零
+    local aggregator_service=""
+    if [[ "${PUSH_MODE_ENABLED}" == "true" ]]; then
+        aggregator_service=$(cat << EOF
+
+  jf-aggregator:
+    image: ${AGGREGATOR_IMAGE}
+    container_name: jf-aggregator
+    hostname: jf-aggregator
+    restart: unless-stopped
+    ports:
+      - '${AGGREGATOR_PORT}:8005'
+    volumes:
+      - './jf_aggregator.py:/app/jf_aggregator.py:ro'
+      - '../jf_monitoring_node/scripts/metrics_http.py:/app/metrics_http.py:ro'
+      - './aggregator:/data'
+    command: ['python3', '/app/jf_aggregator.py', '--port', '8005', '--state-file', '/data/state.json']
+    networks:
+      - monitoring-network
+EOF
+)
+    fi
+    
+    # 长期存储：低分辨率的第二个 Prometheus，只从主 Prometheus 联邦拉取
+    local longterm_service=""
+    if [[ "${LONGTERM_ENABLED}" == "true" ]]; then
+        longterm_service=$(cat << EOF
+
+  prometheus-longterm:
+    image: ${PROMETHEUS_IMAGE}
+    container_name: prometheus-longterm
+    hostname: prometheus-longterm
+    restart: unless-stopped
+    ports:
+      - '${LONGTERM_PORT}:9090'
+    volumes:
+      - './prometheus-longterm/config/prometheus.yml:/etc/prometheus/prometheus.yml'
+      - './prometheus-longterm/data:/prometheus'
+    command:
+      - '--config.file=/etc/prometheus/prometheus.yml'
+      - '--web.enable-lifecycle'
+      - '--storage.tsdb.retention.time=${LONGTERM_RETENTION_TIME}'
+      - '--storage.tsdb.path=/prometheus'
+    user: "root"
+    networks:
+      - monitoring-network
+    depends_on:
+      - prometheus
+EOF
+)
+    fi
+    
     cat > "$compose_file" << EOF
 services:
   prometheus:
@@ -554,6 +788,8 @@ services:
       interval: 30s
       timeout: 10s
       retries: 3
+${aggregator_service}
+${longterm_service}
 
 networks:
   monitoring-network:
@@ -568,6 +804,12 @@ EOF
     log_plain "  Prometheus: ${PROMETHEUS_IMAGE}"
     log_plain "  Grafana: ${GRAFANA_IMAGE}"
     log_plain "  Blackbox Exporter: ${BLACKBOX_EXPORTER_IMAGE}"
+    if [[ "${PUSH_MODE_ENABLED}" == "true" ]]; then
+        log_plain "  Aggregator: ${AGGREGATOR_IMAGE}"
+    fi
+    if [[ "${LONGTERM_ENABLED}" == "true" ]]; then
+        log_plain "  Prometheus (long-term): ${PROMETHEUS_IMAGE}"
+    fi
 }
 
 # 检查Docker Compose版本并创建兼容的配置文件
@@ -739,11 +981,14 @@ Grafana URL:          http://${local_ip}:${GRAFANA_PORT}
 Grafana Login:        ${GRAFANA_ADMIN_USER} / ${GRAFANA_ADMIN_PASSWORD}
 Blackbox Exporter URL: http://${local_ip}:${BLACKBOX_EXPORTER_PORT}
 Artifactory IP:       ${artifactory_ip}
+Push Mode:            ${PUSH_MODE_ENABLED} (jf_node_agent push.url: http://${local_ip}:${AGGREGATOR_PORT}/push)
+Long-term Storage:    ${LONGTERM_ENABLED} (http://${local_ip}:${LONGTERM_PORT}, ${LONGTERM_SCRAPE_INTERVAL} resolution, retention ${LONGTERM_RETENTION_TIME})
 
 Prometheus Configuration:
 Retention Time:       ${PROMETHEUS_RETENTION_TIME}
 Scrape Interval:      ${PROMETHEUS_SCRAPE_INTERVAL}
 Evaluation Interval:  ${PROMETHEUS_EVALUATION_INTERVAL}
+Recording Rules:      ${JF_MONITORING_HOME}/prometheus/rules/jf_recording_rules.yml
 
 Important Configuration Steps:
 1. Log in to Grafana at http://${local_ip}:${GRAFANA_PORT}
@@ -751,6 +996,7 @@ Important Configuration Steps:
 3. Add Prometheus data source:
    - URL: http://${local_ip}:${PROMETHEUS_PORT}
    - Access: Proxy
+   - Long-term (if enabled): http://${local_ip}:${LONGTERM_PORT}
 4. Import dashboards for monitoring
 
 Service Management Commands:
@@ -783,11 +1029,18 @@ Log File:              ${LOG_FILE}"
     echo -e "Grafana Login:        ${GREEN}${GRAFANA_ADMIN_USER} / ${GRAFANA_ADMIN_PASSWORD}${NC}"
     echo -e "Blackbox Exporter URL: ${GREEN}http://${local_ip}:${BLACKBOX_EXPORTER_PORT}${NC}"
     echo -e "Artifactory IP:       ${GREEN}${artifactory_ip}${NC}"
+    if [[ "${PUSH_MODE_ENABLED}" == "true" ]]; then
+        echo -e "Push URL:             ${GREEN}http://${local_ip}:${AGGREGATOR_PORT}/push${NC} (jf_node_agent.json push.url)"
+    fi
+    if [[ "${LONGTERM_ENABLED}" == "true" ]]; then
+        echo -e "Long-term URL:        ${GREEN}http://${local_ip}:${LONGTERM_PORT}${NC} (${LONGTERM_SCRAPE_INTERVAL} resolution, retention ${LONGTERM_RETENTION_TIME})"
+    fi
     echo ""
     echo -e "${YELLOW}Prometheus Configuration:${NC}"
     echo -e "Retention Time:       ${GREEN}${PROMETHEUS_RETENTION_TIME}${NC}"
     echo -e "Scrape Interval:      ${GREEN}${PROMETHEUS_SCRAPE_INTERVAL}${NC}"
     echo -e "Evaluation Interval:  ${GREEN}${PROMETHEUS_EVALUATION_INTERVAL}${NC}"
+    echo -e "Recording Rules:      ${GREEN}${JF_MONITORING_HOME}/prometheus/rules/jf_recording_rules.yml${NC}"
     echo ""
     echo -e "${YELLOW}Important Configuration Steps:${NC}"
     echo -e "1. Log in to Grafana at ${GREEN}http://${local_ip}:${GRAFANA_PORT}${NC}"
@@ -795,6 +1048,9 @@ Log File:              ${LOG_FILE}"
     echo -e "3. Add Prometheus data source:"
     echo -e "   - URL: ${GREEN}http://${local_ip}:${PROMETHEUS_PORT}${NC}"
     echo -e "   - Access: ${GREEN}Proxy${NC}"
+    if [[ "${LONGTERM_ENABLED}" == "true" ]]; then
+        echo -e "   - Long-term data source URL: ${GREEN}http://${local_ip}:${LONGTERM_PORT}${NC}"
+    fi
     echo -e "4. Import dashboards for monitoring"
     echo ""
     echo -e "${YELLOW}Service Management Commands:${NC}"
@@ -878,6 +1134,8 @@ jf_monitoring() {
     
     # 生成配置文件
     generate_prometheus_config "$local_ip" "$artifactory_ip" "$credentials"
+    generate_recording_rules
+    generate_longterm_config
     generate_grafana_config
     create_blackbox_config
     
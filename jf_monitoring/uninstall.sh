@@ -28,6 +28,14 @@ uninstall_jf_monitoring() {
     
     # 移动文件到备份目录
     /usr/bin/mv grafana blackbox-config prometheus installation.log "${backup_dir}/backup_${date_backup}/"
+    # push 模式下 jf-aggregator 保存的累计值
+    if [ -d aggregator ]; then
+        /usr/bin/mv aggregator "${backup_dir}/backup_${date_backup}/"
+    fi
+    # 长期存储 Prometheus 的配置和数据
+    if [ -d prometheus-longterm ]; then
+        /usr/bin/mv prometheus-longterm "${backup_dir}/backup_${date_backup}/"
+    fi
     
     # 确认备份成功
     if [ $? -eq 0 ]; then
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+Artifactory Metrics Relay:
+Prometheus 每次抓取 /artifactory/api/v1/metrics 都会让 Artifactory 重新生成完整的指标，多个 Prometheus 副本或临时的 curl
+都会重复这部分开销，并出现在 Artifactory 的请求日志中。本脚本在节点上代为抓取：每个 FETCH_INTERVAL 最多请求一次上游
+（有抓取时才请求，复用同一个 keep-alive 连接，上游支持时带 If-None-Match/If-Modified-Since），只保留 ALLOW_FAMILIES 中
+Dashboard 使用的指标族，缓存后提供给所有抓取方:
+ARTIFACTORY_TOKEN=<access token> nohup python3 artifactory_metrics_relay.py &
+"""
+
+import argparse
+import bisect
+import gzip
+import http.client
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache, filter_families
+
+# ========== Configuration ==========
+UPSTREAM_URL = 'http://localhost:8082/artifactory/api/v1/metrics'
+ACCESS_TOKEN = os.environ.get('ARTIFACTORY_TOKEN', '')  # Bearer token，也可用 --token-file 指定
+RELAY_PORT = 8004
+FETCH_INTERVAL = 15  # 两次请求上游的最小间隔（秒），期间的抓取都返回缓存
+FETCH_TIMEOUT = 10
+GZIP_MIN_SIZE = 1024  # 客户端支持 gzip 且输出超过此字节数时压缩
+FETCH_DURATION_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+# 保留的指标族（正则，完整匹配族名），为 Dashboard 中使用的 jfrt_*/tomcat_* 指标
+ALLOW_FAMILIES = [
+    r'jfrt_artifacts_gc_.*',
+    r'jfrt_db_connections_.*',
+    r'jfrt_projects_.*',
+    r'jfrt_runtime_heap_.*',
+    r'tomcat_threads_.*',
+]
+# ===================================
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class MetricsRelay:
+    def __init__(self, url=UPSTREAM_URL, token=ACCESS_TOKEN):
+        parsed = urllib.parse.urlsplit(url)
+        self.scheme = parsed.scheme
+        self.netloc = parsed.netloc
+        self.path = parsed.path + (f'?{parsed.query}' if parsed.query else '')
+        self.headers = {'Accept-Encoding': 'gzip'}
+        if token:
+            self.headers['Authorization'] = f'Bearer {token}'
+        self.conn = None
+        self.lock = threading.Lock()
+        self.allow = re.compile('|'.join(f'(?:{p})' for p in ALLOW_FAMILIES))
+        self.allowed = {}  # 族名 -> 是否保留
+        self.text = ''
+        self.validators = {}  # 上游返回的 ETag / Last-Modified
+        self.last_fetch = 0
+        # 请求上游的指标
+        self.up = 0
+        self.fetch_bytes = 0
+        self.families_kept = 0
+        self.families_dropped = 0
+        self.fetches = {'ok': 0, 'not_modified': 0, 'error': 0}
+        self.duration_counts = [0] * (len(FETCH_DURATION_BUCKETS) + 1)  # 最后一个为 +Inf
+        self.duration_sum = 0.0
+
+    def version(self):
+        """每个 FETCH_INTERVAL 变化一次，/metrics 的缓存据此最多每个间隔重新生成（并请求上游）一次"""
+        return int(time.time() / FETCH_INTERVAL)
+
+    def is_allowed(self, family):
+        allowed = self.allowed.get(family)
+        if allowed is None:
+            allowed = self.allowed[family] = self.allow.fullmatch(family) is not None
+        return allowed
+
+    def _request(self):
+        """通过保持的 keep-alive 连接请求上游；连接已被关闭时重连一次"""
+        headers = dict(self.headers)
+        if 'etag' in self.validators:
+            headers['If-None-Match'] = self.validators['etag']
+        if 'last-modified' in self.validators:
+            headers['If-Modified-Since'] = self.validators['last-modified']
+        for attempt in (1, 2):
+            if self.conn is None:
+                cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+                self.conn = cls(self.netloc, timeout=FETCH_TIMEOUT)
+            try:
+                self.conn.request('GET', self.path, headers=headers)
+                response = self.conn.getresponse()
+                return response, response.read()
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt == 2:
+                    raise
+
+    def fetch(self):
+        """请求上游并更新缓存（只在生成 /metrics 的线程中调用）"""
+        start = time.perf_counter()
+        try:
+            response, body = self._request()
+            if response.status == 304:
+                result = 'not_modified'
+            elif response.status == 200:
+                if response.getheader('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                text, kept, dropped = filter_families(body.decode('utf-8', 'ignore'), self.is_allowed)
+                validators = {k: response.getheader(k) for k in ('etag', 'last-modified') if response.getheader(k)}
+                result = 'ok'
+            else:
+                raise http.client.HTTPException(f"HTTP {response.status}")
+        except Exception as e:
+            logger.error(f"Fetch {self.scheme}://{self.netloc}{self.path} failed: {e}")
+            result = 'error'
+        duration = time.perf_counter() - start
+        with self.lock:
+            self.fetches[result] += 1
+            self.up = 0 if result == 'error' else 1
+            self.duration_counts[bisect.bisect_left(FETCH_DURATION_BUCKETS, duration)] += 1
+            self.duration_sum += duration
+            self.last_fetch = time.time()
+            if result == 'ok':
+                self.text = text
+                self.validators = validators
+                self.fetch_bytes = len(body)
+                self.families_kept = kept
+                self.families_dropped = dropped
+            elif result == 'error':
+                # 上游不可用时不再输出旧数据
+                self.text = ''
+
+    def generate_metrics(self) -> str:
+        if int(self.last_fetch / FETCH_INTERVAL) != self.version():
+            self.fetch()
+        with self.lock:
+            m = [
+                '# HELP artifactory_metrics_relay_upstream_up Whether the last fetch from Artifactory succeeded',
+                '# TYPE artifactory_metrics_relay_upstream_up gauge',
+                f'artifactory_metrics_relay_upstream_up {self.up}',
+                '# HELP artifactory_metrics_relay_fetches_total Fetches from Artifactory by result',
+                '# TYPE artifactory_metrics_relay_fetches_total counter',
+            ]
+            m += [f'artifactory_metrics_relay_fetches_total{{result="{k}"}} {v}' for k, v in self.fetches.items()]
+            m += [
+                '# HELP artifactory_metrics_relay_fetch_duration_seconds Latency of fetches from Artifactory',
+                '# TYPE artifactory_metrics_relay_fetch_duration_seconds histogram',
+            ]
+            cumulative = 0
+            for bound, n in zip(FETCH_DURATION_BUCKETS, self.duration_counts):
+                cumulative += n
+                m.append(f'artifactory_metrics_relay_fetch_duration_seconds_bucket{{le="{bound}"}} {cumulative}')
+            cumulative += self.duration_counts[-1]
+            m += [
+                f'artifactory_metrics_relay_fetch_duration_seconds_bucket{{le="+Inf"}} {cumulative}',
+                f'artifactory_metrics_relay_fetch_duration_seconds_sum {round(self.duration_sum, 6)}',
+                f'artifactory_metrics_relay_fetch_duration_seconds_count {cumulative}',
+                '# HELP artifactory_metrics_relay_fetch_bytes Size of the last full response from Artifactory',
+                '# TYPE artifactory_metrics_relay_fetch_bytes gauge',
+                f'artifactory_metrics_relay_fetch_bytes {self.fetch_bytes}',
+                '# HELP artifactory_metrics_relay_families Metric families in the last response by action',
+                '# TYPE artifactory_metrics_relay_families gauge',
+                f'artifactory_metrics_relay_families{{action="kept"}} {self.families_kept}',
+                f'artifactory_metrics_relay_families{{action="dropped"}} {self.families_dropped}',
+            ]
+            if self.text:
+                m.append(self.text)
+        return '\n'.join(m)
+
+# ========== /metrics 输出 ==========
+class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，Prometheus 可复用连接
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body, compressed = metrics_cache.get(openmetrics, 'gzip' in self.headers.get('Accept-Encoding', ''))
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+        else:
+            body = b"OK"
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args): return
+
+def main():
+    global metrics_cache
+    parser = argparse.ArgumentParser(description='Caching relay for the Artifactory /api/v1/metrics endpoint')
+    parser.add_argument('--upstream', default=UPSTREAM_URL, help='Artifactory metrics 地址')
+    parser.add_argument('--token-file', help='从文件读取 access token（默认读取环境变量 ARTIFACTORY_TOKEN）')
+    parser.add_argument('--port', type=int, default=RELAY_PORT)
+    args = parser.parse_args()
+
+    token = ACCESS_TOKEN
+    if args.token_file:
+        with open(args.token_file) as f:
+            token = f.read().strip()
+    if not token:
+        logger.warning("No access token configured, requests to Artifactory will be anonymous")
+
+    relay = MetricsRelay(args.upstream, token)
+    metrics_cache = MetricsCache(relay.generate_metrics, relay.version, GZIP_MIN_SIZE)
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), MetricsHandler)
+    server.daemon_threads = True
+    logger.info(f"Artifactory metrics relay for {args.upstream} started on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""
+JFrog Artifactory Node Agent:
+用一个进程、一个 HTTP 端口替代 artifactory_request_exporter (8002)、s3_connection_exporter (8001)、
+artifactory_tcp_exporter / tomcat_thread_exporter (8000)，每个节点只需一个 Prometheus target。
+
+各 exporter 脚本作为采集器 (collector) 被加载，在配置文件中开启/关闭:
+nohup python3 jf_node_agent.py -c jf_node_agent.json &
+
+exporter 脚本与本脚本放在同一目录（如 /opt/jf_monitoring_node/），或位于仓库中的原始目录。
+/metrics 为多线程 HTTP/1.1 (keep-alive) 服务，各采集器数据都未变化时复用上次的输出；支持 gzip 和 OpenMetrics。
+配置文件中开启 push 后，按固定间隔把 counter 增量和变化的 gauge 打包推送到中心的 jf_aggregator.py（jf_monitoring/ 目录），
+集群的所有节点只需 Prometheus 抓取 aggregator 一个 target。
+"""
+
+import argparse
+import gzip
+import http.client
+import importlib.util
+import json
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlsplit
+
+from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache
+
+# ========== Configuration ==========
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'jf_node_agent.json')
+AGENT_PORT = 8003
+GZIP_MIN_SIZE = 1024  # 客户端支持 gzip 且输出超过此字节数时压缩
+PUSH_INTERVAL = 5     # push 模式下两次推送的间隔（秒），可在配置文件 push.interval 中覆盖
+PUSH_TIMEOUT = 10
+
+# 查找 exporter 脚本的目录，依次尝试
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(os.path.dirname(SCRIPT_DIR))
+EXPORTER_DIRS = [
+    SCRIPT_DIR,
+    os.path.join(REPO_DIR, 'Artifactory Request 监控'),
+    os.path.join(REPO_DIR, 'S3 连接数监控'),
+    os.path.join(REPO_DIR, 'Artifactory TCP 连接数监控'),
+]
+# ===================================
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+CONFIG_END = re.compile(r'^# =+[ \t]*$', re.M)  # exporter 脚本配置区的结束行
+
+def load_exporter_module(filename, settings=None):
+    """
+    按文件路径加载 exporter 脚本，并用 settings 覆盖其配置区中的同名常量。
+    先执行到配置区结束行，覆盖配置后再执行模块的其余部分，由配置派生的值
+    （如 REPO_API_TYPE_SET、直方图边界、LATENCY_TIERS 对应的统计列）使用覆盖后的配置。
+    """
+    for directory in EXPORTER_DIRS:
+        path = os.path.join(directory, filename)
+        if os.path.isfile(path):
+            break
+    else:
+        raise FileNotFoundError(f"{filename} not found in {EXPORTER_DIRS}")
+
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    end = CONFIG_END.search(source)
+    head, body = (source[:end.end()], source[end.end():]) if end else (source, '')
+    spec = importlib.util.spec_from_file_location(os.path.splitext(filename)[0], path)
+    module = importlib.util.module_from_spec(spec)
+    exec(compile(head, path, 'exec'), module.__dict__)
+    for key, value in (settings or {}).items():
+        if not hasattr(module, key):
+            raise KeyError(f"{filename} has no setting {key}")
+        if isinstance(getattr(module, key), dict) and isinstance(value, dict):
+            getattr(module, key).update(value)
+        else:
+            setattr(module, key, value)
+    # 补齐前面的行数，异常堆栈中的行号与脚本文件一致
+    exec(compile('\n' * head.count('\n') + body, path, 'exec'), module.__dict__)
+    logger.info(f"Loaded {path}")
+    return module
+
+# ========== Collectors ==========
+COLLECTORS = {}
+
+def register(cls):
+    COLLECTORS[cls.name] = cls
+    return cls
+
+class Collector:
+    """
+    采集器插件接口：
+    - name: 配置文件中 collectors 下的键
+    - start(pool): 把需要长期运行的采集任务（如日志跟踪）提交到 agent 的线程池，每个任务独占一个线程
+    - collect(): 返回 Prometheus 文本格式的指标
+    - version(): 数据版本，未变化时 /metrics 复用缓存的输出；默认每次都重新生成
+    """
+    name = None
+
+    def __init__(self, options):
+        self.options = options
+
+    def start(self, pool):
+        pass
+
+    def collect(self) -> str:
+        raise NotImplementedError
+
+    def version(self):
+        return time.monotonic()
+
+@register
+class RequestCollector(Collector):
+    """*-request.log 请求统计 (artifactory_request_exporter.RequestMonitor，按 LOG_SOURCES 在一个线程内跟踪多个日志)"""
+    name = 'request'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.module = load_exporter_module('artifactory_request_exporter.py', options.get('settings'))
+        self.monitor = self.module.RequestMonitor(self.module.LOG_SOURCES)
+
+    def start(self, pool):
+        pool.submit(self.monitor.start)
+
+    def collect(self):
+        return self.monitor.generate_metrics()
+
+    def version(self):
+        return self.monitor.version()
+
+@register
+class S3Collector(Collector):
+    """artifactory-connectionpool.log S3 连接池 (s3_connection_exporter.S3ConnectionMetrics)"""
+    name = 's3'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.module = load_exporter_module('s3_connection_exporter.py', options.get('settings'))
+        self.metrics = self.module.S3ConnectionMetrics()
+        self.tailer = self.module.LogTailer(self.module.LOG_FILE_PATH, self.metrics)
+
+    def start(self, pool):
+        pool.submit(self.tailer.start)
+
+    def collect(self):
+        return self.metrics.generate_metrics()
+
+    def version(self):
+        stats = self.metrics.stats
+        return (self.metrics.version, stats.lines_read, sum(stats.rotations.values()), stats.lag_key(),
+                int(time.time() / self.module.WINDOW_SIZE))
+
+@register
+class TcpCollector(Collector):
+    """
+    端口 TCP 连接数 (artifactory_tcp_exporter 的计数逻辑)。
+    tomcat_thread_exporter 为其单端口版本，monitor_ports 中配置 8081 即可替代。
+    """
+    name = 'tcp'
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.module = load_exporter_module('artifactory_tcp_exporter.py', options.get('settings'))
+        self.lock = threading.Lock()
+        self.port_states = {}
+        self.refreshes = 0
+
+    def refresh(self):
+        config = self.module.CONFIG
+        ports = config["monitor_ports"]
+        if config["collector"] == "procfs":
+            states = self.module.read_socket_states(ports)
+        else:
+            states = {}
+            for port in ports:
+                established, timewait = self.module.get_connection_counts_for_port(port)
+                states[port] = {'established': established, 'time_wait': timewait}
+        with self.lock:
+            self.port_states = states
+            self.refreshes += 1
+
+    def run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"TCP collector error: {e}")
+            time.sleep(self.module.CONFIG["refresh_interval"])
+
+    def start(self, pool):
+        pool.submit(self.run)
+
+    def collect(self):
+        with self.lock:
+            port_states = self.port_states
+        m = [
+            '# HELP tcp_port_established Number of ESTABLISHED connections',
+            '# TYPE tcp_port_established gauge',
+        ]
+        m += [f'tcp_port_established{{port="{p}"}} {s.get("established", 0)}' for p, s in port_states.items()]
+        m += [
+            '# HELP tcp_port_timewait Number of TIME_WAIT connections',
+            '# TYPE tcp_port_timewait gauge',
+        ]
+        m += [f'tcp_port_timewait{{port="{p}"}} {s.get("time_wait", 0)}' for p, s in port_states.items()]
+        if self.module.CONFIG["collector"] == "procfs":
+            m += [
+                '# HELP tcp_port_connections Number of TCP connections by state',
+                '# TYPE tcp_port_connections gauge',
+            ]
+            for p, s in port_states.items():
+                m += [f'tcp_port_connections{{port="{p}",state="{state}"}} {s.get(state, 0)}'
+                      for state in self.module.TCP_STATES.values()]
+        durations = sorted(self.module.command_durations.items())
+        if durations:
+            m += [
+                '# HELP tcp_exporter_command_duration_seconds Duration of external commands run by the exporter',
+                '# TYPE tcp_exporter_command_duration_seconds histogram',
+            ]
+            for command, (counts, total) in durations:
+                cumulative = 0
+                for bound, n in zip(self.module.CONFIG["command_duration_buckets"], counts):
+                    cumulative += n
+                    m.append(f'tcp_exporter_command_duration_seconds_bucket{{command="{command}",le="{bound}"}} {cumulative}')
+                cumulative += counts[-1]
+                m.append(f'tcp_exporter_command_duration_seconds_bucket{{command="{command}",le="+Inf"}} {cumulative}')
+                m.append(f'tcp_exporter_command_duration_seconds_sum{{command="{command}"}} {round(total, 6)}')
+                m.append(f'tcp_exporter_command_duration_seconds_count{{command="{command}"}} {cumulative}')
+        return "\n".join(m)
+
+    def version(self):
+        return self.refreshes
+
+# ========== Agent ==========
+class NodeAgent:
+    def __init__(self, config):
+        self.collectors = []
+        for name, options in config.get('collectors', {}).items():
+            if not options.get('enabled', True):
+                continue
+            if name not in COLLECTORS:
+                raise KeyError(f"Unknown collector '{name}', available: {', '.join(COLLECTORS)}")
+            self.collectors.append(COLLECTORS[name](options))
+        # 每个采集器的后台任务是一个长期阻塞的循环（日志跟踪、TCP 定时刷新），各占线程池中的一个线程；
+        # 各日志并不共用一个跟踪循环，只有 request 采集器在一个线程内跟踪 LOG_SOURCES 中的所有日志
+        self.pool = ThreadPoolExecutor(max_workers=max(1, len(self.collectors)), thread_name_prefix='collector')
+
+    def start(self):
+        for collector in self.collectors:
+            collector.start(self.pool)
+        logger.info(f"Collectors started: {', '.join(c.name for c in self.collectors)}")
+
+    def generate_metrics(self) -> str:
+        parts = []
+        for collector in self.collectors:
+            try:
+                parts.append(collector.collect())
+            except Exception as e:
+                logger.error(f"Collector {collector.name} failed: {e}")
+        return "\n\n".join(parts)
+
+    def version(self):
+        return tuple(collector.version() for collector in self.collectors)
+
+    def slow_requests(self, service=None):
+        """request 采集器中 service 的 SlowRequestTracker，未启用时为 None"""
+        for collector in self.collectors:
+            if isinstance(collector, RequestCollector):
+                return collector.monitor.slow_requests(service)
+        return None
+
+# ========== Push 模式 ==========
+def parse_exposition(text):
+    """
+    Prometheus 文本格式 -> (族 {族名: [类型, HELP]}, 样本 [(族名, 样本键, 类型, 值, 时间戳)])。
+    样本键为值之前的部分（如 artifactory_requests_by_code_total{service="artifactory",code="200"}）；
+    histogram/summary 的 _bucket/_sum/_count 按 counter 处理，没有 TYPE 的样本按 gauge 处理。
+    """
+    families = {}
+    samples = []
+    name = None
+    for line in text.split('\n'):
+        if not line:
+            continue
+        if line.startswith('#'):
+            parts = line.split(' ', 3)
+            if len(parts) == 4 and parts[1] in ('HELP', 'TYPE'):
+                name = parts[2]
+                family = families.setdefault(name, ['untyped', ''])
+                family[0 if parts[1] == 'TYPE' else 1] = parts[3]
+            continue
+        end = line.rfind('}')
+        if end >= 0:
+            key, rest = line[:end + 1], line[end + 1:].split()
+        else:
+            key, _, rest = line.partition(' ')
+            rest = rest.split()
+        if not rest:
+            continue
+        try:
+            value = float(rest[0])
+            ts = int(rest[1]) if len(rest) > 1 else None
+        except ValueError:
+            continue
+        metric = key.split('{', 1)[0]
+        if name is None or not (metric == name or metric.startswith(name + '_')):
+            name = metric
+            families.setdefault(name, ['untyped', ''])
+        kind = families[name][0]
+        if kind == 'counter' or (kind in ('histogram', 'summary') and metric != name):
+            kind = 'counter'
+        else:
+            kind = 'gauge'
+        samples.append((name, key, kind, value, ts))
+    return families, samples
+
+def compact(value):
+    """整数值按 int 发送，减小批次体积"""
+    return int(value) if value.is_integer() else value
+
+class Pusher:
+    """
+    push 模式：每 interval 秒渲染一次本节点的指标，与上次确认送达的状态比较，生成一个增量批次 POST 到 aggregator:
+    - counter 只发送增量（变小视为采集器重置，增量为当前值），gauge 只发送变化的值，消失的 gauge 列入 gone
+    - 样本键首次出现时分配整数 id 并随批次发送定义，之后只发送 id
+    - boot 每次启动不同，aggregator 据此识别节点重启，把新一轮的增量累加到原有的总数上，counter 不会归零
+    - seq 递增；发送失败时下次重发同一批次（aggregator 按 seq 去重），期间的增量留到下一批
+    - aggregator 返回 409（重启后丢失了本节点的 id 定义）时，下一批重新发送全部定义和 gauge
+    """
+    def __init__(self, render, options):
+        self.render = render
+        url = urlsplit(options['url'])
+        self.scheme, self.netloc = url.scheme, url.netloc
+        self.path = url.path or '/push'
+        self.interval = options.get('interval', PUSH_INTERVAL)
+        self.node = options.get('node') or socket.gethostname()
+        self.boot = f'{int(time.time())}-{os.getpid()}'
+        self.seq = 0
+        self.ids = {}           # 样本键 -> id
+        self.defined = set()    # aggregator 已确认的 id
+        self.described = set()  # aggregator 已确认的族 (HELP/TYPE)
+        self.counters = {}      # id -> 已确认发送的累计值
+        self.gauges = {}        # id -> 已确认发送的 (值, 时间戳)
+        self.pending = None     # 未确认的批次 (body, 确认后的状态)
+        self.conn = None
+        self.pushes = {'ok': 0, 'error': 0}
+
+    def build(self):
+        families, samples = parse_exposition(self.render())
+        ids = self.ids
+        series, counters, gauges = {}, [], []
+        sent_counters, sent_gauges = self.counters, self.gauges
+        new_counters, new_gauges = {}, {}
+        for name, key, kind, value, ts in samples:
+            sid = ids.get(key)
+            if sid is None:
+                sid = ids[key] = len(ids)
+            if sid not in self.defined:
+                series[sid] = [name, key, kind]
+            if kind == 'counter':
+                last = sent_counters.get(sid, 0)
+                delta = value - last if value >= last else value
+                if delta:
+                    counters.append([sid, compact(delta)])
+                new_counters[sid] = value
+            else:
+                if sent_gauges.get(sid) != (value, ts) or sid in series:
+                    gauges.append([sid, compact(value)] if ts is None else [sid, compact(value), ts])
+                new_gauges[sid] = (value, ts)
+        # counter 消失时保留已确认的值，重新出现时按增量继续累加
+        new_counters = {**sent_counters, **new_counters}
+        batch = {
+            'node': self.node,
+            'boot': self.boot,
+            'seq': self.seq + 1,
+            'full': not self.defined,  # 包含全部定义和 gauge（新启动或重新同步）
+            'families': {name: families[name] for name in dict.fromkeys(s[0] for s in series.values())
+                         if name not in self.described},
+            'series': series,
+            'counters': counters,
+            'gauges': gauges,
+            'gone': [sid for sid in sent_gauges if sid not in new_gauges],
+        }
+        body = gzip.compress(json.dumps(batch, separators=(',', ':')).encode('utf-8'))
+        return body, (batch['seq'], set(series), set(batch['families']), new_counters, new_gauges)
+
+    def send(self, body):
+        """POST 一个批次，返回 HTTP 状态码；复用的连接已被对端关闭时换新连接重试一次（aggregator 按 seq 去重，重试是安全的）"""
+        for attempt in range(2):
+            reused = self.conn is not None
+            if not reused:
+                cls = http.client.HTTPSConnection if self.scheme == 'https' else http.client.HTTPConnection
+                self.conn = cls(self.netloc, timeout=PUSH_TIMEOUT)
+            try:
+                self.conn.request('POST', self.path, body, {'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+                resp = self.conn.getresponse()
+                resp.read()
+                return resp.status
+            except (OSError, http.client.HTTPException):
+                self.conn.close()
+                self.conn = None
+                if not reused or attempt:
+                    raise
+
+    def push_once(self):
+        if self.pending is None:
+            self.pending = self.build()
+        body, (seq, series, described, counters, gauges) = self.pending
+        status = self.send(body)
+        if status == 409:
+            logger.warning(f"Aggregator does not know node {self.node} (boot {self.boot}), resending definitions")
+            self.defined.clear()
+            self.described.clear()
+            self.gauges = {}
+            self.pending = None
+            return
+        if status != 200:
+            raise RuntimeError(f"aggregator returned HTTP {status}")
+        self.seq = seq
+        self.defined |= series
+        self.described |= described
+        self.counters, self.gauges = counters, gauges
+        self.pending = None
+
+    def run(self):
+        logger.info(f"Pushing to {self.scheme}://{self.netloc}{self.path} every {self.interval}s as node {self.node}")
+        while True:
+            started = time.time()
+            try:
+                self.push_once()
+                self.pushes['ok'] += 1
+            except Exception as e:
+                self.pushes['error'] += 1
+                logger.error(f"Push failed: {e}")
+            time.sleep(max(0.0, self.interval - (time.time() - started)))
+
+# ========== /metrics 输出 ==========
+def debug_service(path):
+    """/debug/slow?service=router 中的 service，未指定时为 None"""
+    return parse_qs(urlsplit(path).query).get('service', [None])[0]
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，Prometheus 可复用连接
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body, compressed = metrics_cache.get(openmetrics, 'gzip' in self.headers.get('Accept-Encoding', ''))
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+        elif self.path.split('?', 1)[0] == '/debug/slow' and agent.slow_requests(debug_service(self.path)) is not None:
+            body = json.dumps(agent.slow_requests(debug_service(self.path)).to_dict(), indent=2).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+        else:
+            body = b"OK"
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args): return
+
+def main():
+    global agent, metrics_cache
+    parser = argparse.ArgumentParser(description='JFrog Artifactory node monitoring agent')
+    parser.add_argument('-c', '--config', default=CONFIG_FILE, help='配置文件路径 (JSON)')
+    args = parser.parse_args()
+
+    with open(args.config) as f:
+        config = json.load(f)
+    port = config.get('port', AGENT_PORT)
+
+    agent = NodeAgent(config)
+    agent.start()
+    metrics_cache = MetricsCache(agent.generate_metrics, agent.version, GZIP_MIN_SIZE)
+    push = config.get('push', {})
+    if push.get('enabled', False):
+        pusher = Pusher(lambda: metrics_cache.get()[0].decode('utf-8'), push)
+        threading.Thread(target=pusher.run, daemon=True).start()
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    server.daemon_threads = True
+    logger.info(f"Node agent started on port {port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+JMX Relay:
+jmx_prometheus_javaagent (默认端口 30013) 在 Artifactory JVM 内部遍历并序列化 MBean，每次抓取都消耗 Artifactory 自身的 CPU，
+抓取方越多、MBean 越多，开销越大。本脚本按固定间隔 (FETCH_INTERVAL) 拉取一次 agent，只保留 ALLOW_FAMILIES 中的指标族
+（内存池、GC、线程、Tomcat 连接器线程池、数据库连接池等），缓存后提供给任意数量的 Prometheus 抓取:
+nohup python3 jmx_relay.py &
+
+生成只采集上述 MBean 的 jmx_config.yaml（替代 pattern: ".*"）:
+python3 jmx_relay.py --generate-config > /opt/jf_monitoring_node/jmx_config.yaml
+"""
+
+import argparse
+import gzip
+import logging
+import re
+import threading
+import time
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from metrics_http import OPENMETRICS_TYPE, PROMETHEUS_TYPE, MetricsCache, filter_families
+
+# ========== Configuration ==========
+UPSTREAM_URL = 'http://localhost:30013/metrics'  # jmx_prometheus_javaagent 地址
+AGENT_VERSION = '0.17.2'  # --generate-config 默认的 agent 版本（与 jf_monitoring_node/ 下附带的 jar 一致）
+RELAY_PORT = 30014
+FETCH_INTERVAL = 15  # 拉取 agent 的间隔（秒），与抓取方数量无关
+FETCH_TIMEOUT = 10
+STALE_AFTER = 3  # 连续多少个间隔拉取失败后不再输出缓存的 JVM 指标
+GZIP_MIN_SIZE = 1024  # 客户端支持 gzip 且输出超过此字节数时压缩
+
+# 保留的指标族（正则，完整匹配族名）
+ALLOW_FAMILIES = [
+    r'jvm_info',
+    r'jvm_memory_.*',             # 堆/非堆及各内存池
+    r'jvm_buffer_pool_.*',
+    r'jvm_gc_.*',
+    r'jvm_threads_.*',
+    r'jvm_classes_.*',
+    r'process_.*',
+    r'java_lang_operatingsystem_.*',
+    r'catalina_threadpool_.*',    # Tomcat 连接器线程池
+    r'com_zaxxer_hikari_.*',      # Hikari 连接池
+    r'org_jfrog_artifactory_.*',  # Artifactory 存储（数据库连接池）
+    r'jmx_scrape_.*',
+]
+
+# jmx_config.yaml 中采集的 MBean: (ObjectName 模式, 属性匹配规则)
+# 规则不设置 name，指标名与 pattern: ".*" 时相同，Dashboard 无需修改；
+# 内存池、GC、线程、类加载由 agent 内置的 JVM 采集器导出 (jvm_*)，不需要遍历对应的 MBean
+JMX_RULES = [
+    ('java.lang:type=OperatingSystem', r'java.lang<type=OperatingSystem><>(\w+)'),
+    ('Catalina:type=ThreadPool,*',
+     r'Catalina<type=ThreadPool, name=.+><>(currentThreadCount|currentThreadsBusy|maxThreads|connectionCount|maxConnections|keepAliveCount)'),
+    ('com.zaxxer.hikari:*',
+     r'com.zaxxer.hikari<type=Pool \(.+\)><>(ActiveConnections|IdleConnections|TotalConnections|ThreadsAwaitingConnection)'),
+    ('org.jfrog.artifactory:type=Storage,*', r'org.jfrog.artifactory<.*type=Storage.*><>(\w+)'),
+]
+# ===================================
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def generate_config(agent_version=AGENT_VERSION) -> str:
+    """
+    生成 jmx_config.yaml；0.18 之前的 agent 只识别 whitelistObjectNames，之后为 includeObjectNames，
+    agent_version 为 'any' 时两个键都输出（各版本忽略不认识的键），同一份配置可用于任一版本的 agent
+    """
+    if agent_version == 'any':
+        keys = ['whitelistObjectNames', 'includeObjectNames']
+    else:
+        major, minor = (int(x) for x in agent_version.split('.')[:2])
+        keys = ['includeObjectNames' if (major, minor) >= (0, 18) else 'whitelistObjectNames']
+    lines = [
+        '---',
+        'lowercaseOutputLabelNames: true',
+        'lowercaseOutputName: true',
+        '',
+    ]
+    for key in keys:
+        lines.append(f'{key}:')
+        lines += [f'  - "{object_name}"' for object_name, _ in JMX_RULES]
+        lines.append('')
+    lines.append('rules:')
+    lines += [f"- pattern: '{pattern}'" for _, pattern in JMX_RULES]
+    return '\n'.join(lines) + '\n'
+
+class JmxRelay:
+    def __init__(self, url=UPSTREAM_URL):
+        self.url = url
+        self.lock = threading.Lock()
+        self.allow = re.compile('|'.join(f'(?:{p})' for p in ALLOW_FAMILIES))
+        self.allowed = {}  # 族名 -> 是否保留
+        self.text = ''
+        self.last_success = 0
+        # 每次拉取后加 1，/metrics 据此判断缓存的输出是否过期
+        self.version = 0
+        # 拉取自身的指标
+        self.up = 0
+        self.fetch_duration = 0.0
+        self.fetch_bytes = 0
+        self.families_kept = 0
+        self.families_dropped = 0
+        self.fetch_errors = 0
+
+    def is_allowed(self, family):
+        allowed = self.allowed.get(family)
+        if allowed is None:
+            allowed = self.allowed[family] = self.allow.fullmatch(family) is not None
+        return allowed
+
+    def fetch(self):
+        start = time.perf_counter()
+        request = urllib.request.Request(self.url, headers={'Accept-Encoding': 'gzip'})
+        with urllib.request.urlopen(request, timeout=FETCH_TIMEOUT) as response:
+            body = response.read()
+            if response.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+        text, kept, dropped = filter_families(body.decode('utf-8', 'ignore'), self.is_allowed)
+        with self.lock:
+            self.text = text
+            self.last_success = time.time()
+            self.up = 1
+            self.fetch_duration = time.perf_counter() - start
+            self.fetch_bytes = len(body)
+            self.families_kept = kept
+            self.families_dropped = dropped
+            self.version += 1
+
+    def run(self):
+        while True:
+            started = time.time()
+            try:
+                self.fetch()
+            except Exception as e:
+                logger.error(f"Fetch {self.url} failed: {e}")
+                with self.lock:
+                    self.up = 0
+                    self.fetch_errors += 1
+                    self.version += 1
+            time.sleep(max(0, FETCH_INTERVAL - (time.time() - started)))
+
+    def generate_metrics(self) -> str:
+        with self.lock:
+            fresh = time.time() - self.last_success < FETCH_INTERVAL * STALE_AFTER
+            text = self.text if fresh else ''
+            m = [
+                '# HELP jmx_relay_upstream_up Whether the last fetch from the JMX agent succeeded',
+                '# TYPE jmx_relay_upstream_up gauge',
+                f'jmx_relay_upstream_up {self.up}',
+                '# HELP jmx_relay_fetch_duration_seconds Duration of the last successful fetch from the JMX agent',
+                '# TYPE jmx_relay_fetch_duration_seconds gauge',
+                f'jmx_relay_fetch_duration_seconds {round(self.fetch_duration, 6)}',
+                '# HELP jmx_relay_fetch_bytes Size of the last response from the JMX agent',
+                '# TYPE jmx_relay_fetch_bytes gauge',
+                f'jmx_relay_fetch_bytes {self.fetch_bytes}',
+                '# HELP jmx_relay_families Metric families in the last response by action',
+                '# TYPE jmx_relay_families gauge',
+                f'jmx_relay_families{{action="kept"}} {self.families_kept}',
+                f'jmx_relay_families{{action="dropped"}} {self.families_dropped}',
+                '# HELP jmx_relay_fetch_errors_total Failed fetches from the JMX agent',
+                '# TYPE jmx_relay_fetch_errors_total counter',
+                f'jmx_relay_fetch_errors_total {self.fetch_errors}',
+                '# HELP jmx_relay_last_success_timestamp_seconds Time of the last successful fetch',
+                '# TYPE jmx_relay_last_success_timestamp_seconds gauge',
+                f'jmx_relay_last_success_timestamp_seconds {self.last_success}',
+            ]
+        if text:
+            m.append(text)
+        return '\n'.join(m)
+
+# ========== /metrics 输出 ==========
+class MetricsHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持 keep-alive，Prometheus 可复用连接
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body, compressed = metrics_cache.get(openmetrics, 'gzip' in self.headers.get('Accept-Encoding', ''))
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            if compressed:
+                self.send_header('Content-Encoding', 'gzip')
+        else:
+            body = b"OK"
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    def log_message(self, format, *args): return
+
+def main():
+    global metrics_cache
+    parser = argparse.ArgumentParser(description='Filtering, caching relay for jmx_prometheus_javaagent')
+    parser.add_argument('--generate-config', action='store_true', help='输出精简后的 jmx_config.yaml 并退出')
+    parser.add_argument('--agent-version', default=AGENT_VERSION,
+                        help="jmx_prometheus_javaagent 版本，决定配置文件的键名；'any' 同时输出两种键名")
+    parser.add_argument('--upstream', default=UPSTREAM_URL, help='jmx_prometheus_javaagent 的 /metrics 地址')
+    parser.add_argument('--port', type=int, default=RELAY_PORT)
+    args = parser.parse_args()
+
+    if args.generate_config:
+        print(generate_config(args.agent_version), end='')
+        return
+
+    relay = JmxRelay(args.upstream)
+    threading.Thread(target=relay.run, daemon=True).start()
+    metrics_cache = MetricsCache(relay.generate_metrics, lambda: relay.version, GZIP_MIN_SIZE)
+    server = ThreadingHTTPServer(('0.0.0.0', args.port), MetricsHandler)
+    server.daemon_threads = True
+    logger.info(f"JMX relay for {args.upstream} started on port {args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
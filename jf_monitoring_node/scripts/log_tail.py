@@ -0,0 +1,296 @@
+"""
+artifactory_request_exporter.py 与 s3_connection_exporter.py 共用的日志跟踪部分：等待日志新内容和轮转的 FileWatcher
+（inotify，不可用时退避轮询）、读取位置及其检查点 TailPosition、日志时间戳解析，以及 exporter 自身的运行指标 ExporterStats。
+部署时与 exporter 脚本（及 jf_node_agent.py）放在同一目录；在仓库中直接运行时 exporter 从 jf_monitoring_node/scripts/ 导入。
+"""
+
+import calendar
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import time
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+LOG_TIME_CACHE = {}  # 最近一次解析的 "到秒" 时间前缀 -> 秒
+
+def log_time(ts: bytes):
+    """日志第 0 列 2026-10-18T08:00:00.123Z (UTC) -> 秒；同一秒内只解析一次"""
+    cache = LOG_TIME_CACHE
+    prefix = ts[:19]
+    sec = cache.get(prefix)
+    if sec is None:
+        try:
+            sec = calendar.timegm(time.strptime(prefix.decode('ascii'), '%Y-%m-%dT%H:%M:%S'))
+        except (UnicodeDecodeError, ValueError):
+            return None
+        cache.clear()
+        cache[prefix] = sec
+    try:
+        return sec + int(ts[20:23]) / 1000
+    except ValueError:
+        return sec
+
+class ExporterStats:
+    """
+    exporter 自身的运行指标。读取/解析相关的计数只由日志跟踪线程更新，锁等待时间在 exporter 的统计锁内累加；
+    所有 key 预先创建（parse_error_reasons 为各 exporter 的解析错误原因），渲染线程遍历时字典大小不会变化。
+    """
+    def __init__(self, parse_error_reasons):
+        self.lines_read = 0
+        self.bytes_read = 0
+        self.parse_errors = {reason: 0 for reason in parse_error_reasons}
+        self.rotations = {'rotate': 0, 'truncate': 0}
+        self.lock_wait = {'ingest': 0.0, 'render': 0.0}  # 等待统计锁的累计秒数
+        self.render_count = 0
+        self.render_seconds = 0.0
+        self.last_line_time = None  # 最近读到的一行日志的时间戳 (秒)
+        self.tailer = None          # LogTailer 启动时登记自己，用于计算读取延迟
+
+    def tail_lag(self):
+        """返回 (落后字节数, 落后秒数)；未开始读取时为 None"""
+        tailer = self.tailer
+        if tailer is None or tailer.inode is None:
+            return None
+        try:
+            st = os.stat(tailer.log_file)
+        except OSError:
+            return None
+        # 文件已被轮转但尚未重新打开时，新文件的全部内容都还没有读
+        lag_bytes = max(st.st_size - tailer.offset, 0) if st.st_ino == tailer.inode else st.st_size
+        if not lag_bytes or self.last_line_time is None:
+            return lag_bytes, 0.0
+        return lag_bytes, max(time.time() - self.last_line_time, 0.0)
+
+    def lag_key(self):
+        """tail_lag 按秒取整，作为 /metrics 缓存键的一部分：读取落后时落后量变化即重新渲染，追平后不影响缓存"""
+        lag = self.tail_lag()
+        return lag and (lag[0], int(lag[1]))
+
+# inotify 常量 (见 <sys/inotify.h>)
+IN_MODIFY = 0x00000002
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o0004000
+INOTIFY_EVENT = struct.Struct('iIII')  # wd, mask, cookie, len
+
+class FileWatcher:
+    """
+    在一个线程内等待多个日志文件出现新内容或被轮转。
+    Linux 上通过 ctypes 调用 inotify，所有文件共用一个 inotify fd：监听文件本身 (IN_MODIFY/IN_MOVE_SELF/IN_DELETE_SELF)
+    和所在目录 (IN_CREATE/IN_MOVED_TO)，轮转直接由事件判断；
+    inotify 不可用时退化为指数退避轮询 (min_interval ~ max_interval 秒)。
+    """
+    def __init__(self, paths, min_interval=0.01, max_interval=1.0):
+        self.paths = list(paths)
+        self.inodes = {path: None for path in self.paths}
+        self.sizes = {path: None for path in self.paths}
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.rotated = set()
+        self.fd = None
+        self.file_wds = {}  # 文件的 watch descriptor -> 路径
+        self.path_wds = {}  # 路径 -> 文件的 watch descriptor
+        self.dir_wds = {}   # 目录的 watch descriptor -> {文件名: 路径}
+        self._libc = None
+        self._poller = None
+        try:
+            self._init_inotify()
+            logger.info(f"Using inotify to watch {', '.join(self.paths)}")
+        except Exception as e:
+            self.close()
+            logger.info(f"inotify unavailable ({e}), falling back to polling {', '.join(self.paths)}")
+
+    def _init_inotify(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        self._libc = libc
+        self.fd = fd
+        directories = defaultdict(dict)
+        for path in self.paths:
+            directories[os.path.dirname(path) or '.'][os.fsencode(os.path.basename(path))] = path
+        for directory, names in directories.items():
+            self.dir_wds[self._add_watch(directory, IN_CREATE | IN_MOVED_TO)] = names
+        self._poller = select.poll()
+        self._poller.register(fd, select.POLLIN)
+
+    def _add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def _inode_changed(self, path):
+        try:
+            return os.stat(path).st_ino != self.inodes[path]
+        except FileNotFoundError:
+            return self.inodes[path] is not None
+
+    def track(self, path, f):
+        """登记 path 当前打开的日志文件，每次 (重新) 打开后调用"""
+        st = os.fstat(f.fileno())
+        self.inodes[path] = st.st_ino
+        self.sizes[path] = st.st_size
+        self.interval = self.min_interval
+        self.rotated.discard(path)
+        if self.fd is None:
+            return
+        old_wd = self.path_wds.pop(path, None)
+        if old_wd is not None:
+            self.file_wds.pop(old_wd, None)
+            self._libc.inotify_rm_watch(self.fd, old_wd)
+        wd = self._add_watch(path, IN_MODIFY | IN_MOVE_SELF | IN_DELETE_SELF)
+        self.file_wds[wd] = path
+        self.path_wds[path] = wd
+        # 打开与添加监听之间文件可能已被替换
+        if self._inode_changed(path):
+            self.rotated.add(path)
+
+    def wait(self, timeout=1.0):
+        """阻塞直到有文件变化或超时，返回被轮转（需要重新打开）或新出现的文件路径集合"""
+        if self.rotated:
+            rotated, self.rotated = self.rotated, set()
+            return rotated
+        if self.fd is None:
+            return self._poll_wait(timeout)
+
+        if not self._poller.poll(timeout * 1000):
+            return set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return set()
+
+        rotated = set()
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                rotated.update(path for path in self.paths if self._inode_changed(path))
+            elif wd in self.file_wds and mask & (IN_MOVE_SELF | IN_DELETE_SELF):
+                rotated.add(self.file_wds[wd])
+            elif wd in self.dir_wds and name in self.dir_wds[wd]:
+                # 同名新文件出现；事件可能晚于重新打开到达，需确认 inode 确实变了
+                path = self.dir_wds[wd][name]
+                if self._inode_changed(path):
+                    rotated.add(path)
+        return rotated
+
+    def _poll_wait(self, timeout):
+        time.sleep(min(self.interval, timeout))
+        rotated = set()
+        changed = False
+        for path in self.paths:
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                if self.inodes[path] is not None:
+                    rotated.add(path)
+                continue
+            if st.st_ino != self.inodes[path]:
+                rotated.add(path)
+            elif st.st_size != self.sizes[path]:
+                self.sizes[path] = st.st_size
+                changed = True
+        if rotated or changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return rotated
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+        self.file_wds = {}
+        self.path_wds = {}
+        self.dir_wds = {}
+
+    def forget(self, path):
+        """path 当前不存在（未打开），等它重新出现时再报告"""
+        self.inodes[path] = None
+        self.sizes[path] = None
+        self.rotated.discard(path)
+
+class TailPosition:
+    """
+    日志文件的读取位置 (inode, offset) 及其检查点，exporter 的 LogTailer 继承本类并在读取时更新 offset。
+    checkpoint_file 中持久化的位置在重启后由 load_checkpoint 恢复；checkpoint_file 为 None 则不持久化。
+    """
+    def __init__(self, log_file, checkpoint_file=None, checkpoint_interval=5):
+        self.log_file = log_file
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval  # 检查点最短写入间隔（秒）
+        # 当前读取位置：inode 为 None 表示从未读过（首次部署），打开时跳到末尾
+        self.inode = None
+        self.offset = 0
+        self.saved_position = None
+        self.last_checkpoint = 0
+
+    def load_checkpoint(self):
+        if not self.checkpoint_file:
+            return
+        try:
+            with open(self.checkpoint_file) as f:
+                data = json.load(f)
+            self.inode = int(data['inode'])
+            self.offset = int(data['offset'])
+            self.saved_position = (self.inode, self.offset)
+            logger.info(f"Loaded checkpoint inode={self.inode} offset={self.offset}")
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"Ignoring invalid checkpoint {self.checkpoint_file}: {e}")
+
+    def save_checkpoint(self, force=False):
+        """原子写入 (inode, offset)，按 checkpoint_interval 限频"""
+        position = (self.inode, self.offset)
+        if not self.checkpoint_file or position == self.saved_position:
+            return
+        now = time.time()
+        if not force and now - self.last_checkpoint < self.checkpoint_interval:
+            return
+        tmp = self.checkpoint_file + '.tmp'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump({'inode': self.inode, 'offset': self.offset}, f)
+            os.replace(tmp, self.checkpoint_file)
+            self.saved_position = position
+            self.last_checkpoint = now
+        except OSError as e:
+            logger.warning(f"Failed to write checkpoint: {e}")
+
+    def seek_start_position(self, f, created=False):
+        """
+        决定打开文件后的起始位置：
+        - 同一 inode 且偏移仍有效：从检查点/上次位置继续
+        - 从未读过：跳到末尾；但启动后才出现的文件（created）从头读取
+        - 否则（文件已轮转或被截断）：从头读取
+        """
+        st = os.fstat(f.fileno())
+        if self.inode == st.st_ino and self.offset <= st.st_size:
+            f.seek(self.offset)
+        elif self.inode is None and not created:
+            f.seek(0, 2)
+        else:
+            logger.info(f"{self.log_file} changed since last read, reading from offset 0")
+            f.seek(0)
+        self.inode = st.st_ino
+        self.offset = f.tell()
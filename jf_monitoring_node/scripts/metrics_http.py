@@ -0,0 +1,132 @@
+"""
+jf_monitoring_node/scripts 下各脚本共用的 /metrics 输出：Prometheus 文本格式转换为 OpenMetrics、按版本缓存渲染结果，
+以及 relay 使用的按指标族过滤。
+jmx_relay.py、artifactory_metrics_relay.py、jf_node_agent.py 从同一目录导入，部署时与这些脚本放在一起。
+"""
+
+import gzip
+import threading
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+# 样本名相对于族名（HELP/TYPE 中的名字）可能带的后缀
+SAMPLE_SUFFIXES = ('_total', '_bucket', '_sum', '_count', '_created')
+
+def sample_family(name, family):
+    """样本名为 family 本身或 family 加上 SAMPLE_SUFFIXES 之一时属于该族，返回 family；否则返回样本名"""
+    if family is not None and name.startswith(family) and (len(name) == len(family) or name[len(family):] in SAMPLE_SUFFIXES):
+        return family
+    return name
+
+def filter_families(text, is_allowed):
+    """
+    按族过滤 Prometheus 文本格式，is_allowed(族名) 决定是否保留；返回 (保留的文本, 保留的族数, 丢弃的族数)。
+    0.17 版 jmx agent 的标签以逗号结尾 {gc="G1 Young Generation",}，OpenMetrics 不允许，输出时去掉。
+    """
+    out = []
+    kept = set()
+    dropped = set()
+    family = None
+    keep = False
+    for line in text.split('\n'):
+        if not line:
+            continue
+        if line.startswith('#'):
+            parts = line.split(' ', 3)
+            if len(parts) < 3 or parts[1] not in ('HELP', 'TYPE'):
+                continue
+            name = parts[2]
+        else:
+            # 样本值和时间戳中没有 }，最后一个 } 即标签的结束
+            end = line.rfind('}')
+            if end > 0 and line[end - 1] == ',':
+                line = line[:end - 1] + line[end:]
+            name = sample_family(line.split('{', 1)[0].split(' ', 1)[0], family)
+        if name != family:
+            family = name
+            keep = is_allowed(family)
+            (kept if keep else dropped).add(family)
+        if keep:
+            out.append(line)
+    return '\n'.join(out), len(kept), len(dropped)
+
+def to_openmetrics(text: str) -> str:
+    """
+    Prometheus 文本格式 -> OpenMetrics：
+    counter 的族名去掉 _total 后缀（样本名不变）、untyped 改为 unknown、样本时间戳由毫秒改为秒、去掉空行并以 # EOF 结尾。
+    去掉后缀后与其它指标族重名的 counter（如 artifactory_traffic_bytes_total 与 gauge artifactory_traffic_bytes）
+    保留原名并声明为 unknown 类型。
+    """
+    lines = [line for line in text.split('\n') if line]
+    families = set()
+    counters = []
+    for line in lines:
+        if line.startswith('# TYPE '):
+            _, _, name, kind = line.split(' ')
+            families.add(name)
+            if kind == 'counter' and name.endswith('_total'):
+                counters.append(name)
+    renamed = {name: name[:-len('_total')] for name in counters if name[:-len('_total')] not in families}
+    out = []
+    for line in lines:
+        if line.startswith('#'):
+            parts = line.split(' ', 3)
+            if len(parts) > 3 and parts[2] in counters:
+                if parts[2] in renamed:
+                    parts[2] = renamed[parts[2]]
+                elif parts[1] == 'TYPE':
+                    parts[3] = 'unknown'
+                line = ' '.join(parts)
+            elif len(parts) > 3 and parts[1] == 'TYPE' and parts[3] == 'untyped':
+                parts[3] = 'unknown'
+                line = ' '.join(parts)
+        else:
+            parts = line.rsplit(' ', 2)
+            if len(parts) == 3:
+                try:
+                    float(parts[1])
+                    line = f'{parts[0]} {parts[1]} {int(parts[2]) / 1000}'
+                except ValueError:
+                    pass
+        out.append(line)
+    out.append('# EOF\n')
+    return '\n'.join(out)
+
+class MetricsCache:
+    """
+    缓存渲染好的 /metrics 输出。version() 的返回值不变时直接复用，不再获取采集数据的锁；
+    编码后的字节按 (OpenMetrics, gzip) 组合分别缓存，输出不小于 gzip_min_size 字节时才压缩。同一时刻只有一个线程重新渲染，
+    已有缓存时其它抓取请求不等待，直接返回上一份输出。
+    """
+    def __init__(self, render, version, gzip_min_size=1024):
+        self.render = render
+        self.version = version
+        self.gzip_min_size = gzip_min_size
+        self.lock = threading.Lock()
+        self.rebuild_lock = threading.Lock()
+        self.key = None
+        self.text = None
+        self.bodies = {}
+
+    def get(self, openmetrics=False, accept_gzip=False):
+        """返回 (body, 是否 gzip 压缩)"""
+        key = self.version()
+        if key != self.key and self.rebuild_lock.acquire(blocking=self.text is None):
+            try:
+                if key != self.key:
+                    text = self.render()
+                    with self.lock:
+                        self.key, self.text, self.bodies = key, text, {}
+            finally:
+                self.rebuild_lock.release()
+        with self.lock:
+            text, bodies = self.text, self.bodies
+        fmt = (openmetrics, accept_gzip and len(text) >= self.gzip_min_size)
+        body = bodies.get(fmt)
+        if body is None:
+            body = (to_openmetrics(text) if openmetrics else text + '\n').encode('utf-8')
+            if fmt[1]:
+                body = gzip.compress(body, compresslevel=6)
+            bodies[fmt] = body
+        return body, fmt[1]